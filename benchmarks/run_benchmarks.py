@@ -0,0 +1,183 @@
+"""Time the scan and apply paths on a synthetic theme and write the results as JSON.
+
+    python run_benchmarks.py --files 10000 --repeat 3 --output results.json
+
+Qt benchmarks (worker threads, table population) run under the offscreen
+platform and are skipped when PyQt5 is not installed.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from synthetic_theme import generate_theme
+from discovery import discover_files, select_entries
+from scan_index import scan_directory
+from color_table import ColorTable
+from clustering import cluster_colors
+from replacer import ColorReplacer, replace_in_files
+
+try:
+    from PyQt5.QtWidgets import QApplication
+except ImportError:
+    QApplication = None
+
+DEFAULT_FILETYPES = ['.css', '.scss', '.less', '.svg']
+MAPPED_COLORS = 50  # Number of colors remapped by the apply benchmarks
+
+
+def timed(function, repeat, setup=None):
+    """Run function repeat times, returning the wall times in seconds."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summary(times):
+    return {'times': times, 'best': min(times), 'median': statistics.median(times)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(files, repeat, seed, workers):
+    work_directory = tempfile.mkdtemp(prefix='color_changer_bench_')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(work_directory, 'cache')  # Keep the scan index out of the user's cache
+    source = os.path.join(work_directory, 'source')
+    tree = os.path.join(work_directory, 'theme')
+    results = {}
+
+    try:
+        generate_theme(source, files, seed)
+        shutil.copytree(source, tree)
+
+        def fresh_tree():
+            shutil.rmtree(tree)
+            for backup in os.listdir(work_directory):
+                if '_backup_' in backup:
+                    shutil.rmtree(os.path.join(work_directory, backup))
+            shutil.copytree(source, tree)
+
+        manifest = discover_files(tree)
+        entries = select_entries(manifest, DEFAULT_FILETYPES)
+        results['discover_files'] = summary(timed(lambda: discover_files(tree), repeat))
+        results['scan_serial'] = summary(timed(lambda: scan_directory(tree, entries, 1, False), repeat))
+        results['scan_serial_no_prefetch'] = summary(timed(lambda: scan_directory(tree, entries, 1, False,
+                                                                                  io_threads=0), repeat))
+        if workers > 1:
+            results['scan_parallel'] = summary(timed(lambda: scan_directory(tree, entries, workers, False), repeat))
+        scan_directory(tree, entries, 1, True)  # Fill the index
+        results['scan_index_warm'] = summary(timed(lambda: scan_directory(tree, entries, 1, True), repeat))
+
+        colors, file_table = scan_directory(tree, entries, 1, False)
+        mappings = {color: '#000000' for color in sorted(colors)[:MAPPED_COLORS]}
+
+        def convert_colors():
+            table = ColorTable()
+            table.alternatives(table.extend(list(colors)))
+            table.groups()
+
+        results['color_table'] = summary(timed(convert_colors, repeat))
+        results['cluster_colors'] = summary(timed(lambda: cluster_colors(colors), repeat))
+
+        def apply(sync):
+            def run():
+                replace_in_files(ColorReplacer(mappings), [entry.path for entry in entries], sync=sync)
+            return run
+
+        results['replace_in_files'] = summary(timed(apply(True), repeat, fresh_tree))
+        results['replace_in_files_no_sync'] = summary(timed(apply(False), repeat, fresh_tree))
+
+        if QApplication is None:
+            results['qt'] = 'skipped, PyQt5 is not installed'
+            return results, len(manifest), len(colors)
+
+        from worker_threads import ColorScanWorkerThread, WorkerThread
+        from color_model import ColorTableModel
+        from PyQt5.QtWidgets import QTableView
+
+        app = QApplication.instance() or QApplication([])
+
+        def scan_worker():
+            ColorScanWorkerThread(tree, manifest, DEFAULT_FILETYPES, 1, False).run()
+
+        def apply_worker(backup):
+            def run():
+                WorkerThread(colors, tree, mappings, DEFAULT_FILETYPES, discover_files(tree), backup).run()
+            return run
+
+        def populate_table():
+            view = QTableView()
+            model = ColorTableModel(view)
+            view.setModel(model)
+            view.show()
+            model.update_colors(colors)
+            app.processEvents()
+            view.close()
+
+        results['ColorScanWorkerThread.run'] = summary(timed(scan_worker, repeat))
+        results['WorkerThread.run'] = summary(timed(apply_worker(False), repeat, fresh_tree))
+        results['WorkerThread.run_with_backup'] = summary(timed(apply_worker(True), repeat, fresh_tree))
+        results['table_population'] = summary(timed(populate_table, repeat))
+        return results, len(manifest), len(colors)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scan and apply paths.')
+    parser.add_argument('--files', type=int, default=1000, help='size of the synthetic theme, 100 to 100000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes for the parallel scan')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    results, file_count, color_count = run_benchmarks(args.files, args.repeat, args.seed, args.workers)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'files': file_count,
+            'colors': color_count,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+
+    for name, result in results.items():
+        if isinstance(result, dict):
+            print(f"{name:32} best {result['best']:.3f}s  median {result['median']:.3f}s")
+        else:
+            print(f"{name:32} {result}")
+
+
+if __name__ == '__main__':
+    main()
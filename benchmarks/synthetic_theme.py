@@ -0,0 +1,117 @@
+"""Deterministic generator for synthetic GTK themes and icon sets.
+
+    python synthetic_theme.py OUTPUT_DIRECTORY --files 1000 [--seed 0]
+
+The tree mixes CSS/SCSS files with @define-color blocks, heavily colored
+SVG icons and a few files of experimental types (.json, .js, .xml), in
+roughly the proportions of a real theme plus its icon set.
+"""
+import argparse
+import os
+import random
+
+STYLESHEET_SHARE = 0.1  # Fraction of files that are CSS/SCSS
+EXPERIMENTAL_SHARE = 0.05  # Fraction of files of experimental types
+FILES_PER_DIRECTORY = 200
+PALETTE_SIZE = 400  # Named colors shared between stylesheets and icons
+
+
+def random_color(rng):
+    """Return a hex, short hex, rgb() or rgba() color."""
+    kind = rng.random()
+    if kind < 0.6:
+        return f"#{rng.randrange(1 << 24):06x}"
+    if kind < 0.75:
+        return f"#{rng.randrange(1 << 12):03X}"
+    r, g, b = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+    if kind < 0.9:
+        return f"rgb({r}, {g}, {b})"
+    return f"rgba({r}, {g}, {b}, {rng.choice(['0.1', '0.25', '0.5', '0.8'])})"
+
+
+def stylesheet(rng, palette, index):
+    lines = ["/* Generated stylesheet */"]
+    for name, color in rng.sample(palette, 20):
+        lines.append(f"@define-color {name}_{index} {color};")
+    lines.append("")
+    for selector in range(40):
+        name, color = rng.choice(palette)
+        lines.append(f".widget-{index}-{selector} {{ color: @{name}; background-color: {color}; "
+                     f"border-color: {random_color(rng)}; }}")
+    return "\n".join(lines) + "\n"
+
+
+def scss(rng, palette, index):
+    lines = [f"${name}: {color};" for name, color in rng.sample(palette, 20)]
+    for selector in range(30):
+        name, color = rng.choice(palette)
+        lines.append(f".item-{index}-{selector} {{ color: ${name}; fill: {color}; }}")
+    return "\n".join(lines) + "\n"
+
+
+def svg_icon(rng, palette):
+    shapes = []
+    for shape in range(rng.randrange(5, 30)):
+        fill = rng.choice(palette)[1] if rng.random() < 0.5 else random_color(rng)
+        stroke = random_color(rng)
+        if rng.random() < 0.3:
+            shapes.append(f'<path style="fill:{fill};stroke:{stroke}" d="M{shape} 0h16v16H0z"/>')
+        else:
+            shapes.append(f'<rect x="{shape}" y="0" width="16" height="16" fill="{fill}" stroke="{stroke}"/>')
+    stops = "".join(f'<stop offset="{i / 2}" stop-color="{random_color(rng)}"/>' for i in range(3))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16">\n'
+            f'<defs><linearGradient id="g">{stops}</linearGradient></defs>\n'
+            + "\n".join(shapes) + "\n</svg>\n")
+
+
+def experimental_file(rng, palette, index):
+    kind = rng.choice(['.json', '.js', '.xml'])
+    colors = [rng.choice(palette)[1] for _ in range(20)]
+    if kind == '.json':
+        content = "{" + ", ".join(f'"color{i}": "{color}"' for i, color in enumerate(colors)) + "}\n"
+    elif kind == '.js':
+        content = "".join(f"export const c{i} = '{color}';\n" for i, color in enumerate(colors))
+    else:
+        content = "<colors>" + "".join(f'<color value="{color}"/>' for color in colors) + "</colors>\n"
+    return f"data-{index}{kind}", content
+
+
+def generate_theme(directory, files=1000, seed=0):
+    """Write a synthetic theme with the given number of files, returns the list of paths."""
+    rng = random.Random(seed)
+    palette = [(f"color_{i}", random_color(rng)) for i in range(PALETTE_SIZE)]
+    paths = []
+
+    for index in range(files):
+        subdirectory = os.path.join(directory, f"part{index // FILES_PER_DIRECTORY:04d}")
+        os.makedirs(subdirectory, exist_ok=True)
+
+        kind = rng.random()
+        if kind < STYLESHEET_SHARE / 2:
+            name, content = f"gtk-{index}.css", stylesheet(rng, palette, index)
+        elif kind < STYLESHEET_SHARE:
+            name, content = f"_style-{index}.scss", scss(rng, palette, index)
+        elif kind < STYLESHEET_SHARE + EXPERIMENTAL_SHARE:
+            name, content = experimental_file(rng, palette, index)
+        else:
+            name, content = f"icon-{index}.svg", svg_icon(rng, palette)
+
+        path = os.path.join(subdirectory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        paths.append(path)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic GTK theme tree.')
+    parser.add_argument('directory')
+    parser.add_argument('--files', type=int, default=1000, help='number of files, 100 to 100000')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_theme(args.directory, args.files, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import os
+import stat
+import tempfile
+import threading
+from pipeline import DEFAULT_IO_THREADS, prefetched
+
+TEMP_SUFFIX = '.recolor'  # Suffix of the hidden temporary files new contents are written to
+
+
+def copy_metadata(info, fd, temp_path):
+    """Give a temporary file the permission bits of info (an os.stat result) and, where allowed, its owner and group."""
+    os.chmod(fd if os.chmod in os.supports_fd else temp_path, stat.S_IMODE(info.st_mode))
+    if not hasattr(os, 'chown'):
+        return
+    own_info = os.fstat(fd)
+    if (own_info.st_uid, own_info.st_gid) == (info.st_uid, info.st_gid):
+        return
+    try:
+        os.chown(fd, info.st_uid, info.st_gid)
+    except PermissionError:
+        # Only root gives files away, other users can still keep the group if they belong to it
+        try:
+            os.chown(fd, -1, info.st_gid)
+        except PermissionError:
+            pass
+
+
+def target_path(file_path):
+    """Path a file is replaced at, the file a symlink points to rather than the symlink itself."""
+    return os.path.realpath(file_path) if os.path.islink(file_path) else file_path
+
+
+def sync_directory(directory):
+    """Make the renames in a directory durable, a no-op where directories cannot be opened (Windows)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class AtomicWriter:
+    """Replaces files through a temporary file in the same directory, renamed over the file once complete.
+
+    An interrupted apply leaves every file with its old or its new contents.
+    With sync the files are flushed on the writer threads and each directory
+    is synced once in close. Thread safe.
+    """
+
+    def __init__(self, sync=True, io_threads=DEFAULT_IO_THREADS):
+        self.sync = sync  # Whether contents and renames are flushed to disk
+        self.io_threads = io_threads  # Threads syncing directories in close
+        self.directories = set()  # Directories with renames not synced yet
+        self.lock = threading.Lock()
+
+    def begin(self, file_path, binary=False, metadata_path=None):
+        """Create the temporary file for the new contents of file_path, returns it opened for writing and its path.
+
+        The temporary file takes the metadata of metadata_path instead when
+        given, e.g. for a file that does not exist yet.
+        """
+        directory, name = os.path.split(target_path(file_path))
+        fd, temp_path = tempfile.mkstemp(TEMP_SUFFIX, f'.{name}.', directory or os.curdir)
+        try:
+            copy_metadata(os.stat(metadata_path or file_path), fd, temp_path)
+        except BaseException:
+            os.close(fd)
+            os.remove(temp_path)
+            raise
+        if binary:
+            return open(fd, 'wb'), temp_path
+        return open(fd, 'w', encoding='utf-8', newline=''), temp_path  # Line endings are written as read
+
+    def commit(self, temp_file, temp_path, file_path):
+        """Close a temporary file from begin and rename it over file_path."""
+        path = target_path(file_path)
+        try:
+            temp_file.flush()
+            if self.sync:
+                os.fsync(temp_file.fileno())
+            temp_file.close()
+            os.replace(temp_path, path)
+        except BaseException:
+            self.discard(temp_file, temp_path)
+            raise
+        with self.lock:
+            self.directories.add(os.path.dirname(os.path.abspath(path)))
+
+    @staticmethod
+    def discard(temp_file, temp_path):
+        """Close and remove a temporary file from begin, leaving the file it was meant for untouched."""
+        temp_file.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def write(self, file_path, content):
+        """Replace the contents of file_path with content."""
+        temp_file, temp_path = self.begin(file_path)
+        try:
+            temp_file.write(content)
+        except BaseException:
+            self.discard(temp_file, temp_path)
+            raise
+        self.commit(temp_file, temp_path, file_path)
+
+    def close(self):
+        """Sync every directory a file was renamed in, once each."""
+        with self.lock:
+            directories, self.directories = sorted(self.directories), set()
+        if self.sync:
+            for _ in prefetched(sync_directory, directories, self.io_threads):
+                pass
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from atomic import AtomicWriter
+
+SNAPSHOT_MANIFEST = 'snapshot.json'  # Written at the root of every snapshot
+
+
+class BackupSnapshot:
+    """Timestamped backup holding only the files an apply modifies.
+
+    Files are copied right before they are rewritten, into a new directory
+    created on the first save. save may be called from several writer
+    threads at once.
+    """
+
+    def __init__(self, directory, snapshot_dir=None):
+        self.directory = os.path.abspath(directory)
+        self.snapshot_dir = snapshot_dir  # Picked next to directory when the first file is saved, unless given
+        self.files = []  # Paths relative to directory
+        self.started = False  # Whether the snapshot directory was created
+        self.lock = threading.Lock()
+
+    def create(self):
+        """Create the snapshot directory, existing snapshots are never reused or removed."""
+        if self.snapshot_dir is not None:
+            os.makedirs(self.snapshot_dir)  # FileExistsError rather than mixing two snapshots
+            return
+        # Applies started within the same second get different suffixes
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.snapshot_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(self.directory)}_backup_{timestamp}_",
+                                             dir=os.path.dirname(self.directory))
+
+    def save(self, file_path):
+        """Copy a file into the snapshot before it gets modified."""
+        with self.lock:
+            if not self.started:
+                self.create()
+            self.started = True
+
+        relative_path = os.path.relpath(file_path, self.directory)
+        backup_path = os.path.join(self.snapshot_dir, relative_path)
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        shutil.copy2(file_path, backup_path)
+        with self.lock:
+            self.files.append(relative_path)
+
+    def close(self):
+        """Write the snapshot manifest, returns the snapshot directory or None if nothing was saved."""
+        if not self.files:
+            return None
+
+        manifest = {
+            'directory': self.directory,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'files': self.files,
+        }
+        with open(os.path.join(self.snapshot_dir, SNAPSHOT_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        return self.snapshot_dir
+
+
+def restore_snapshot(snapshot_dir):
+    """Copy the files of a snapshot back over the directory it was taken from.
+
+    Files are replaced atomically and through symlinks, like an apply
+    replaces them (see atomic.AtomicWriter). Returns the restored directory
+    and the number of files restored.
+    """
+    with open(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    directory = manifest['directory']
+    writer = AtomicWriter()
+    try:
+        for relative_path in manifest['files']:
+            backup_path = os.path.join(snapshot_dir, relative_path)
+            target_path = os.path.join(directory, relative_path)
+            exists = os.path.exists(target_path)
+            if not exists:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            # A file deleted since the backup gets the mode of its backup
+            temp_file, temp_path = writer.begin(target_path, binary=True, metadata_path=None if exists else backup_path)
+            try:
+                with open(backup_path, 'rb') as source:
+                    shutil.copyfileobj(source, temp_file)
+            except BaseException:
+                writer.discard(temp_file, temp_path)
+                raise
+            writer.commit(temp_file, temp_path, target_path)  # Never leaves a half-restored file behind
+    finally:
+        writer.close()
+
+    return directory, len(manifest['files'])
@@ -0,0 +1,300 @@
+"""Headless entry point for scanning and recoloring themes without Qt.
+
+    python cli.py scan DIRECTORY [--format json|csv] [--output FILE] [--cluster DELTA_E] [--save-scan FILE]
+    python cli.py apply DIRECTORY MAPPING_FILE [--backup] [--all-spellings] [--no-sync]
+    python cli.py undo DIRECTORY [--mapping OLD_COLOR] [--journal FILE]
+    python cli.py diff DIRECTORY MAPPING_FILE [--all-spellings]
+    python cli.py transform DIRECTORY CHAIN_FILE [--output MAPPING_FILE]
+
+Every command takes --stats FILE and --profile cprofile|tracemalloc, see
+profiling.py. Mapping files are JSON objects ({"#abc": "#123456"}) or two
+column CSV files (old,new). No display or PyQt5 installation is needed.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from backup import BackupSnapshot
+from clustering import cluster_colors
+from color_table import canonical_hex, expand_mappings
+from discovery import DEFAULT_IGNORE_GLOBS, discover_files, parse_ignore_globs, select_entries
+from journal import ApplyJournal, StaleJournal, journal_paths, undo_journal
+from pipeline import DEFAULT_IO_THREADS
+from profiling import PROFILE_MODES, RunStats, default_profile_path, profiled, save_report
+from replacer import ColorReplacer, replace_in_files
+from saved_scan import save_scan
+from scan_index import scan_directory
+from textfiles import SkippedFile
+from transforms import generate_mappings, load_chain
+from utils import is_valid_color
+
+DEFAULT_FILETYPES = ['.css', '.scss', '.less', '.svg']
+
+
+def selected_types(args):
+    return [file_type.strip() for file_type in args.types.split(',') if file_type.strip()]
+
+
+def selected_entries(args):
+    """Discover the files of the directory and keep the selected file types."""
+    with args.run_stats.phase('walk'):
+        manifest = discover_files(args.directory, parse_ignore_globs(args.ignore))
+    return select_entries(manifest, selected_types(args))
+
+
+def load_mappings(mapping_file):
+    """Read old -> new color mappings from a JSON or CSV file, skipping invalid new colors."""
+    with open(mapping_file, 'r', encoding='utf-8', newline='') as f:
+        if mapping_file.lower().endswith('.json'):
+            raw_mappings = json.load(f)
+        else:
+            raw_mappings = {row[0].strip(): row[1].strip() for row in csv.reader(f) if len(row) >= 2}
+
+    mappings = {}
+    for old_color, new_color in raw_mappings.items():
+        if is_valid_color(new_color):
+            mappings[old_color] = new_color
+        else:
+            print(f"Skipping invalid color {new_color!r} for {old_color}", file=sys.stderr)
+    return mappings
+
+
+def selected_mappings(args, entries):
+    """Load the mapping file, scanning for equivalent spellings of the mapped colors if asked to."""
+    mappings = load_mappings(args.mapping_file)
+    if args.all_spellings and mappings:
+        color_definitions, file_table = scan_directory(args.directory, entries, stats=args.run_stats,
+                                                       io_threads=args.io_threads)
+        mappings = expand_mappings(mappings, color_definitions)
+    return mappings
+
+
+def color_rows(color_definitions, file_table, directory, with_sites, clusters=None):
+    """Flatten scanned color records into dicts for JSON or CSV output.
+
+    With clusters (see clustering.cluster_colors) each row names the
+    representative color of its cluster.
+    """
+    representatives = {member: representative for representative, members in (clusters or {}).items()
+                       for member in members}
+    rows = []
+    for color_value, record in sorted(color_definitions.items()):
+        alternative = record.alternative
+        row = {
+            'value': color_value,
+            'name': record.name,
+            'alternative': list(alternative) if isinstance(alternative, tuple) else alternative,
+            'canonical': canonical_hex(record.key) if record.key is not None else None,
+            'usage_count': record.usage_count,
+            'line': record.line,
+        }
+        if clusters is not None:
+            row['cluster'] = representatives[color_value]
+        if with_sites:
+            row['sites'] = [{'file': os.path.relpath(file_table.paths[file_id], directory), 'line': line_number}
+                            for file_id, line_number, offset in record.usage_sites()]
+        rows.append(row)
+    return rows
+
+
+def command_scan(args):
+    entries = selected_entries(args)
+    color_definitions, file_table = scan_directory(args.directory, entries, args.workers, not args.no_index,
+                                                   args.run_stats, args.io_threads)
+    if args.save_scan:
+        with args.run_stats.phase('save'):
+            save_scan(args.save_scan, args.directory, selected_types(args), entries, color_definitions, file_table)
+    clusters = cluster_colors(color_definitions, args.cluster) if args.cluster else None
+    rows = color_rows(color_definitions, file_table, args.directory, args.sites and args.format == 'json', clusters)
+
+    output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            fieldnames = ['value', 'name', 'alternative', 'canonical', 'usage_count', 'line']
+            writer = csv.DictWriter(output, fieldnames=fieldnames + ['cluster'] if clusters is not None else fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, output, indent=1)
+            output.write('\n')
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+def command_apply(args):
+    entries = selected_entries(args)
+    replacer = ColorReplacer(selected_mappings(args, entries))
+    file_paths = [entry.path for entry in entries] if replacer.mappings else []
+    stats = args.run_stats
+    stats.add_entries(entries if replacer.mappings else [])
+
+    snapshot = BackupSnapshot(args.directory) if args.backup else None
+    journal = ApplyJournal(args.directory, replacer.mappings)
+    try:
+        report = replace_in_files(replacer, file_paths, stats.timed('backup', snapshot.save) if snapshot else None,
+                                  stats=stats, io_threads=args.io_threads, journal=journal, sync=not args.no_sync)
+    finally:
+        with stats.phase('backup'):
+            backup_dir = snapshot.close() if snapshot else None
+        with stats.phase('journal'):
+            journal_path = journal.close()
+    report['backup_dir'] = backup_dir
+    report['journal'] = journal_path
+
+    json.dump(report, sys.stdout, indent=1)
+    sys.stdout.write('\n')
+    return 0
+
+
+def command_diff(args):
+    entries = selected_entries(args)
+    replacer = ColorReplacer(selected_mappings(args, entries))
+    if not replacer.mappings:
+        return 0
+
+    changed = False
+    args.run_stats.add_entries(entries)
+    diff_file = args.run_stats.timed('diff', replacer.diff_file)
+    for entry in entries:
+        try:
+            diff = diff_file(entry.path, os.path.relpath(entry.path, args.directory))
+        except (SkippedFile, UnicodeDecodeError):
+            continue  # Left untouched by apply as well
+        if diff:
+            sys.stdout.write(diff)
+            changed = True
+    return 1 if changed else 0  # Like diff(1), 1 means there are differences
+
+
+def command_transform(args):
+    chain = load_chain(args.chain_file)
+    color_definitions, file_table = scan_directory(args.directory, selected_entries(args), stats=args.run_stats,
+                                                   io_threads=args.io_threads)
+    with args.run_stats.phase('transform'):
+        mappings = generate_mappings(color_definitions, chain)
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        json.dump(mappings, output, indent=1)
+        output.write('\n')
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+def command_undo(args):
+    if args.journal:
+        journal_path = args.journal
+    else:
+        journals = journal_paths(args.directory)
+        if not journals:
+            print(f"Nothing to undo in {args.directory}", file=sys.stderr)
+            return 1
+        journal_path = journals[0]
+
+    try:
+        with args.run_stats.phase('undo'):
+            directory, restored = undo_journal(journal_path, set(args.mapping) if args.mapping else None)
+    except StaleJournal as e:
+        print(f"Not undoing {journal_path}: {e}", file=sys.stderr)
+        for file_path in e.paths:
+            print(f"  {file_path}", file=sys.stderr)
+        return 1
+
+    json.dump({'directory': directory, 'files': restored, 'journal': journal_path}, sys.stdout, indent=1)
+    sys.stdout.write('\n')
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='color_changer', description='Scan and recolor theme files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_run_options(subparser):
+        subparser.add_argument('--stats', metavar='FILE', help='write per-phase timings and throughput as JSON')
+        subparser.add_argument('--profile', choices=PROFILE_MODES, help='run under cProfile or tracemalloc')
+        subparser.add_argument('--profile-output', metavar='FILE',
+                               help='where to write the profile (default: a new file in the temporary directory)')
+
+    def add_common(subparser):
+        subparser.add_argument('directory', help='theme directory')
+        subparser.add_argument('--types', default=','.join(DEFAULT_FILETYPES),
+                               help='comma separated file types (default: %(default)s)')
+        subparser.add_argument('--ignore', default=','.join(DEFAULT_IGNORE_GLOBS),
+                               help='comma separated names to skip (default: %(default)s)')
+        subparser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS, metavar='N',
+                               help='threads reading files ahead and writing them back, 0 for none '
+                                    '(default: %(default)s)')
+        add_run_options(subparser)
+
+    def add_mapping(subparser):
+        subparser.add_argument('mapping_file', help='JSON or CSV old -> new color mappings')
+        subparser.add_argument('--all-spellings', action='store_true',
+                               help='also map equivalent spellings of each old color (e.g. #abc and #AABBCC)')
+
+    scan_parser = subparsers.add_parser('scan', help='dump the color table')
+    add_common(scan_parser)
+    scan_parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    scan_parser.add_argument('--output', '-o', help='write to a file instead of stdout')
+    scan_parser.add_argument('--sites', action='store_true', help='include usage sites (JSON only)')
+    scan_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='scanning processes')
+    scan_parser.add_argument('--save-scan', metavar='FILE',
+                             help='also save the scan in binary form, the GUI opens it without rescanning')
+    scan_parser.add_argument('--no-index', action='store_true', help='ignore the persistent scan index')
+    scan_parser.add_argument('--cluster', type=float, metavar='DELTA_E',
+                             help='name the representative of each group of colors within DELTA_E of each other')
+    scan_parser.set_defaults(func=command_scan)
+
+    apply_parser = subparsers.add_parser('apply', help='apply a mapping file')
+    add_common(apply_parser)
+    add_mapping(apply_parser)
+    apply_parser.add_argument('--backup', action='store_true', help='back up the files that get modified')
+    apply_parser.add_argument('--no-sync', action='store_true',
+                              help='skip flushing the rewritten files to disk, they are still replaced atomically')
+    apply_parser.set_defaults(func=command_apply)
+
+    undo_parser = subparsers.add_parser('undo', help='undo the last apply, or some of its mappings')
+    undo_parser.add_argument('directory', help='theme directory')
+    undo_parser.add_argument('--mapping', action='append', metavar='OLD_COLOR',
+                             help='only undo the mapping of this old color, can be repeated')
+    undo_parser.add_argument('--journal', metavar='FILE', help='undo this journal instead of the last one')
+    add_run_options(undo_parser)
+    undo_parser.set_defaults(func=command_undo)
+
+    diff_parser = subparsers.add_parser('diff', help='show the changes a mapping file would make')
+    add_common(diff_parser)
+    add_mapping(diff_parser)
+    diff_parser.set_defaults(func=command_diff)
+
+    transform_parser = subparsers.add_parser('transform', help='generate a mapping file from a transform chain')
+    add_common(transform_parser)
+    transform_parser.add_argument('chain_file', help='JSON transform chain, e.g. saved from the GUI')
+    transform_parser.add_argument('--output', '-o', help='write to a file instead of stdout')
+    transform_parser.set_defaults(func=command_transform)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run_stats = stats = RunStats(args.command)
+    if args.profile:
+        stats.profile_path = args.profile_output or default_profile_path(args.command, args.profile)
+
+    with profiled(args.profile, stats.profile_path):
+        status = args.func(args)
+
+    stats.finish()
+    if args.stats:
+        save_report(stats.report(), args.stats)
+    if stats.profile_path:
+        print(f"Profile written to {stats.profile_path}", file=sys.stderr)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
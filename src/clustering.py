@@ -0,0 +1,157 @@
+import numpy as np
+from color_table import ColorTable, rgb_to_lab
+
+DEFAULT_DELTA_E = 2.3  # Roughly the smallest color difference people notice
+MAX_CANDIDATES = 1 << 22  # Candidate pairs compared at once, bounds memory for large thresholds
+DENSE_CANDIDATES = 48  # Candidates per point above which leaders query their neighbors one by one
+
+# Offsets of a grid cell and its 26 neighbors
+NEIGHBOR_OFFSETS = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)])
+
+
+def expand_ranges(starts, counts):
+    """Concatenate the index ranges [start, start + count) into one array."""
+    total = counts.sum()
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+class CellGrid:
+    """Points hashed into a grid of threshold sized cells, one grid per alpha.
+
+    Points threshold apart always lie in neighboring cells, so a radius
+    query only compares the points of 27 cells, the way a KD-tree prunes
+    its search. Points with a different alpha are never neighbors.
+    """
+
+    def __init__(self, lab, alpha, threshold):
+        cells = np.floor(lab / threshold).astype(np.int64)
+        cells -= cells.min(axis=0) - 1  # Neighbors of every cell stay inside the grid
+        span = cells.max(axis=0) + 2
+        cell_keys = ((alpha.astype(np.int64) * span[0] + cells[:, 0]) * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+
+        self.order = np.argsort(cell_keys, kind='stable')  # Points sorted by cell
+        cell_ids, self.starts, self.counts = np.unique(cell_keys[self.order], return_index=True, return_counts=True)
+        self.point_cells = np.searchsorted(cell_ids, cell_keys)  # Cell index of each point
+
+        neighbors = []
+        for dx, dy, dz in NEIGHBOR_OFFSETS.tolist():
+            neighbor_ids = cell_ids + (dx * span[1] + dy) * span[2] + dz
+            neighbor_cells = np.minimum(np.searchsorted(cell_ids, neighbor_ids), len(cell_ids) - 1)
+            neighbors.append(np.where(cell_ids[neighbor_cells] == neighbor_ids, neighbor_cells, -1))
+        self.neighbors = np.stack(neighbors, axis=1)  # Index of the 27 neighbors of each cell, -1 where empty
+        self.neighbor_counts = np.where(self.neighbors >= 0, self.counts[self.neighbors], 0)
+
+    def candidate_count(self):
+        """Number of point pairs compared when every point is queried."""
+        return int((self.neighbor_counts.sum(axis=1) * self.counts).sum())
+
+    def candidates(self, point):
+        """Return the points in the cell of point and its neighbors, point included."""
+        cells = self.neighbors[self.point_cells[point]]
+        cells = cells[cells >= 0]
+        return self.order[expand_ranges(self.starts[cells], self.counts[cells])]
+
+
+def near_pairs(lab, grid, threshold):
+    """Return (i, j) arrays of the ordered pairs of points at most threshold apart, i != j, see CellGrid."""
+    count = len(lab)
+    points = np.arange(count)
+    pairs_i, pairs_j = [np.zeros(0, np.intp)], [np.zeros(0, np.intp)]
+
+    for neighbor in range(len(NEIGHBOR_OFFSETS)):
+        # Spread the neighbor of every occupied cell to the points of the cell
+        neighbor_cells = grid.neighbors[:, neighbor]
+        starts = grid.starts[neighbor_cells][grid.point_cells]
+        counts = grid.neighbor_counts[:, neighbor][grid.point_cells]
+
+        # Compare in blocks of points so the candidate pairs fit in memory
+        cumulative = np.cumsum(counts)
+        block_start = 0
+        while block_start < count:
+            limit = (cumulative[block_start - 1] if block_start else 0) + MAX_CANDIDATES
+            block_end = max(int(np.searchsorted(cumulative, limit, 'right')), block_start + 1)
+            block = slice(block_start, block_end)
+            block_start = block_end
+
+            i = np.repeat(points[block], counts[block])
+            j = grid.order[expand_ranges(starts[block], counts[block])]
+            close = (i != j) & (((lab[i] - lab[j]) ** 2).sum(axis=1) <= threshold * threshold)
+            pairs_i.append(i[close])
+            pairs_j.append(j[close])
+
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def leader_clusters(lab, alpha, weights, threshold):
+    """Assign every point to a leader at most threshold away, returns the leader of each point.
+
+    Points are visited from the heaviest down, so clusters never chain
+    across a gradient.
+    """
+    if not len(lab):
+        return []
+    grid = CellGrid(lab, alpha, threshold)
+    order = np.argsort(-weights, kind='stable').tolist()
+
+    if grid.candidate_count() > DENSE_CANDIDATES * len(lab):
+        leaders = np.full(len(lab), -1)
+        for point in order:
+            if leaders[point] >= 0:
+                continue
+            candidates = grid.candidates(point)
+            candidates = candidates[leaders[candidates] < 0]
+            close = ((lab[candidates] - lab[point]) ** 2).sum(axis=1) <= threshold * threshold
+            leaders[candidates[close]] = point  # The leader itself is at distance 0
+        return leaders.tolist()
+
+    i, j = near_pairs(lab, grid, threshold)
+    by_point = np.argsort(i, kind='stable')
+    neighbors = j[by_point].tolist()
+    bounds = np.searchsorted(i[by_point], np.arange(len(lab) + 1)).tolist()
+
+    leaders = [-1] * len(lab)
+    for point in order:
+        if leaders[point] >= 0:
+            continue
+        leaders[point] = point
+        for neighbor in neighbors[bounds[point]:bounds[point + 1]]:
+            if leaders[neighbor] < 0:
+                leaders[neighbor] = point
+    return leaders
+
+
+def cluster_colors(color_definitions, threshold=DEFAULT_DELTA_E):
+    """Group scanned colors that are at most threshold Delta-E (CIE76) from the representative of their group.
+
+    Returns representative color value -> member color values, the
+    representative (the most used spelling of the heaviest color) listed
+    first. Equivalent spellings always share a cluster.
+    """
+    values = list(color_definitions)
+    usage = np.array([color_definitions[value].usage_count for value in values], np.float64)
+    table = ColorTable()
+    rows = table.extend(values)
+    valid = table.valid[rows]
+
+    # One point per distinct RGBA, weighted by the usage of all its spellings
+    keys, first, inverse = np.unique(table.keys(rows)[valid], return_index=True, return_inverse=True)
+    valid_rows = np.flatnonzero(valid)
+    weights = np.bincount(inverse, usage[valid_rows], len(keys))
+    lab = rgb_to_lab(table.rgb[rows[valid_rows[first]]])
+    leaders = leader_clusters(lab, keys & 0xFF, weights, threshold)
+
+    # The most used spelling of the leader represents the cluster, members are within threshold of the leader only
+    members = {}
+    for index in np.argsort(-usage[valid_rows], kind='stable').tolist():
+        members.setdefault(leaders[inverse[index]], []).append(index)
+    clusters = {}
+    for leader, indexes in members.items():
+        representative = next(index for index in indexes if inverse[index] == leader)
+        spellings = [values[valid_rows[representative]]]
+        spellings.extend(values[valid_rows[index]] for index in indexes if index != representative)
+        clusters[spellings[0]] = spellings
+
+    for index in np.flatnonzero(~valid).tolist():
+        clusters[values[index]] = [values[index]]
+    return clusters
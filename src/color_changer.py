@@ -1,13 +1,134 @@
 import os
-import re
-import shutil
-from datetime import datetime
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import  QWidget, QPushButton, QVBoxLayout, QLabel, QCheckBox, QScrollArea, QProgressBar, QLineEdit, QGroupBox, QHBoxLayout, QGridLayout, QFileDialog, QFrame, QColorDialog, QDialog, QDialogButtonBox, QMessageBox
-from worker_threads import WorkerThread, FileTypeWorkerThread
-from utils import rgba_to_rgb, hex_to_rgba, rgba_to_hex
+from PyQt5.QtCore import Qt, QTimer, QFileSystemWatcher, pyqtSignal
+from PyQt5.QtGui import QFontDatabase
+from PyQt5.QtWidgets import  QWidget, QPushButton, QVBoxLayout, QLabel, QCheckBox, QScrollArea, QProgressBar, QLineEdit, QGroupBox, QHBoxLayout, QGridLayout, QFileDialog, QColorDialog, QDialog, QDialogButtonBox, QMessageBox, QSpinBox, QDoubleSpinBox, QInputDialog, QTableView, QHeaderView, QAbstractItemView, QPlainTextEdit
+from worker_threads import WorkerThread, FileTypeWorkerThread, ColorScanWorkerThread, DiffPreviewWorkerThread, FileChangesWorkerThread
+from discovery import DEFAULT_IGNORE_GLOBS, manifest_extensions, parse_ignore_globs, select_entries
+from color_model import ColorTableModel, ColorDelegate, SWATCH, VALUE, USAGE
+from records import FileTable, read_usage_lines
+from clustering import DEFAULT_DELTA_E, cluster_colors
+from transforms import generate_mappings, load_chain, save_chain
+from color_table import entered_mappings
+from preview import DiffPreview
+from watch import IncrementalScan, changed_paths
+from saved_scan import SCAN_EXTENSION, ScanFormatError, load_scan, save_scan
+from profiling import format_report, save_report
+from pipeline import DEFAULT_IO_THREADS
+from backup import restore_snapshot
+from journal import StaleJournal, journal_paths, pending_mappings, read_journal, undo_journal
 from styles import light_mode_style, dark_mode_style  # Import styles
 
+USAGE_PAGE_SIZE = 200  # Usage sites shown per page of the usage dialog
+DIFF_PREVIEW_DELAY = 300  # Milliseconds without new entries before the diff preview is refreshed
+WATCH_DELAY = 500  # Milliseconds without file events before changed files are rescanned, coalesces checkouts
+
+
+class DiffPreviewDialog(QDialog):
+    """Shows one page of the diffs of a DiffPreview, the pages are computed by DiffPreviewWorkerThread."""
+
+    page_requested = pyqtSignal(int)  # Signal asking the app for the diffs of another page
+
+    def __init__(self, parent, directory):
+        super().__init__(parent)
+        self.setWindowTitle('Preview Changes')
+        self.directory = directory
+        self.page = 0  # Page shown, or asked for while the preview is busy
+
+        layout = QVBoxLayout()
+        self.summary_label = QLabel(self)
+        layout.addWidget(self.summary_label)
+
+        self.diff_edit = QPlainTextEdit(self)
+        self.diff_edit.setReadOnly(True)
+        self.diff_edit.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.diff_edit.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.diff_edit)
+
+        # Its own progress bar, the one of the app shows scans and applies running at the same time
+        self.progress_bar = QProgressBar(self)
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setVisible(False)
+        layout.addWidget(self.progress_bar)
+
+        # Buttons to move between pages of files
+        page_layout = QHBoxLayout()
+        self.previous_btn = QPushButton('Previous', self)
+        self.previous_btn.clicked.connect(lambda: self.page_requested.emit(self.page - 1))
+        self.page_label = QLabel(self)
+        self.next_btn = QPushButton('Next', self)
+        self.next_btn.clicked.connect(lambda: self.page_requested.emit(self.page + 1))
+        page_layout.addWidget(self.previous_btn)
+        page_layout.addWidget(self.page_label, 1, Qt.AlignCenter)
+        page_layout.addWidget(self.next_btn)
+        layout.addLayout(page_layout)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Close, Qt.Horizontal, self)
+        button_box.rejected.connect(self.close)
+        layout.addWidget(button_box)
+
+        self.setLayout(layout)
+        self.resize(800, 600)
+
+    def set_busy(self):
+        self.summary_label.setText('Computing changes...')
+        self.previous_btn.setEnabled(False)
+        self.next_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(True)
+
+    def show_progress(self, value, eta=-1.0):
+        self.progress_bar.setValue(value)
+
+    def show_page(self, diff_page):
+        """Show a preview.DiffPage."""
+        self.page = diff_page.page
+        self.progress_bar.setVisible(False)
+        self.summary_label.setText(f"{diff_page.substitutions} substitution(s) across {diff_page.file_count} file(s)")
+        self.diff_edit.setPlainText(diff_page.text)
+        self.page_label.setText(f"Page {diff_page.page + 1} of {diff_page.page_count}")
+        self.previous_btn.setEnabled(diff_page.page > 0)
+        self.next_btn.setEnabled(diff_page.page + 1 < diff_page.page_count)
+
+
+class StatsDialog(QDialog):
+    """Shows the stats of the last run of each kind (discover, scan, apply), see profiling.RunStats."""
+
+    def __init__(self, parent, reports):
+        super().__init__(parent)
+        self.setWindowTitle('Run Stats')
+        self.reports = reports  # Run name -> report, shared with the app and updated in place
+
+        layout = QVBoxLayout()
+        self.stats_edit = QPlainTextEdit(self)
+        self.stats_edit.setReadOnly(True)
+        self.stats_edit.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.stats_edit.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.stats_edit)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Close, Qt.Horizontal, self)
+        button_box.accepted.connect(self.save)
+        button_box.rejected.connect(self.close)
+        layout.addWidget(button_box)
+
+        self.setLayout(layout)
+        self.resize(700, 450)
+        self.show_reports()
+
+    def show_reports(self):
+        self.stats_edit.setPlainText('\n'.join(format_report(report) for report in self.reports.values())
+                                     or 'Nothing has run yet.')
+
+    def save(self):
+        """Save the reports as JSON."""
+        report_path, _ = QFileDialog.getSaveFileName(self, 'Save Stats', 'color_changer_stats.json', 'JSON (*.json)')
+        if not report_path:
+            return
+        try:
+            save_report(self.reports, report_path)
+        except OSError as e:
+            QMessageBox.warning(self, 'Save Failed', f'Could not save {report_path}:\n{e}')
+
+
 class ColorChangerApp(QWidget):
     def __init__(self):
         super().__init__()
@@ -16,8 +137,23 @@ class ColorChangerApp(QWidget):
 
         self.directory = ""
         self.unique_colors = {}
-        self.color_entries = {}
         self.selected_filetypes = ['.css', '.scss', '.less', '.svg']  # Default filetype
+        self.manifest = None  # Files in the directory, see discovery.discover_files
+        self.file_table = FileTable()  # Files referred to by usage sites
+        self.scan_worker_thread = None
+        self.file_type_worker_thread = None
+        self.worker_thread = None  # Applies the changes
+        self.transform_chain = []  # Chain loaded in the transform dialog, kept for the next time it opens
+        self.diff_preview = None  # DiffPreview of the last complete scan
+        self.diff_worker_thread = None
+        self.diff_dialog = None
+        self.incremental_scan = None  # Applies rescanned files to the last complete scan
+        self.scanned_filetypes = []  # File types of the last complete scan
+        self.file_changes_worker_thread = None
+        self.saved_scan_path = None  # Saved scan the table was opened from, its files are checked before an apply
+        self.saved_scan_check_thread = None  # Rediscovers the directory of a saved scan before an apply
+        self.run_reports = {}  # Run name -> stats report of the last run, see profiling.RunStats
+        self.stats_dialog = None
 
         self.initUI()
 
@@ -31,6 +167,15 @@ class ColorChangerApp(QWidget):
         # Directory label
         self.dir_label = QLabel('No directory selected', self)
 
+        # Keep a complete scan in a file and open it again without rescanning
+        saved_scan_layout = QHBoxLayout()
+        self.open_scan_btn = QPushButton('Open Scan', self)
+        self.open_scan_btn.clicked.connect(self.open_scan)
+        saved_scan_layout.addWidget(self.open_scan_btn)
+        self.save_scan_btn = QPushButton('Save Scan', self)
+        self.save_scan_btn.clicked.connect(self.save_scan)
+        saved_scan_layout.addWidget(self.save_scan_btn)
+
         self.default_filetype_groupbox = QGroupBox('Default File Types', self)
         default_filetype_layout = QGridLayout()
 
@@ -61,16 +206,74 @@ class ColorChangerApp(QWidget):
         self.experimental_layout = QGridLayout()
         self.experimental_groupbox.setLayout(self.experimental_layout)
 
-        # Scroll Area for colors
-        self.scroll_area = QScrollArea(self)
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_content_frame = QFrame(self.scroll_area)
-        self.scroll_area.setWidget(self.scroll_content_frame)
+        # Comma separated file and directory names skipped when discovering files
+        ignore_layout = QHBoxLayout()
+        ignore_layout.addWidget(QLabel('Ignore', self))
+        self.ignore_edit = QLineEdit(', '.join(DEFAULT_IGNORE_GLOBS), self)
+        self.ignore_edit.editingFinished.connect(self.on_ignore_globs_changed)
+        ignore_layout.addWidget(self.ignore_edit)
+
+        # Filter for the color table
+        self.filter_edit = QLineEdit(self)
+        self.filter_edit.setPlaceholderText('Filter colors by value or name')
+        self.filter_edit.textChanged.connect(lambda text: self.color_model.set_filter(text))
+
+        # Collapse colors that look the same into one row, a new color then applies to the whole group
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.filter_edit)
+        self.group_similar_checkbox = QCheckBox('Group Similar', self)
+        self.group_similar_checkbox.stateChanged.connect(self.update_clusters)
+        filter_layout.addWidget(self.group_similar_checkbox)
+        filter_layout.addWidget(QLabel('ΔE', self))
+        self.delta_e_spinbox = QDoubleSpinBox(self)
+        self.delta_e_spinbox.setRange(0.5, 10.0)
+        self.delta_e_spinbox.setSingleStep(0.5)
+        self.delta_e_spinbox.setValue(DEFAULT_DELTA_E)
+        self.delta_e_spinbox.valueChanged.connect(self.update_clusters)
+        filter_layout.addWidget(self.delta_e_spinbox)
+
+        # Color table, only the visible rows are rendered
+        self.color_model = ColorTableModel(self)
+        self.color_model.new_colors_changed.connect(self.schedule_diff_preview)
+        self.color_table = QTableView(self)
+        self.color_table.setModel(self.color_model)
+        self.color_table.setItemDelegate(ColorDelegate(self.color_table))
+        self.color_table.setSortingEnabled(True)
+        self.color_table.sortByColumn(VALUE, Qt.AscendingOrder)
+        self.color_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.color_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.color_table.setEditTriggers(QAbstractItemView.DoubleClicked | QAbstractItemView.EditKeyPressed | QAbstractItemView.AnyKeyPressed)
+        self.color_table.verticalHeader().setVisible(False)
+        self.color_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.color_table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.color_table.horizontalHeader().setStretchLastSection(True)
+        self.color_table.setColumnWidth(SWATCH, 40)
+        self.color_table.doubleClicked.connect(self.on_table_double_clicked)
+
+        # Buttons acting on the selected color
+        row_buttons_layout = QHBoxLayout()
+        self.pick_color_btn = QPushButton('Pick Color', self)
+        self.pick_color_btn.clicked.connect(lambda: self.pick_color(self.selected_color()))
+        row_buttons_layout.addWidget(self.pick_color_btn)
+        self.show_usage_btn = QPushButton('Show Usage', self)
+        self.show_usage_btn.clicked.connect(lambda: self.show_usage(self.selected_color()))
+        row_buttons_layout.addWidget(self.show_usage_btn)
+        self.transform_palette_btn = QPushButton('Transform Palette', self)
+        self.transform_palette_btn.clicked.connect(self.transform_palette)
+        row_buttons_layout.addWidget(self.transform_palette_btn)
 
         # Apply Changes Button
         self.apply_changes_btn = QPushButton('Apply Changes', self)
         self.apply_changes_btn.clicked.connect(self.apply_changes)
 
+        # Restore Backup Button
+        self.restore_backup_btn = QPushButton('Restore Backup', self)
+        self.restore_backup_btn.clicked.connect(self.restore_backup)
+
+        # Undo the last apply, or one of its mappings, from its journal
+        self.undo_apply_btn = QPushButton('Undo Apply', self)
+        self.undo_apply_btn.clicked.connect(self.undo_apply)
+
         # Preview Changes Button
         self.preview_changes_btn = QPushButton('Preview Changes', self)
         self.preview_changes_btn.clicked.connect(self.preview_changes)
@@ -81,16 +284,30 @@ class ColorChangerApp(QWidget):
         self.progress_bar.setValue(0)
         self.progress_bar.setVisible(False)  # Hide progress bar initially
 
+        # Stops a scan or apply between two files
+        self.cancel_btn = QPushButton('Cancel', self)
+        self.cancel_btn.clicked.connect(self.cancel_run)
+        self.cancel_btn.setVisible(False)
+        progress_layout = QHBoxLayout()
+        progress_layout.addWidget(self.progress_bar, 1)
+        progress_layout.addWidget(self.cancel_btn)
+
         # Layout for content area
         content_layout = QVBoxLayout()
         content_layout.addWidget(self.select_dir_btn)
         content_layout.addWidget(self.dir_label)
+        content_layout.addLayout(saved_scan_layout)
         content_layout.addWidget(self.default_filetype_groupbox)
         content_layout.addWidget(self.experimental_groupbox)
-        content_layout.addWidget(self.scroll_area)
+        content_layout.addLayout(ignore_layout)
+        content_layout.addLayout(filter_layout)
+        content_layout.addWidget(self.color_table)
+        content_layout.addLayout(row_buttons_layout)
         content_layout.addWidget(self.apply_changes_btn)
         content_layout.addWidget(self.preview_changes_btn)
-        content_layout.addWidget(self.progress_bar)
+        content_layout.addWidget(self.restore_backup_btn)
+        content_layout.addWidget(self.undo_apply_btn)
+        content_layout.addLayout(progress_layout)
 
         layout.addLayout(content_layout)
 
@@ -110,10 +327,49 @@ class ColorChangerApp(QWidget):
         self.backup_checkbox.setChecked(True)  # Default is to backup files
         bottom_layout.addWidget(self.backup_checkbox)  # Add backup checkbox
 
+        # Update the table as the scanned files are edited
+        self.watch_checkbox = QCheckBox('Watch Files', self)
+        self.watch_checkbox.stateChanged.connect(self.watch_files)
+        bottom_layout.addWidget(self.watch_checkbox)
+
+        # Timings of the last discover, scan and apply
+        self.stats_btn = QPushButton('Stats', self)
+        self.stats_btn.clicked.connect(self.show_stats)
+        bottom_layout.addWidget(self.stats_btn)
+
+        # Number of processes used to scan large directories
+        bottom_layout.addWidget(QLabel('Scan Workers', self))
+        self.scan_workers_spinbox = QSpinBox(self)
+        self.scan_workers_spinbox.setRange(1, os.cpu_count() or 1)
+        self.scan_workers_spinbox.setValue(os.cpu_count() or 1)
+        bottom_layout.addWidget(self.scan_workers_spinbox)
+
+        # Threads reading files ahead and writing them back, more hide the latency of network filesystems
+        bottom_layout.addWidget(QLabel('I/O Threads', self))
+        self.io_threads_spinbox = QSpinBox(self)
+        self.io_threads_spinbox.setRange(0, 64)
+        self.io_threads_spinbox.setValue(DEFAULT_IO_THREADS)
+        bottom_layout.addWidget(self.io_threads_spinbox)
+
         layout.addLayout(bottom_layout)  # Add the bottom layout with the toggle button
 
         self.setLayout(layout)
 
+        # Refresh an open diff preview once entries stop changing
+        self.diff_timer = QTimer(self)
+        self.diff_timer.setSingleShot(True)
+        self.diff_timer.setInterval(DIFF_PREVIEW_DELAY)
+        self.diff_timer.timeout.connect(self.refresh_diff_preview)
+
+        # File events restart the timer, changed files are rescanned once they stop
+        self.file_watcher = QFileSystemWatcher(self)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(WATCH_DELAY)
+        self.watch_timer.timeout.connect(self.check_file_changes)
+        self.file_watcher.directoryChanged.connect(lambda path: self.watch_timer.start())
+        self.file_watcher.fileChanged.connect(lambda path: self.watch_timer.start())
+
         # Start with Dark Mode
         self.setStyleSheet(dark_mode_style)  # Set initial theme to dark mode
 
@@ -133,12 +389,49 @@ class ColorChangerApp(QWidget):
         if folder:
             self.directory = folder
             self.dir_label.setText(f'Directory: {self.directory}')
-            self.scan_for_colors()
+            self.discover_files()
+
+    def discover_files(self):
+        """Build the file manifest of the directory, the scan starts once it is ready."""
+        self.cancel_scan()
+        self.cancel_file_changes()
+        self.cancel_saved_scan_check()
+        self.cancel_discovery()
+        self.manifest = None
+        self.incremental_scan = None
+        self.saved_scan_path = None
+        self.watch_files()
+
+        # Start the thread to find the files and file types in the selected directory
+        self.file_type_worker_thread = FileTypeWorkerThread(self.directory, parse_ignore_globs(self.ignore_edit.text()))
+        self.file_type_worker_thread.manifest_signal.connect(self.on_manifest_ready)
+        self.file_type_worker_thread.file_types_signal.connect(self.update_file_type_checkboxes)
+        self.file_type_worker_thread.stats_signal.connect(self.on_stats)
+        self.file_type_worker_thread.start()
+        self.update_file_actions()
+
+    def cancel_discovery(self):
+        """Drop the result of a running directory walk."""
+        if self.file_type_worker_thread is None:
+            return
+
+        self.file_type_worker_thread.manifest_signal.disconnect()
+        self.file_type_worker_thread.file_types_signal.disconnect()
+        self.file_type_worker_thread.stats_signal.disconnect()
+        self.file_type_worker_thread.wait()
+        self.file_type_worker_thread = None
+        self.update_file_actions()
 
-            # Start the thread to find file types in the selected directory
-            self.file_type_worker_thread = FileTypeWorkerThread(self.directory)
-            self.file_type_worker_thread.file_types_signal.connect(self.update_file_type_checkboxes)
-            self.file_type_worker_thread.start()
+    def on_manifest_ready(self, manifest):
+        """Keep the manifest for the scan and apply, then start scanning."""
+        self.manifest = manifest
+        self.scan_for_colors()
+
+    def on_ignore_globs_changed(self):
+        """Rediscover the files of the current directory with the new ignore globs."""
+        if self.directory and self.ignore_edit.isModified():
+            self.ignore_edit.setModified(False)
+            self.discover_files()
 
     def update_file_type_checkboxes(self, file_types):
         """Dynamically add checkboxes for the found file types."""
@@ -175,301 +468,692 @@ class ColorChangerApp(QWidget):
                 
 
 
-    def scan_for_colors(self):
-        """Scan the selected file types for color definitions."""
-        self.unique_colors.clear()
-        self.color_entries.clear()
-
-        # Get the current layout of the scroll_content_frame if it exists
-        current_layout = self.scroll_content_frame.layout()
-
-        # If there's an existing layout, clear its widgets first
-        if current_layout:
-            self.clear_widgets_in_layout(current_layout)
-            current_layout.deleteLater()  # Delete the old layout to avoid reuse
-        else:
-            print("No layout to clear.")
-
-        # Now we can safely create and set the new layout
-        colors_layout = QVBoxLayout()
-
-        # Scan all selected file types in the directory for color definitions
-        self.unique_colors = self.extract_colors_from_directory(self.directory)
-
-        # Iterate over unique colors and add widgets to the new layout
-        for color_value, (color_name, color_line, usage_count, usage_instances, alternative_value) in sorted(self.unique_colors.items()):
-            display_color = rgba_to_rgb(alternative_value)  # Convert rgba to rgb for display
-
-            # Color box to show color with black border
-            color_box = QWidget(self.scroll_content_frame)
-            color_box.setFixedSize(30, 30)
-            color_box.setStyleSheet(f'background-color: {display_color}; border: 1px solid black;')
-
-            # Label to show the color value (hex or rgba)
-            color_label = QLabel(f"Hex: {color_value}", self.scroll_content_frame)
-            rgba_label = QLabel(f"Alternative: {alternative_value}", self.scroll_content_frame)  # Show RGBA too
-
-            # Label to show the color name (e.g., GRAPE_900)
-            if color_name.lower().startswith('rgb') or color_name.startswith('#'):
-                color_name = "" # Ignore names with # or rgb
-            color_name_label = QLabel(color_name, self.scroll_content_frame)
-
-
-            # Label to show the number of instances
-            instance_label = QLabel(f'Used {usage_count} time(s)', self.scroll_content_frame)
-
-            # Input box for new color (increased width)
-            color_entry = QLineEdit(self.scroll_content_frame)
-            color_entry.setPlaceholderText('Enter new color (Hex or rgba)')
-            self.color_entries[color_value] = color_entry
-            color_entry.setFixedWidth(250)  # Increased width of the textboxes
-
-            # Button to show the usage of the color
-            show_usage_btn = QPushButton('Show Usage', self.scroll_content_frame)
-            show_usage_btn.clicked.connect(lambda _, color_value=color_value: self.show_usage(color_value))
-
-            # Add a "Pick Color" button to select a color visually
-            pick_color_btn = QPushButton('Pick Color', self.scroll_content_frame)
-            pick_color_btn.clicked.connect(lambda _, color_value=color_value: self.pick_color(color_value))
-
-            # Horizontal layout for color box, color code, name, instances, and input box
-            row_layout = QHBoxLayout()
-            row_layout.addWidget(color_box)
-            row_layout.addWidget(color_label)
-            row_layout.addWidget(rgba_label)  # Add RGBA label
-            row_layout.addWidget(color_name_label)
-            row_layout.addWidget(instance_label)
-            row_layout.addWidget(color_entry)
-            row_layout.addWidget(pick_color_btn)  # Add the Pick Color button
-            row_layout.addWidget(show_usage_btn)
-
-            colors_layout.addLayout(row_layout)
-
-        # Now that the layout is empty of old widgets, set the new layout
-        self.scroll_content_frame.setLayout(colors_layout)
-
-
-    def clear_widgets_in_layout(self, layout):
-        """Clears the widgets in a layout without resetting the layout itself."""
-        if layout:
-            print(f"Clearing widgets in layout: {layout}")
-            for i in range(layout.count()):
-                item = layout.itemAt(i)
-                widget = item.widget()
-                if widget:
-                    print(f"Deleting widget: {widget}")
-                    widget.deleteLater()
-        else:
-            print("No layout to clear.")
-
-
-
-    def color_conversion(self, color_value, color_name, line, color_definitions):
+    def scan_for_colors(self, refresh=False):
+        """Scan the selected file types for color definitions in a background thread.
+
+        With refresh, the table is kept as it is during the scan and only
+        the rows that differ are updated once it is done.
+        """
+        self.cancel_scan()
+        self.cancel_diff_preview()
+        self.diff_preview = None
+        self.incremental_scan = None
+        self.saved_scan_path = None
+
+        if not refresh:
+            if self.diff_dialog is not None:
+                self.diff_dialog.close()
+            self.unique_colors.clear()
+            self.color_model.clear()
+
+        self.scan_worker_thread = ColorScanWorkerThread(self.directory, self.manifest, self.selected_filetypes,
+                                                        self.scan_workers_spinbox.value(), stream_batches=not refresh,
+                                                        io_threads=self.io_threads_spinbox.value())
+        self.scan_worker_thread.progress_signal.connect(self.update_progress_bar)
+        self.scan_worker_thread.colors_batch_signal.connect(self.add_color_rows)
+        self.scan_worker_thread.finished_signal.connect(self.on_scan_finished)
+        self.scan_worker_thread.stats_signal.connect(self.on_stats)
+        if not refresh:
+            self.file_table = self.scan_worker_thread.file_table  # Usage sites can be shown while scanning
 
-        # Convert the hex color to RGBA (with full opacity by default)
-        if color_value.startswith("#"):
-            alternative_value = hex_to_rgba(color_value)  # Convert hex to rgba
-        elif color_value.lower().startswith("rgb"):
-            alternative_value = rgba_to_hex(color_value)
-        else:
-            alternative_value = color_value
-
-        if color_value not in color_definitions:
-            # Store as a list: [color_name, color_line, usage_count, usage_instances, alternative_value]
-            color_definitions[color_value] = [color_name, line.strip(), 0, [], alternative_value]
-        else:
-            # Update the RGBA value if it hasn't been set
-            # if len(color_definitions[color_value]) < 5 or not color_definitions[color_value][4]:
-            color_definitions[color_value][4] = alternative_value
-            
-        return
-
-
-    def extract_colors_from_directory(self, directory_path):
-        """Extract unique colors and their usage from all selected file types in the directory."""
-        color_definitions = {}
-
-        # Regex pattern to match hex, rgb(), and rgba() colors in @define-color
-        color_pattern = r'@define-color\s+([a-zA-Z0-9_]+)\s+(\#[0-9a-fA-F]{3,6}|rgb\(\s*(\d+),\s*(\d+),\s*(\d+)\s*\)|rgba\(\s*(\d+),\s*(\d+),\s*(\d+),\s*([\d\.]+)\s*\));'
-
-        # Regex pattern to match color usage (hex, rgb, rgba, or color variables)
-        usage_pattern = r'(\#([0-9a-fA-F]{3,6})|rgb\((\d+),\s*(\d+),\s*(\d+)\)|rgba\((\d+),\s*(\d+),\s*(\d+),\s*([\d\.]+)\))'
-
-        # Updated regex pattern to match colors in SVG attributes or inline styles
-        svg_color_pattern = r'(#(?:[0-9a-fA-F]{3}){1,2}|rgb\(\d{1,3},\s*\d{1,3},\s*\d{1,3}\)|rgba\(\d{1,3},\s*\d{1,3},\s*\d{1,3},\s*[\d\.]+\))'
-
-        for root, dirs, files in os.walk(directory_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-
-                # Ensure that the file is one of the selected types, including SVG files
-                if any(file.endswith(ext) for ext in self.selected_filetypes):
-                    with open(file_path, 'r', encoding='utf-8') as file_obj:
-                        for line_number, line in enumerate(file_obj, 1):
-                            # Ignore commented lines
-                            if line.strip().startswith('/*') or line.strip().startswith('*'):
-                                continue
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setValue(0)
+        self.cancel_btn.setVisible(True)
 
-                            # Match color definitions in CSS-like syntax
-                            match = re.search(color_pattern, line.strip())
-                            if match:
-                                color_value = match.group(2)
-                                color_name = match.group(1)
-                                self.color_conversion(color_value, color_name, line, color_definitions)
+        self.scan_worker_thread.start()
+        self.update_file_actions()
 
+    def cancel_scan(self):
+        """Stop a running scan at the next file boundary and drop its pending results."""
+        if self.scan_worker_thread is None:
+            return
 
-                            # Track color usage in CSS-like syntax
-                            for usage_match in re.finditer(usage_pattern, line.strip()):
-                                used_color = usage_match.group(1)
-                                if used_color in color_definitions:
-                                    color_definitions[used_color][2] += 1  # Increment the usage count
-                                    color_definitions[used_color][3].append(f"Line {line_number}: {line.strip()}")
+        self.scan_worker_thread.progress_signal.disconnect()
+        self.scan_worker_thread.colors_batch_signal.disconnect()
+        self.scan_worker_thread.finished_signal.disconnect()
+        self.scan_worker_thread.stats_signal.disconnect()
+        self.scan_worker_thread.requestInterruption()
+        self.scan_worker_thread.wait()
+        self.scan_worker_thread = None
+        self.update_file_actions()
+        self.progress_bar.setVisible(False)
+        self.cancel_btn.setVisible(False)
+
+    def add_color_rows(self, colors):
+        """Add rows for newly found colors and refresh the usage count of known ones."""
+        self.unique_colors.update(colors)
+        with self.scan_worker_thread.stats.phase('table'):
+            self.color_model.update_colors(colors)
+
+    def on_scan_finished(self, all_colors, file_table):
+        """Keep the complete scan result once the worker is done."""
+        self.unique_colors = all_colors
+        self.file_table = file_table
+        stats = self.scan_worker_thread.stats
+        with stats.phase('table'):
+            self.color_model.replace_records(all_colors)
+        self.on_stats(stats.report())
+        self.incremental_scan = IncrementalScan(self.scan_worker_thread.resolver, file_table)
+        self.scanned_filetypes = self.scan_worker_thread.selected_filetypes
+        self.scan_worker_thread = None
+        self.update_file_actions()
+        self.progress_bar.setVisible(False)
+        self.cancel_btn.setVisible(False)
+        self.diff_preview = self.new_diff_preview()
+        self.update_clusters()
+        self.schedule_diff_preview()
+        self.watch_files()
+
+    def new_diff_preview(self, changed_paths=None):
+        """Preview over the files an apply of the scanned file types would rewrite.
+
+        With changed_paths, the index of the current preview is kept for
+        the other files, so a watched change does not read the tree again.
+        """
+        preview = DiffPreview([entry.path for entry in select_entries(self.manifest, self.scanned_filetypes)])
+        if changed_paths is not None and self.diff_preview is not None:
+            preview.reuse_index(self.diff_preview, changed_paths)
+        return preview
+
+    def watch_files(self):
+        """Watch the scanned files and their directories while watching is enabled."""
+        watched = set(self.file_watcher.files() + self.file_watcher.directories())
+        wanted = set()
+        if self.watch_checkbox.isChecked() and self.incremental_scan is not None:
+            wanted.add(os.path.abspath(self.directory))
+            wanted.update(os.path.dirname(entry.path) for entry in self.manifest)  # New and renamed files
+            wanted.update(entry.path for entry in select_entries(self.manifest, self.scanned_filetypes))
+
+        if watched - wanted:
+            self.file_watcher.removePaths(list(watched - wanted))
+        if wanted - watched:
+            self.file_watcher.addPaths(sorted(wanted - watched))
+
+    def check_file_changes(self):
+        """Rescan the files that changed since the last scan or update."""
+        if (self.scan_worker_thread is not None or self.file_changes_worker_thread is not None or
+                self.worker_thread is not None):
+            self.watch_timer.start()  # Check again once the running work is done, files being applied are half done
+            return
+        if self.incremental_scan is None:
+            return
 
-                            # If the file is an SVG, extract color values from attributes or inline styles
-                            if file.endswith('.svg'):
-                                svg_matches = re.findall(svg_color_pattern, line)
-                                for color in svg_matches:
-                                    # Store each color found in SVG files
-                                    # color_value = match.group(2)
-                                    # color_name = color_value # match.group(1)
-                                    self.color_conversion(color, color, line, color_definitions)
-                                    
-                                    color_definitions[color][2] += 1  # Increment usage count
-        return color_definitions
+        self.file_changes_worker_thread = FileChangesWorkerThread(self.directory, self.manifest,
+                                                                  parse_ignore_globs(self.ignore_edit.text()),
+                                                                  self.scanned_filetypes)
+        self.file_changes_worker_thread.changes_signal.connect(self.on_file_changes)
+        self.file_changes_worker_thread.start()
+        self.update_file_actions()
 
+    def cancel_file_changes(self):
+        """Drop the result of a running file changes check."""
+        if self.file_changes_worker_thread is None:
+            return
 
+        self.file_changes_worker_thread.changes_signal.disconnect()
+        self.file_changes_worker_thread.wait()
+        self.file_changes_worker_thread = None
+        self.update_file_actions()
+
+    def on_file_changes(self, manifest, changes):
+        """Update the rows of the colors used by the changed files, or rescan if a definition changed."""
+        self.file_changes_worker_thread = None
+        self.update_file_actions()
+        self.manifest = manifest
+        if changes:
+            touched = self.incremental_scan.apply(changes)
+            if touched is None:
+                # The index still makes the rescan parse only the changed files
+                self.scan_for_colors(refresh=True)
+                return
+
+            self.color_model.update_colors({color_value: self.unique_colors[color_value] for color_value in touched})
+            self.cancel_diff_preview()  # Its worker is still reading the preview being replaced, restarted below
+            self.diff_preview = self.new_diff_preview([path for path, _, _ in changes])
+            self.update_clusters()
+            self.schedule_diff_preview()
+        self.watch_files()
+
+    def update_clusters(self):
+        """Group similar colors in the table once the scan is complete, or show every color."""
+        if self.group_similar_checkbox.isChecked() and self.scan_worker_thread is None:
+            self.color_model.set_clusters(cluster_colors(self.unique_colors, self.delta_e_spinbox.value()))
+        elif self.color_model.clusters is not None:
+            self.color_model.set_clusters(None)
+
+    def selected_color(self):
+        """Return the color value of the selected table row, if any."""
+        index = self.color_table.currentIndex()
+        return self.color_model.color_at(index.row()) if index.isValid() else None
+
+    def on_table_double_clicked(self, index):
+        """Pick a color from the swatch, or show where a color is used from its usage count."""
+        if index.column() == SWATCH:
+            self.pick_color(self.color_model.color_at(index.row()))
+        elif index.column() == USAGE:
+            self.show_usage(self.color_model.color_at(index.row()))
 
     def show_usage(self, color_value):
-        """Show usage information in a dialog for the selected color."""
-        color_name, color_line, usage_count, usage_instances, color_alternative = self.unique_colors.get(color_value, (None, None, 0, [], None))
+        """Show usage information in a dialog for the selected color, reading the lines page by page."""
+        record = self.unique_colors.get(color_value)
+        if record is None:
+            return
 
-        if usage_count == 0:
-            msg = f"The color {color_name} ({color_value}) has not been used in any files."
+        if record.usage_count == 0:
+            msg = f"The color {record.name} ({color_value}) has not been used in any files."
         else:
-            msg = f"Color {color_name} ({color_value}) is used {usage_count} time(s):\n\n"
-            msg += "\n".join(usage_instances)
+            msg = f"Color {record.name} ({color_value}) is used {record.usage_count} time(s):"
 
         usage_dialog = QDialog(self)
-        usage_dialog.setWindowTitle(f"Usage of {color_name}")
+        usage_dialog.setWindowTitle(f"Usage of {record.name}")
         usage_layout = QVBoxLayout()
+        usage_layout.addWidget(QLabel(msg, usage_dialog))
 
         # Scroll Area for usage details
         scroll_area = QScrollArea(usage_dialog)
         scroll_area.setWidgetResizable(True)
 
-        # Create a widget to hold the usage details text
-        usage_widget = QWidget(scroll_area)
-        usage_layout_widget = QVBoxLayout(usage_widget)
-
-        # Add the message and usage instances
-        usage_label = QLabel(msg, usage_widget)
-        usage_layout_widget.addWidget(usage_label)
-
-        usage_widget.setLayout(usage_layout_widget)
-
-        # Set the scrollable area for the dialog
-        scroll_area.setWidget(usage_widget)
+        # Label holding the usage lines of the current page
+        usage_label = QLabel(scroll_area)
+        usage_label.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+        usage_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        scroll_area.setWidget(usage_label)
         usage_layout.addWidget(scroll_area)
 
+        # Buttons to move between pages of usage sites
+        page_layout = QHBoxLayout()
+        previous_btn = QPushButton('Previous', usage_dialog)
+        page_label = QLabel(usage_dialog)
+        next_btn = QPushButton('Next', usage_dialog)
+        page_layout.addWidget(previous_btn)
+        page_layout.addWidget(page_label, 1, Qt.AlignCenter)
+        page_layout.addWidget(next_btn)
+        usage_layout.addLayout(page_layout)
+
+        site_count = record.site_count()
+        page_count = max(1, -(-site_count // USAGE_PAGE_SIZE))
+        current_page = [0]
+
+        def show_page(page):
+            """Read the lines of one page of usage sites from disk."""
+            current_page[0] = page
+            start = page * USAGE_PAGE_SIZE
+            sites = record.usage_sites(start, start + USAGE_PAGE_SIZE)
+            usage_label.setText("\n".join(
+                f"{os.path.relpath(file_path, self.directory)}: Line {line_number}: {text}"
+                for file_path, line_number, text in read_usage_lines(self.file_table, sites)))
+            page_label.setText(f"Page {page + 1} of {page_count}")
+            previous_btn.setEnabled(page > 0)
+            next_btn.setEnabled(page + 1 < page_count)
+
+        previous_btn.clicked.connect(lambda: show_page(current_page[0] - 1))
+        next_btn.clicked.connect(lambda: show_page(current_page[0] + 1))
+        show_page(0)
+
         # Ok button to close the dialog
         button_box = QDialogButtonBox(QDialogButtonBox.Ok, Qt.Horizontal, usage_dialog)
         button_box.accepted.connect(usage_dialog.accept)
         usage_layout.addWidget(button_box)
 
         usage_dialog.setLayout(usage_layout)
+        usage_dialog.resize(700, 500)
         usage_dialog.exec_()
 
+    def running_work(self):
+        """Describe the background work reading or rewriting the files of the directory, None if there is none."""
+        if self.worker_thread is not None:
+            return 'The changes are being applied'
+        if self.scan_worker_thread is not None:
+            return 'The directory is being scanned'
+        if self.file_changes_worker_thread is not None:
+            return 'Changed files are being rescanned'
+        discovery = self.file_type_worker_thread
+        if self.saved_scan_check_thread is not None or (discovery is not None and discovery.isRunning()):
+            return 'The directory is being listed'  # The discovery thread is kept once done, see cancel_discovery
+        return None
+
+    def update_file_actions(self):
+        """Enable the actions that rewrite files only while no background work reads or rewrites them."""
+        idle = self.running_work() is None
+        for button in (self.apply_changes_btn, self.restore_backup_btn, self.undo_apply_btn):
+            button.setEnabled(idle)
+
+    def refuse_while_busy(self):
+        """Warn and return True if background work is running, an apply, undo or restore has to wait for it."""
+        work = self.running_work()
+        if work is None:
+            return False
+        QMessageBox.warning(self, 'Files In Use', f'{work}, please wait for it to finish.')
+        return True
+
     def apply_changes(self):
         """Apply the color changes based on the mappings provided in the UI."""
         if not self.directory:
             QMessageBox.warning(self, 'No Directory', 'Please select a directory first.')
             return
+        if self.refuse_while_busy():
+            return
+        if self.manifest is None:
+            QMessageBox.warning(self, 'Scan In Progress', 'Please wait for the directory to be scanned.')
+            return
+        if self.saved_scan_path is not None:
+            self.check_saved_scan()  # Applies once the files are known to match the saved scan
+            return
 
-        # Check if backup is selected
-        if self.backup_checkbox.isChecked():
-            # Generate a timestamped backup directory name
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_dir = f"{self.directory}_backup_{timestamp}"
-
-            # Ensure the backup directory doesn't already exist
-            if os.path.exists(backup_dir):
-                shutil.rmtree(backup_dir)  # Remove existing backup if any
-            shutil.copytree(self.directory, backup_dir)  # Create backup
-
-        # Create a new worker thread and pass selected_filetypes
-        self.worker_thread = WorkerThread(self.unique_colors, self.directory, self.color_entries, self.selected_filetypes)
+        # Create a new worker thread and pass selected_filetypes, it backs up the files it modifies if selected
+        self.worker_thread = WorkerThread(self.unique_colors, self.directory, dict(self.color_model.new_colors), self.selected_filetypes, self.manifest,
+                                          self.backup_checkbox.isChecked(), self.io_threads_spinbox.value())
         self.worker_thread.progress_signal.connect(self.update_progress_bar)
         self.worker_thread.finished_signal.connect(self.on_apply_changes_finished)
+        self.worker_thread.error_signal.connect(self.on_apply_changes_failed)
+        self.worker_thread.stats_signal.connect(self.on_stats)
 
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
+        self.cancel_btn.setVisible(True)
 
         # Start the worker thread
         self.worker_thread.start()
+        self.update_file_actions()
+
+
+    def restore_backup(self):
+        """Restore the files saved in a backup snapshot and rescan."""
+        if self.refuse_while_busy():
+            return
+        snapshot_dir = QFileDialog.getExistingDirectory(self, 'Select Backup', os.path.dirname(self.directory))
+        if not snapshot_dir:
+            return
+
+        try:
+            directory, restored = restore_snapshot(snapshot_dir)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, 'Restore Failed', f'Could not restore {snapshot_dir}:\n{e}')
+            return
+
+        QMessageBox.information(self, 'Backup Restored', f'Restored {restored} file(s) in {directory}.')
+        if os.path.abspath(self.directory) == directory:
+            self.discover_files()
+
+    def undo_apply(self):
+        """Undo the last apply to the directory, or one of its mappings, rewriting only the files it changed."""
+        if self.refuse_while_busy():
+            return
+        journals = journal_paths(self.directory) if self.directory else []
+        if not journals:
+            QMessageBox.information(self, 'Nothing to Undo', 'No changes applied to this directory can be undone.')
+            return
+
+        try:
+            journal = read_journal(journals[0])
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, 'Undo Failed', f'Could not read {journals[0]}:\n{e}')
+            return
+
+        mappings = pending_mappings(journal)
+        choices = [f"All {len(mappings)} mapping(s) applied on {journal['created']}"]
+        choices.extend(f"{old_color} → {new_color}" for old_color, new_color in mappings)
+        choice, accepted = QInputDialog.getItem(self, 'Undo Apply', 'Undo:', choices, 0, False)
+        if not accepted:
+            return
+        index = choices.index(choice)
+        old_colors = {mappings[index - 1][0]} if index else None
+
+        try:
+            directory, restored = undo_journal(journals[0], old_colors)
+        except StaleJournal as e:
+            paths = '\n'.join(os.path.relpath(file_path, self.directory) for file_path in e.paths[:20])
+            QMessageBox.warning(self, 'Undo Refused', f'{e}, undoing would overwrite those changes:\n\n{paths}')
+            return
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, 'Undo Failed', f'Could not undo {journals[0]}:\n{e}')
+            return
+
+        QMessageBox.information(self, 'Apply Undone', f'Restored the old colors in {restored} file(s).')
+        self.discover_files()  # Modification times changed, the manifest is walked again
+
+    def save_scan(self):
+        """Save the complete scan shown in the table, it opens again without rescanning."""
+        if self.scan_worker_thread is not None or self.manifest is None or not self.unique_colors:
+            QMessageBox.warning(self, 'No Scan', 'Please wait for a scan to complete first.')
+            return
+
+        default_path = f"{os.path.abspath(self.directory)}{SCAN_EXTENSION}"
+        scan_path, _ = QFileDialog.getSaveFileName(self, 'Save Scan', default_path, f'Saved scans (*{SCAN_EXTENSION})')
+        if not scan_path:
+            return
+        if not scan_path.endswith(SCAN_EXTENSION):
+            scan_path += SCAN_EXTENSION
+
+        try:
+            save_scan(scan_path, self.directory, self.scanned_filetypes, self.manifest, self.unique_colors,
+                      self.file_table)
+        except OSError as e:
+            QMessageBox.warning(self, 'Save Failed', f'Could not save {scan_path}:\n{e}')
+
+    def open_scan(self):
+        """Fill the table from a saved scan, without reading the scanned files."""
+        scan_path, _ = QFileDialog.getOpenFileName(self, 'Open Scan', os.path.dirname(self.directory),
+                                                   f'Saved scans (*{SCAN_EXTENSION})')
+        if not scan_path:
+            return
+
+        try:
+            saved = load_scan(scan_path)
+            if not os.path.isdir(saved.directory):
+                # Saved on another machine, the theme is checked out somewhere else here
+                directory = QFileDialog.getExistingDirectory(self, f'Select the Directory of {saved.directory}')
+                if not directory:
+                    return
+                saved = load_scan(scan_path, directory)
+        except (OSError, ScanFormatError) as e:
+            QMessageBox.warning(self, 'Open Failed', f'Could not open {scan_path}:\n{e}')
+            return
+
+        self.cancel_scan()
+        self.cancel_file_changes()
+        self.cancel_saved_scan_check()
+        self.cancel_discovery()
+        self.cancel_diff_preview()
+        if self.diff_dialog is not None:
+            self.diff_dialog.close()
+
+        self.directory = saved.directory
+        self.dir_label.setText(f'Directory: {self.directory}')
+        self.manifest = saved.manifest
+        self.saved_scan_path = scan_path
+        self.incremental_scan = None  # Watching needs a scan of the files as they are now
+        self.update_file_type_checkboxes(manifest_extensions(saved.manifest))
+        for checkbox in (self.default_filetype_groupbox.findChildren(QCheckBox) +
+                         self.experimental_groupbox.findChildren(QCheckBox)):
+            checkbox.setChecked(checkbox.text() in saved.selected_filetypes)
+
+        self.unique_colors = saved.color_definitions
+        self.file_table = saved.file_table
+        self.scanned_filetypes = saved.selected_filetypes
+        self.color_model.clear()
+        self.color_model.update_colors(saved.color_definitions)
+        self.diff_preview = self.new_diff_preview()
+        self.update_clusters()
+        self.watch_files()
+
+    def check_saved_scan(self):
+        """Walk the directory of an opened saved scan, to find the files that changed since it was saved."""
+        if self.saved_scan_check_thread is not None:
+            return
 
+        self.saved_scan_check_thread = FileTypeWorkerThread(self.directory, parse_ignore_globs(self.ignore_edit.text()))
+        self.saved_scan_check_thread.manifest_signal.connect(self.on_saved_scan_checked)
+        self.saved_scan_check_thread.stats_signal.connect(self.on_stats)
+        self.saved_scan_check_thread.start()
+        self.update_file_actions()
 
-    def update_progress_bar(self, value):
-        """Update progress bar from worker thread."""
+    def cancel_saved_scan_check(self):
+        """Drop the result of a running saved scan check."""
+        if self.saved_scan_check_thread is None:
+            return
+
+        self.saved_scan_check_thread.manifest_signal.disconnect()
+        self.saved_scan_check_thread.stats_signal.disconnect()
+        self.saved_scan_check_thread.wait()
+        self.saved_scan_check_thread = None
+        self.update_file_actions()
+
+    def on_saved_scan_checked(self, manifest):
+        """Apply the changes if the files still match the saved scan, otherwise offer to rescan first."""
+        self.saved_scan_check_thread = None
+        self.update_file_actions()
+        changed = changed_paths(self.manifest, manifest, self.scanned_filetypes)[0]
+        self.manifest = manifest
+        self.saved_scan_path = None  # Checked, the apply goes through the files as they are now
+
+        if changed:
+            answer = QMessageBox.question(
+                self, 'Files Changed',
+                f"{len(changed)} file(s) were added, modified or removed since the scan was saved.\n\n"
+                f"Rescan before applying? The new colors entered so far are kept for the colors still found.",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+            if answer == QMessageBox.Yes:
+                self.scan_for_colors(refresh=True)
+                return
+            if answer != QMessageBox.No:
+                return
+        self.apply_changes()
+
+    def on_stats(self, report):
+        """Keep the stats of the last run of each kind, refreshing the stats panel if it is open."""
+        self.run_reports[report['name']] = report
+        if self.stats_dialog is not None:
+            self.stats_dialog.show_reports()
+
+    def show_stats(self):
+        """Open the stats panel, it follows the runs while it stays open."""
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(self, self.run_reports)
+        self.stats_dialog.show_reports()
+        self.stats_dialog.show()
+        self.stats_dialog.raise_()
+
+    def update_progress_bar(self, value, eta=-1.0):
+        """Update progress bar from worker thread, with the time left if known."""
         self.progress_bar.setValue(value)
+        if eta < 0 or value >= 100:
+            self.progress_bar.setFormat('%p%')
+        else:
+            minutes, seconds = divmod(int(eta + 0.5), 60)
+            self.progress_bar.setFormat(f"%p% ({minutes}:{seconds:02d} left)")
+
+    def cancel_run(self):
+        """Stop the running scan or apply between two files, no file is left half-written."""
+        if self.worker_thread is not None:
+            self.worker_thread.requestInterruption()  # The report of the files done so far still arrives
+            self.cancel_btn.setEnabled(False)
+        else:
+            self.cancel_scan()
 
-    def on_apply_changes_finished(self):
-        """When the apply changes operation finishes, show a message box."""
-        QMessageBox.information(self, 'Changes Applied', 'The color changes have been applied successfully.')
+    def end_apply(self):
+        """Release the buttons and the progress bar held by the apply."""
+        self.worker_thread = None
+        self.update_file_actions()
         self.progress_bar.setVisible(False)  # Hide progress bar after applying
+        self.cancel_btn.setVisible(False)
+        self.cancel_btn.setEnabled(True)
+
+    def on_apply_changes_failed(self, error):
+        """When the apply stops on an error, show it, the files rewritten before it stay rewritten."""
+        self.end_apply()
+        QMessageBox.warning(self, 'Apply Failed', f"Applying the color changes stopped on an error:\n{error}\n\n"
+                                                  "Files rewritten before it can be reverted with 'Undo Apply'.")
+
+    def on_apply_changes_finished(self, report):
+        """When the apply changes operation finishes, show a message box."""
+        self.end_apply()
+
+        substitutions = sum(report['per_mapping'].values())
+        if report['cancelled']:
+            msg = (f"Applying the color changes was cancelled, the remaining files were left untouched.\n\n"
+                   f"{substitutions} substitution(s) across {len(report['per_file'])} file(s) were applied.")
+        else:
+            msg = (f"The color changes have been applied successfully.\n\n"
+                   f"{substitutions} substitution(s) across {len(report['per_file'])} file(s).")
+        if report['skipped']:
+            msg += f"\n\n{len(report['skipped'])} binary, oversized or non UTF-8 file(s) were skipped."
+        if report['backup_dir']:
+            msg += f"\n\nModified files were backed up to {report['backup_dir']}"
+        if report['journal']:
+            msg += "\n\n'Undo Apply' reverts these changes, or a single mapping of them."
+        QMessageBox.information(self, 'Changes Cancelled' if report['cancelled'] else 'Changes Applied', msg)
 
     def preview_changes(self):
-        """Preview the changes by simulating the replacement in the UI."""
-        for color_value, (color_name, color_line, usage_count, usage_instances, color_alternative) in self.unique_colors.items():
-            # Get the new color from the user input (from the UI)
-            new_color = self.color_entries.get(color_value, None).text().strip()
-            if new_color:
-                # Validate the new color format (either hex or rgba)
-                if not self.is_valid_color(new_color):
-                    continue
-
-                # Preview the color by temporarily applying the new color in the UI
-                for widget in self.scroll_content_frame.findChildren(QLabel):
-                    if widget.text() == f"Hex: {color_value}" or widget.text() == f"rgba: {color_value}":
-                        widget.setStyleSheet(f"background-color: {new_color}; border: 1px solid black;")
-
-    def replace_color_in_files(self, old_color, new_color, processed_files):
-        """Replace occurrences of old_color with new_color in the selected files."""
-        changes_made = False
-        updated_files = []
-
-        # Iterate over the selected file types and process the files
-        for root, dirs, files in os.walk(self.directory):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.selected_filetypes):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-
-                    # Replace occurrences of old color with new color in the file content
-                    if old_color in content:
-                        changes_made = True
-                        content = content.replace(old_color, new_color)
-                        updated_files.append((file_path, content))  # Save updated content
-
-        # Write all updated files
-        for file_path, new_content in updated_files:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-
-        return changes_made
-
-
-    def is_valid_color(self, color):
-        """Check if the provided color is valid (either hex or rgba)."""
-        # Check for valid hex color (#RRGGBB or #RGB)
-        hex_pattern = r'^#([0-9A-Fa-f]{3}){1,2}$'
-        rgba_pattern = r'^rgba\((\d{1,3}), (\d{1,3}), (\d{1,3}), (\d(\.\d+)?)\)$'
-        
-        return bool(re.match(hex_pattern, color)) or bool(re.match(rgba_pattern, color))
+        """Preview the changes by painting the new colors next to the old ones, and show the diffs they make."""
+        self.color_table.closePersistentEditor(self.color_table.currentIndex())
+        self.color_model.set_preview(True)
+
+        if self.diff_preview is None:
+            QMessageBox.warning(self, 'Scan In Progress', 'Please wait for the directory to be scanned.')
+            return
 
+        if self.diff_dialog is None or self.diff_dialog.directory != self.directory:
+            self.diff_dialog = DiffPreviewDialog(self, self.directory)
+            self.diff_dialog.setStyleSheet(self.styleSheet())
+            self.diff_dialog.page_requested.connect(self.refresh_diff_preview)
+        self.diff_dialog.show()
+        self.diff_dialog.raise_()
+        self.refresh_diff_preview()
+
+    def schedule_diff_preview(self):
+        """Refresh the open diff preview shortly, so typing a color does not restart it for every key."""
+        if self.diff_dialog is not None and self.diff_dialog.isVisible():
+            self.diff_timer.start()
+
+    def refresh_diff_preview(self, page=None):
+        """Bring the diff preview up to date with the entries and diff a page of it (the shown one by default) in a background thread."""
+        if self.diff_preview is None:
+            return
+        self.cancel_diff_preview()
+
+        if page is not None:
+            self.diff_dialog.page = page
+        mappings = entered_mappings(dict(self.color_model.new_colors), self.unique_colors)
+        self.diff_worker_thread = DiffPreviewWorkerThread(self.diff_preview, mappings, self.diff_dialog.page,
+                                                          self.directory)
+        self.diff_worker_thread.progress_signal.connect(self.diff_dialog.show_progress)
+        self.diff_worker_thread.finished_signal.connect(self.on_diff_preview_finished)
+        self.diff_dialog.set_busy()
+        self.diff_worker_thread.start()
+
+    def cancel_diff_preview(self):
+        """Stop a running diff preview, the preview keeps the state of its last complete update."""
+        if self.diff_worker_thread is None:
+            return
+
+        self.diff_worker_thread.progress_signal.disconnect()
+        self.diff_worker_thread.finished_signal.disconnect()
+        self.diff_worker_thread.requestInterruption()
+        self.diff_worker_thread.wait()
+        self.diff_worker_thread = None
+        self.diff_dialog.progress_bar.setVisible(False)
+
+    def on_diff_preview_finished(self, diff_page):
+        self.diff_worker_thread = None
+        self.diff_dialog.show_page(diff_page)
+
+    def transform_palette(self):
+        """Generate new colors for the whole palette from a chain of transforms."""
+        if not self.unique_colors:
+            QMessageBox.warning(self, 'No Colors', 'Please scan a directory first.')
+            return
+
+        transform_dialog = QDialog(self)
+        transform_dialog.setWindowTitle('Transform Palette')
+        transform_layout = QGridLayout()
+
+        # A chain loaded from a file runs first, the steps set below are added after it
+        loaded_chain = [list(self.transform_chain)]
+        chain_label = QLabel(transform_dialog)
+
+        def show_loaded_chain():
+            chain_label.setText(f"Loaded chain: {len(loaded_chain[0])} step(s)" if loaded_chain[0] else "No chain loaded")
+
+        invert_checkbox = QCheckBox('Invert lightness', transform_dialog)
+        hue_spinbox = QSpinBox(transform_dialog)
+        hue_spinbox.setRange(-180, 180)
+        hue_spinbox.setSuffix('°')
+        saturation_spinbox = QSpinBox(transform_dialog)
+        saturation_spinbox.setRange(-100, 100)
+        lightness_spinbox = QSpinBox(transform_dialog)
+        lightness_spinbox.setRange(-100, 100)
+        gamma_spinbox = QDoubleSpinBox(transform_dialog)
+        gamma_spinbox.setRange(0.1, 5.0)
+        gamma_spinbox.setSingleStep(0.1)
+        gamma_spinbox.setValue(1.0)
+        palette_edit = QLineEdit(transform_dialog)
+        palette_edit.setPlaceholderText('Comma separated colors, e.g. #2e3440, #88c0d0')
+
+        transform_layout.addWidget(chain_label, 0, 0, 1, 2)
+        transform_layout.addWidget(invert_checkbox, 1, 0, 1, 2)
+        for row, (label, widget) in enumerate([('Rotate hue', hue_spinbox), ('Shift saturation', saturation_spinbox),
+                                               ('Shift lightness', lightness_spinbox), ('Gamma', gamma_spinbox),
+                                               ('Map onto palette', palette_edit)], 2):
+            transform_layout.addWidget(QLabel(label, transform_dialog), row, 0)
+            transform_layout.addWidget(widget, row, 1)
+
+        def current_chain():
+            chain = list(loaded_chain[0])
+            if invert_checkbox.isChecked():
+                chain.append({'op': 'invert_lightness'})
+            if hue_spinbox.value():
+                chain.append({'op': 'hue_rotate', 'degrees': hue_spinbox.value()})
+            if saturation_spinbox.value():
+                chain.append({'op': 'saturate', 'amount': saturation_spinbox.value()})
+            if lightness_spinbox.value():
+                chain.append({'op': 'lighten', 'amount': lightness_spinbox.value()})
+            if gamma_spinbox.value() != 1.0:
+                chain.append({'op': 'gamma', 'value': gamma_spinbox.value()})
+            palette = [color.strip() for color in palette_edit.text().split(',') if color.strip()]
+            if palette:
+                chain.append({'op': 'palette', 'colors': palette})
+            return chain
+
+        def load():
+            chain_file, _ = QFileDialog.getOpenFileName(transform_dialog, 'Load Transform Chain', '', 'JSON (*.json)')
+            if chain_file:
+                try:
+                    loaded_chain[0] = load_chain(chain_file)
+                except (OSError, ValueError, KeyError) as e:
+                    QMessageBox.warning(transform_dialog, 'Load Failed', f'Could not load {chain_file}:\n{e}')
+                show_loaded_chain()
+
+        def save():
+            chain_file, _ = QFileDialog.getSaveFileName(transform_dialog, 'Save Transform Chain', '', 'JSON (*.json)')
+            if chain_file:
+                try:
+                    save_chain(current_chain(), chain_file)
+                except OSError as e:
+                    QMessageBox.warning(transform_dialog, 'Save Failed', f'Could not save {chain_file}:\n{e}')
+
+        def clear():
+            loaded_chain[0] = []
+            show_loaded_chain()
+
+        chain_buttons_layout = QHBoxLayout()
+        load_btn = QPushButton('Load Chain', transform_dialog)
+        load_btn.clicked.connect(load)
+        chain_buttons_layout.addWidget(load_btn)
+        save_btn = QPushButton('Save Chain', transform_dialog)
+        save_btn.clicked.connect(save)
+        chain_buttons_layout.addWidget(save_btn)
+        clear_btn = QPushButton('Clear Chain', transform_dialog)
+        clear_btn.clicked.connect(clear)
+        chain_buttons_layout.addWidget(clear_btn)
+        transform_layout.addLayout(chain_buttons_layout, 7, 0, 1, 2)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, Qt.Horizontal, transform_dialog)
+        button_box.accepted.connect(transform_dialog.accept)
+        button_box.rejected.connect(transform_dialog.reject)
+        transform_layout.addWidget(button_box, 8, 0, 1, 2)
+
+        show_loaded_chain()
+        transform_dialog.setLayout(transform_layout)
+        if not transform_dialog.exec_():
+            return
+
+        chain = current_chain()
+        try:
+            mappings = generate_mappings(self.unique_colors, chain)
+        except ValueError as e:
+            QMessageBox.warning(self, 'Transform Failed', str(e))
+            return
+
+        self.transform_chain = chain
+        self.color_model.set_new_colors(mappings)
+        QMessageBox.information(self, 'Palette Transformed', f'New colors were set for {len(mappings)} color(s).')
 
     def pick_color(self, color_value):
         """Pick a color using QColorDialog and update the corresponding entry."""
+        if color_value is None:
+            return
+
         # Open the QColorDialog with the correct style
         color_dialog = QColorDialog(self)
         color_dialog.setOption(QColorDialog.DontUseNativeDialog, True)  # Use Qt's native dialog
@@ -477,4 +1161,4 @@ class ColorChangerApp(QWidget):
 
         if color_dialog.exec_():
             selected_color = color_dialog.selectedColor().name()
-            self.color_entries[color_value].setText(selected_color)  # Update the text entry with the picked color
+            self.color_model.set_new_color(color_value, selected_color)  # Update the new color entry with the picked color
@@ -0,0 +1,325 @@
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QRect, pyqtSignal
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QStyledItemDelegate, QLineEdit
+from utils import parse_color_string
+
+# Table columns
+SWATCH, VALUE, ALTERNATIVE, NAME, USAGE, NEW_COLOR = range(6)
+HEADERS = ['', 'Color', 'Alternative', 'Name', 'Usage', 'New Color']
+
+TOOLTIP_MEMBERS = 20  # Cluster members listed in a tooltip
+
+
+def display_name(color_name):
+    """Names that are just the color itself (SVG colors) are not shown."""
+    if color_name.lower().startswith(('rgb', 'hsl')) or color_name.startswith('#'):
+        return ""
+    return color_name
+
+
+def to_qcolor(color_value, alternative_value):
+    """Return a QColor for a scanned color, invalid if it cannot be displayed."""
+    if isinstance(alternative_value, tuple):
+        return QColor(*alternative_value[:3])
+    if isinstance(alternative_value, str) and alternative_value.startswith('#'):
+        return QColor(alternative_value)
+    return QColor(color_value)
+
+
+def parse_qcolor(color_text):
+    """Return a QColor for a hex or rgb()/rgba() string entered by the user."""
+    if color_text.lower().startswith('rgb'):
+        try:
+            r, g, b, a = parse_color_string(color_text)
+        except ValueError:
+            return QColor()
+        return QColor(r, g, b, int(a * 255)) if a <= 1 else QColor()
+    return QColor(color_text) if color_text.startswith('#') else QColor()
+
+
+class ColorTableModel(QAbstractTableModel):
+    """Scanned colors and the new colors entered for them.
+
+    Rows are the color values that pass the current filter, ordered by the
+    current sort column. Only the rows a view asks for are ever rendered.
+    """
+
+    new_colors_changed = pyqtSignal()  # Emitted whenever new colors are entered or cleared
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.records = {}  # Color value -> ColorRecord
+        self.spellings = {}  # Canonical key -> color values denoting the same color
+        self.clusters = None  # Representative color value -> similar color values, while similar colors are grouped
+        self.new_colors = {}  # Color value -> new color text entered by the user
+        self.preview = False  # Whether swatches also show the new color
+        self.rows = []  # Visible color values in display order
+        self.row_of = {}  # Visible color value -> its row
+        self.filter_text = ""
+        self.sort_column = VALUE
+        self.sort_order = Qt.AscendingOrder
+
+    def clear(self):
+        self.beginResetModel()
+        self.records = {}
+        self.spellings = {}
+        self.clusters = None
+        self.new_colors = {}
+        self.rows = []
+        self.row_of = {}
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return HEADERS[section]
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == NEW_COLOR:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def color_at(self, row):
+        return self.rows[row]
+
+    def members(self, color_value):
+        """Color values a row stands for, the whole cluster while similar colors are grouped."""
+        if self.clusters is None:
+            return [color_value]
+        return self.clusters.get(color_value, [color_value])
+
+    def usage(self, color_value):
+        return sum(self.records[member].usage_count for member in self.members(color_value))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        color_value = self.rows[index.row()]
+        record = self.records[color_value]
+        column = index.column()
+
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            if column == VALUE:
+                return color_value
+            if column == ALTERNATIVE:
+                return str(record.alternative)
+            if column == NAME:
+                similar = len(self.members(color_value)) - 1
+                if similar:
+                    return f"{display_name(record.name)} (+{similar} similar)".lstrip()
+                return display_name(record.name)
+            if column == USAGE:
+                return self.usage(color_value)
+            if column == NEW_COLOR:
+                return self.new_colors.get(color_value, "")
+        elif role == Qt.ToolTipRole and column in (VALUE, NAME):
+            tooltip = record.line
+            others = [spelling for spelling in self.spellings.get(record.key, ()) if spelling != color_value]
+            if others:
+                tooltip += f"\nAlso written as: {', '.join(others)}"
+            similar = self.members(color_value)[1:]
+            if similar:
+                shown = ', '.join(similar[:TOOLTIP_MEMBERS]) + (', ...' if len(similar) > TOOLTIP_MEMBERS else '')
+                tooltip += f"\nGrouped with: {shown}"
+            return tooltip
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or index.column() != NEW_COLOR:
+            return False
+        self.set_new_color(self.rows[index.row()], value)
+        return True
+
+    def set_new_color(self, color_value, new_color):
+        """Store the new color for a color value, or every member of its cluster, and refresh its row."""
+        new_color = new_color.strip()
+        for member in self.members(color_value):
+            if new_color:
+                self.new_colors[member] = new_color
+            else:
+                self.new_colors.pop(member, None)
+
+        row = self.row_of.get(color_value)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, SWATCH), self.index(row, NEW_COLOR))
+        self.new_colors_changed.emit()
+
+    def set_new_colors(self, mappings):
+        """Store many new colors at once, e.g. a mapping generated for the whole palette."""
+        self.new_colors.update(mappings)
+        if self.rows:
+            self.dataChanged.emit(self.index(0, SWATCH), self.index(len(self.rows) - 1, NEW_COLOR))
+        self.new_colors_changed.emit()
+
+    def set_preview(self, preview):
+        """Toggle painting the new colors next to the old ones in the swatches."""
+        self.preview = preview
+        if self.rows:
+            self.dataChanged.emit(self.index(0, SWATCH), self.index(len(self.rows) - 1, SWATCH))
+
+    def update_colors(self, colors):
+        """Add new color records and refresh the rows of known ones, sorting again only if they moved."""
+        added = [color_value for color_value in colors if color_value not in self.records]
+        self.records.update(colors)
+        for color_value in added:
+            key = self.records[color_value].key
+            if key is not None:
+                self.spellings.setdefault(key, []).append(color_value)
+
+        changed = colors.keys() - set(added)
+        if self.clusters is not None and changed:
+            # Grouped rows show the usage of their whole cluster
+            changed |= {representative for representative, members in self.clusters.items()
+                        if not changed.isdisjoint(members)}
+        changed = [color_value for color_value in changed if color_value in self.row_of]
+
+        visible = [color_value for color_value in added if self.accepts(color_value)]
+        if visible:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(visible) - 1)
+            self.rows.extend(visible)
+            self.endInsertRows()
+        if visible or not self.in_order([self.row_of[color_value] for color_value in changed]):
+            self.sort(self.sort_column, self.sort_order)
+        self.emit_rows([self.row_of[color_value] for color_value in changed])
+
+    def in_order(self, rows):
+        """Whether each of rows still sorts between its neighbours, i.e. sorting again would not move any row."""
+        key = self.sort_key(self.sort_column)
+        if key is None:
+            return True  # Sorted by color value, which does not change
+        descending = self.sort_order == Qt.DescendingOrder
+        for row in rows:
+            value = key(self.rows[row])
+            if row > 0:
+                previous = key(self.rows[row - 1])
+                if previous < value if descending else value < previous:
+                    return False
+            if row + 1 < len(self.rows):
+                following = key(self.rows[row + 1])
+                if value < following if descending else following < value:
+                    return False
+        return True
+
+    def emit_rows(self, rows):
+        """Emit dataChanged for some rows, one signal per run of consecutive rows."""
+        rows = sorted(rows)
+        start = 0
+        for index, row in enumerate(rows):
+            if index + 1 == len(rows) or rows[index + 1] != row + 1:
+                self.dataChanged.emit(self.index(rows[start], SWATCH), self.index(row, NEW_COLOR))
+                start = index + 1
+
+    def replace_records(self, records):
+        """Switch to the records of a rescan, only removing and adding the rows that differ."""
+        if self.clusters is not None:
+            self.clusters = None  # Clusters may name removed colors, they are computed again for the new records
+            self.refresh_rows()
+
+        removed = sorted((self.row_of[color_value] for color_value in self.records
+                          if color_value not in records and color_value in self.row_of), reverse=True)
+        for row in removed:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.rows[row]
+            self.endRemoveRows()
+        self.row_of = {color_value: row for row, color_value in enumerate(self.rows)}
+
+        self.records = {color_value: records[color_value] for color_value in self.records if color_value in records}
+        self.spellings = {}
+        for color_value, record in self.records.items():
+            if record.key is not None:
+                self.spellings.setdefault(record.key, []).append(color_value)
+        self.update_colors({color_value: record for color_value, record in records.items() if color_value not in self.records})
+        if self.rows:
+            self.dataChanged.emit(self.index(0, SWATCH), self.index(len(self.rows) - 1, NEW_COLOR))
+
+    def accepts(self, color_value):
+        """Check a color against the current filter text."""
+        if not self.filter_text:
+            return True
+        record = self.records[color_value]
+        return any(self.filter_text in text.lower()
+                   for text in (color_value, record.name, str(record.alternative)))
+
+    def set_filter(self, text):
+        """Only show the colors whose value, name or alternative contain text."""
+        self.filter_text = text.strip().lower()
+        self.refresh_rows()
+
+    def set_clusters(self, clusters):
+        """Show one row per cluster of similar colors (see clustering.cluster_colors), or every color for None."""
+        self.clusters = clusters
+        self.refresh_rows()
+
+    def refresh_rows(self):
+        self.beginResetModel()
+        candidates = self.records if self.clusters is None else self.clusters
+        self.rows = [color_value for color_value in candidates if self.accepts(color_value)]
+        self.endResetModel()
+        self.sort(self.sort_column, self.sort_order)
+
+    def sort_key(self, column):
+        records = self.records
+        if column == USAGE:
+            return self.usage
+        if column == NAME:
+            return lambda color_value: display_name(records[color_value].name).lower()
+        if column == ALTERNATIVE:
+            return lambda color_value: str(records[color_value].alternative)
+        if column == NEW_COLOR:
+            return lambda color_value: self.new_colors.get(color_value, "")
+        return None  # Sort by color value
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+
+        self.layoutAboutToBeChanged.emit()
+        old_rows = list(self.rows)
+        self.rows.sort(key=self.sort_key(column), reverse=order == Qt.DescendingOrder)
+        self.row_of = {color_value: row for row, color_value in enumerate(self.rows)}
+
+        # Keep selections and open editors on the same colors
+        for index in self.persistentIndexList():
+            row = self.row_of[old_rows[index.row()]]
+            self.changePersistentIndex(index, self.index(row, index.column()))
+        self.layoutChanged.emit()
+
+
+class ColorDelegate(QStyledItemDelegate):
+    """Paints color swatches and edits the new color cell."""
+
+    def paint(self, painter, option, index):
+        if index.column() != SWATCH:
+            super().paint(painter, option, index)
+            return
+
+        model = index.model()
+        color_value = model.color_at(index.row())
+        alternative_value = model.records[color_value].alternative
+        rect = option.rect.adjusted(2, 2, -2, -2)
+
+        new_color = parse_qcolor(model.new_colors.get(color_value, "")) if model.preview else QColor()
+        if new_color.isValid():
+            # Split the swatch, old color on the left and the previewed new color on the right
+            half = rect.width() // 2
+            painter.fillRect(QRect(rect.left(), rect.top(), half, rect.height()), to_qcolor(color_value, alternative_value))
+            painter.fillRect(QRect(rect.left() + half, rect.top(), rect.width() - half, rect.height()), new_color)
+        else:
+            painter.fillRect(rect, to_qcolor(color_value, alternative_value))
+
+        painter.setPen(Qt.black)
+        painter.drawRect(rect)
+
+    def createEditor(self, parent, option, index):
+        editor = QLineEdit(parent)
+        editor.setPlaceholderText('Enter new color (Hex or rgba)')
+        return editor
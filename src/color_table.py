@@ -0,0 +1,358 @@
+import re
+import numpy as np
+from utils import is_valid_color
+
+# Value of each ASCII hex digit, 255 for every other byte
+HEX_NIBBLES = np.full(256, 255, np.uint8)
+for nibble, digit in enumerate(b'0123456789abcdef'):
+    HEX_NIBBLES[digit] = HEX_NIBBLES[ord(chr(digit).upper())] = nibble
+
+HEX_LENGTHS = (3, 4, 6, 8)  # #RGB, #RGBA, #RRGGBB and #RRGGBBAA
+
+# Linear sRGB -> CIE XYZ, and the XYZ of the D65 white point
+SRGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+# Functional colors, matched line by line over all values of a kind joined with newlines
+rgb_pattern = re.compile(r'^rgba?\([^\S\n]*(\d+),[^\S\n]*(\d+),[^\S\n]*(\d+)(?:,[^\S\n]*([\d.]+))?[^\S\n]*\)$',
+                         re.MULTILINE | re.IGNORECASE)
+hsl_pattern = re.compile(r'^hsla?\([^\S\n]*([\d.]+)(?:deg)?,[^\S\n]*([\d.]+)%,[^\S\n]*([\d.]+)%(?:,[^\S\n]*([\d.]+))?[^\S\n]*\)$',
+                         re.MULTILINE | re.IGNORECASE)
+
+
+def parse_hex(digits):
+    """Parse hex digit strings of one length, returns (rgb, alpha, valid) arrays."""
+    length = len(digits[0])
+    codes = np.frombuffer(''.join(digits).encode('ascii', 'replace'), np.uint8).reshape(-1, length)
+    nibbles = HEX_NIBBLES[codes]
+    valid = (nibbles != 255).all(axis=1)
+
+    if length <= 4:
+        channels = nibbles * np.uint8(17)  # 'a' -> 'aa'
+    else:
+        channels = nibbles[:, 0::2] * np.uint8(16) + nibbles[:, 1::2]
+    alpha = channels[:, 3] / np.float32(255) if channels.shape[1] == 4 else np.ones(len(digits), np.float32)
+    return channels[:, :3], alpha, valid
+
+
+def match_functions(pattern, values):
+    """Match every value against pattern, returns an array of the groups and the valid rows."""
+    matches = pattern.findall('\n'.join(values))
+    if len(matches) == len(values):
+        return np.array(matches, dtype=str).reshape(len(values), 4), np.ones(len(values), bool)
+
+    # Some value did not match, fall back to matching them one by one to keep rows aligned
+    groups, valid = [], []
+    for value in values:
+        match = pattern.fullmatch(value)
+        groups.append(match.groups('') if match else ('0', '0', '0', ''))
+        valid.append(match is not None)
+    return np.array(groups, dtype=str).reshape(len(values), 4), np.array(valid, bool)
+
+
+def parse_alpha(column):
+    column = np.where(column == '', '1', column)
+    return np.clip(column.astype(np.float32), 0, 1)
+
+
+def parse_rgb(values):
+    groups, valid = match_functions(rgb_pattern, values)
+    channels = np.clip(groups[:, :3].astype(np.int64), 0, 255).astype(np.uint8)
+    return channels, parse_alpha(groups[:, 3]), valid
+
+
+def parse_hsl(values):
+    groups, valid = match_functions(hsl_pattern, values)
+    hsl = groups[:, :3].astype(np.float64)
+    return hsl_to_rgb(hsl[:, 0], hsl[:, 1] / 100, hsl[:, 2] / 100), parse_alpha(groups[:, 3]), valid
+
+
+def hsl_to_rgb(hue, saturation, lightness):
+    """Convert arrays of hue (degrees), saturation and lightness (0 to 1) into uint8 rgb rows."""
+    saturation = np.clip(saturation, 0, 1)
+    lightness = np.clip(lightness, 0, 1)
+    chroma = saturation * np.minimum(lightness, 1 - lightness)
+
+    def channel(n):
+        k = (n + hue / 30) % 12
+        return lightness - chroma * np.clip(np.minimum(k - 3, 9 - k), -1, 1)
+
+    return np.rint(np.stack([channel(0), channel(8), channel(4)], axis=1) * 255).astype(np.uint8)
+
+
+def rgb_to_hsl(rgb):
+    """Convert uint8 rgb rows into arrays of hue (degrees), saturation and lightness (percent)."""
+    r, g, b = (rgb / 255).T
+    high = np.maximum(np.maximum(r, g), b)
+    low = np.minimum(np.minimum(r, g), b)
+    delta = high - low
+    lightness = (high + low) / 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        saturation = np.where(delta == 0, 0, delta / (1 - np.abs(2 * lightness - 1)))
+        hue = np.select([delta == 0, high == r, high == g],
+                        [0, ((g - b) / delta) % 6, (b - r) / delta + 2],
+                        (r - g) / delta + 4) * 60
+    return hue, saturation * 100, lightness * 100
+
+
+def rgb_to_lab(rgb):
+    """Convert uint8 sRGB rows into CIELAB rows (D65 white point)."""
+    linear = rgb / 255
+    linear = np.where(linear <= 0.04045, linear / 12.92, ((linear + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ SRGB_TO_XYZ.T / D65_WHITE
+
+    epsilon = 216 / 24389
+    f = np.where(xyz > epsilon, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.column_stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])])
+
+
+def parse_colors(values):
+    """Parse hex, rgb(), rgba(), hsl() and hsla() strings in bulk.
+
+    Returns (rgb, alpha, valid): uint8 rgb rows, float32 alpha and whether
+    each value could be parsed. Values are grouped by kind so every kind
+    is parsed with a few array operations, however many values there are.
+    """
+    count = len(values)
+    rgb = np.zeros((count, 3), np.uint8)
+    alpha = np.ones(count, np.float32)
+    valid = np.zeros(count, bool)
+
+    kinds = {}
+    for row, value in enumerate(values):
+        if value.startswith('#'):
+            kind = len(value) - 1 if len(value) - 1 in HEX_LENGTHS else None
+        else:
+            kind = value[:3].lower()
+        kinds.setdefault(kind, []).append(row)
+
+    for kind, rows in kinds.items():
+        if kind in HEX_LENGTHS:
+            parsed = parse_hex([values[row][1:] for row in rows])
+        elif kind == 'rgb':
+            parsed = parse_rgb([values[row] for row in rows])
+        elif kind == 'hsl':
+            parsed = parse_hsl([values[row] for row in rows])
+        else:
+            continue  # e.g. 5 digit hex values, left invalid
+        rgb[rows], alpha[rows], valid[rows] = parsed
+
+    return rgb, alpha, valid
+
+
+def canonical_keys(rgb, alpha):
+    """Pack rgb rows and alpha into one uint32 per color, equal for equivalent spellings."""
+    rgb = rgb.astype(np.uint32)
+    return (rgb[:, 0] << 24) | (rgb[:, 1] << 16) | (rgb[:, 2] << 8) | np.rint(alpha * 255).astype(np.uint32)
+
+
+def alpha_values(alpha):
+    """Alpha as Python floats, without float32 noise (0.3 rather than 0.30000001)."""
+    return np.round(alpha.astype(np.float64), 3).tolist()
+
+
+def format_hex(rgb, alpha=None):
+    """Format uint8 rgb rows as '#RRGGBB', or '#RRGGBBAA' when alpha is given."""
+    channels = rgb
+    if alpha is not None:
+        channels = np.column_stack([rgb, np.rint(alpha * 255).astype(np.uint8)])
+    digits = channels.tobytes().hex().upper()
+    width = channels.shape[1] * 2
+    return ['#' + digits[start:start + width] for start in range(0, len(digits), width)]
+
+
+def format_rgba(rgb, alpha):
+    return [f"rgba({r}, {g}, {b}, {a:g})" for (r, g, b), a in zip(rgb.tolist(), alpha_values(alpha))]
+
+
+class ColorTable:
+    """Every discovered color as a row of an RGBA array.
+
+    Rows keep the order the values were added in. Arrays grow by doubling,
+    so adding colors batch by batch stays linear in the number of colors.
+    """
+
+    def __init__(self):
+        self.values = []  # Row -> color value as spelled in the files
+        self.rows = {}  # Color value -> row
+        self.rgb = np.zeros((0, 3), np.uint8)
+        self.alpha = np.zeros(0, np.float32)
+        self.valid = np.zeros(0, bool)
+
+    @classmethod
+    def from_parsed(cls, values, rgb, alpha, valid):
+        """Build a table from values parsed before, e.g. by a saved scan, without parsing them again."""
+        table = cls()
+        table.values = list(values)
+        table.rows = {value: row for row, value in enumerate(table.values)}
+        table.rgb, table.alpha, table.valid = rgb, alpha, valid
+        return table
+
+    def __len__(self):
+        return len(self.values)
+
+    def extend(self, values):
+        """Add the values not in the table yet, returns the rows of all values."""
+        new_values = [value for value in dict.fromkeys(values) if value not in self.rows]
+        if new_values:
+            start = len(self.values)
+            end = start + len(new_values)
+            if end > len(self.valid):
+                self.grow(end)
+
+            self.rgb[start:end], self.alpha[start:end], self.valid[start:end] = parse_colors(new_values)
+            for row, value in enumerate(new_values, start):
+                self.rows[value] = row
+            self.values.extend(new_values)
+
+        return np.array([self.rows[value] for value in values], np.intp)
+
+    def grow(self, size):
+        capacity = max(size, 2 * len(self.valid), 64)
+        rgb = np.zeros((capacity, 3), np.uint8)
+        alpha = np.ones(capacity, np.float32)
+        valid = np.zeros(capacity, bool)
+        used = len(self.values)
+        rgb[:used], alpha[:used], valid[:used] = self.rgb[:used], self.alpha[:used], self.valid[:used]
+        self.rgb, self.alpha, self.valid = rgb, alpha, valid
+
+    def all_rows(self):
+        return np.arange(len(self.values))
+
+    def keys(self, rows):
+        """Canonical RGBA key of each row, equivalent spellings share a key."""
+        return canonical_keys(self.rgb[rows], self.alpha[rows])
+
+    def groups(self):
+        """Group the valid spellings by the color they denote, returns canonical key -> values."""
+        rows = np.flatnonzero(self.valid[:len(self.values)])
+        keys, inverse = np.unique(self.keys(rows), return_inverse=True)
+        groups = {int(key): [] for key in keys}
+        for row, group in zip(rows.tolist(), inverse.tolist()):
+            groups[int(keys[group])].append(self.values[row])
+        return groups
+
+    def to_hex(self, rows, with_alpha=False):
+        """Format rows as '#RRGGBB', or '#RRGGBBAA' with_alpha."""
+        return format_hex(self.rgb[rows], self.alpha[rows] if with_alpha else None)
+
+    def to_rgb(self, rows):
+        return [f"rgb({r}, {g}, {b})" for r, g, b in self.rgb[rows].tolist()]
+
+    def to_rgba(self, rows):
+        return format_rgba(self.rgb[rows], self.alpha[rows])
+
+    def to_hsl(self, rows):
+        hue, saturation, lightness = (np.rint(channel).astype(np.int64).tolist() for channel in rgb_to_hsl(self.rgb[rows]))
+        return [f"hsl({h}, {s}%, {l}%)" for h, s, l in zip(hue, saturation, lightness)]
+
+    def alpha_values(self, rows):
+        return alpha_values(self.alpha[rows])
+
+    def alternatives(self, rows):
+        """The hex <-> rgba alternative shown for each row.
+
+        Hex spellings get an (r, g, b, a) tuple, functional spellings their hex
+        value. Values that cannot be parsed are their own alternative.
+        """
+        rows = np.asarray(rows, np.intp)
+        hex_values = self.to_hex(rows)
+        rgb = self.rgb[rows].tolist()
+        alpha = self.alpha_values(rows)
+
+        alternatives = []
+        for index, row in enumerate(rows.tolist()):
+            value = self.values[row]
+            if not self.valid[row]:
+                alternatives.append(value)
+            elif value.startswith('#'):
+                alternatives.append((*rgb[index], alpha[index]))
+            else:
+                alternatives.append(hex_values[index])
+        return alternatives
+
+
+def equivalent_spellings(color_definitions):
+    """Group scanned color values by the canonical key of their records."""
+    spellings = {}
+    for color_value, record in color_definitions.items():
+        if record.key is not None:
+            spellings.setdefault(record.key, []).append(color_value)
+    return spellings
+
+
+def key_spellings(key):
+    """The usual spellings of the color of a canonical key, the ones ColorTable parses back to the same key.
+
+    Hex values in lower and upper case, short where every channel allows
+    it and with an alpha digit only when needed or opaque, then rgb() and
+    rgba() with and without spaces after the commas.
+    """
+    channels = [(key >> shift) & 0xFF for shift in (24, 16, 8, 0)]
+    red, green, blue, alpha = channels
+    digits = [''.join(f'{channel:02x}' for channel in channels)]
+    if alpha == 0xFF:
+        digits.append(digits[0][:6])
+    if all(channel % 17 == 0 for channel in channels):
+        digits.extend(value[::2] for value in list(digits))
+    spellings = [f'#{value}' for value in digits] + [f'#{value.upper()}' for value in digits if value != value.upper()]
+
+    opacity = f'{round(alpha / 255, 3):g}'
+    functions = [f'rgba({red}, {green}, {blue}, {opacity})']
+    if alpha == 0xFF:
+        functions.insert(0, f'rgb({red}, {green}, {blue})')
+    spellings.extend(functions)
+    spellings.extend(function.replace(', ', ',') for function in functions)
+    return spellings
+
+
+def expand_mappings(mappings, color_definitions):
+    """Apply each mapping to every spelling of the same color.
+
+    Besides the scanned spellings of the color, its usual spellings (see
+    key_spellings) are mapped too, so a color the scan never recorded,
+    e.g. a literal rgb(170, 187, 204) in a rule, is still replaced.
+    Spellings with a mapping of their own keep it.
+    """
+    keys = {old_color: record.key for old_color, record in color_definitions.items()
+            if old_color in mappings and record.key is not None}
+    unscanned = [old_color for old_color in mappings if old_color not in color_definitions]
+    if unscanned:
+        table = ColorTable()
+        rows = table.extend(unscanned)
+        for old_color, key, valid in zip(unscanned, table.keys(rows).tolist(), table.valid[rows].tolist()):
+            if valid:
+                keys[old_color] = key
+
+    spellings = equivalent_spellings(color_definitions)
+    expanded = dict(mappings)
+    for old_color, new_color in mappings.items():
+        key = keys.get(old_color)
+        if key is None:
+            continue
+        for spelling in spellings.get(key, []) + key_spellings(key):
+            expanded.setdefault(spelling, new_color)
+    return expanded
+
+
+def entered_mappings(color_entries, color_definitions):
+    """Build old -> new mappings from the valid new colors entered for scanned colors.
+
+    A new color entered for one spelling also applies to the equivalent
+    spellings (e.g. #abc, #AABBCC and rgb(170, 187, 204)), see
+    expand_mappings.
+    """
+    mappings = {}
+    for color_value, new_color in color_entries.items():
+        new_color = new_color.strip()
+        if color_value in color_definitions and new_color and is_valid_color(new_color):
+            mappings[color_value] = new_color
+    return expand_mappings(mappings, color_definitions)
+
+
+def canonical_hex(key):
+    """Format a canonical key as '#RRGGBBAA'."""
+    return f"#{key:08X}"
@@ -0,0 +1,84 @@
+import fnmatch
+import os
+import re
+from collections import namedtuple
+
+# One discovered file, mtime is in nanoseconds and ext is lowercased (e.g. '.css')
+ManifestEntry = namedtuple('ManifestEntry', ['path', 'size', 'mtime', 'ext'])
+
+# File and directory names skipped during discovery
+DEFAULT_IGNORE_GLOBS = ['.git', '.hg', '.svn', 'node_modules', '__pycache__', '*_backup_*', '*.bak', '*~']
+
+
+def compile_ignore_globs(ignore_globs):
+    """Combine name globs into a single regex, None if there are none."""
+    if not ignore_globs:
+        return None
+    return re.compile('|'.join(fnmatch.translate(glob) for glob in ignore_globs))
+
+
+def parse_ignore_globs(text):
+    """Parse a comma separated list of globs as entered in the UI."""
+    return [glob.strip() for glob in text.split(',') if glob.strip()]
+
+
+def discover_files(directory, ignore_globs=DEFAULT_IGNORE_GLOBS):
+    """List every file below directory as ManifestEntry tuples, depth first in name order.
+
+    Symlinked directories are followed once, and files reached through links
+    are only listed once.
+    """
+    ignore_pattern = compile_ignore_globs(ignore_globs)
+    manifest = []
+    visited = set()  # (st_dev, st_ino) of directories already walked, guards against symlink loops
+    listed = set()  # (st_dev, st_ino) of files already in the manifest
+
+    pending = [os.path.abspath(directory)]  # Stack of directories still to walk
+    while pending:
+        path = pending.pop()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if (stat.st_dev, stat.st_ino) in visited:
+            continue
+        visited.add((stat.st_dev, stat.st_ino))
+
+        try:
+            with os.scandir(path) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            continue  # Unreadable directory
+
+        subdirectories = []
+        for entry in entries:
+            if ignore_pattern and ignore_pattern.match(entry.name):
+                continue
+            try:
+                if entry.is_dir():
+                    subdirectories.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    if stat.st_ino:  # Not filled in by scandir on Windows
+                        if (stat.st_dev, stat.st_ino) in listed:
+                            continue
+                        listed.add((stat.st_dev, stat.st_ino))
+                    manifest.append(ManifestEntry(entry.path, stat.st_size, stat.st_mtime_ns,
+                                                  os.path.splitext(entry.name)[1].lower()))
+            except OSError:
+                continue  # Broken symlink or the file vanished
+
+        pending.extend(reversed(subdirectories))  # Visit subdirectories in name order
+
+    return manifest
+
+
+def manifest_extensions(manifest):
+    """Return the set of file extensions present in a manifest."""
+    return {entry.ext for entry in manifest if entry.ext}
+
+
+def select_entries(manifest, selected_filetypes):
+    """Return the manifest entries whose extension is one of the selected file types."""
+    extensions = {ext.lower() for ext in selected_filetypes}
+    return [entry for entry in manifest if entry.ext in extensions]
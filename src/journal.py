@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from atomic import AtomicWriter
+from textfiles import CHUNK_BYTES
+from utils import cache_dir
+
+JOURNAL_VERSION = 1  # Bump whenever the journal layout changes, older journals are then refused
+
+
+class StaleJournal(Exception):
+    """Files changed since the apply a journal records, so undoing it would overwrite those changes."""
+
+    def __init__(self, paths):
+        super().__init__(f"{len(paths)} file(s) changed since the changes were applied")
+        self.paths = paths
+
+
+def default_journal_dir():
+    """Return the journal directory under the user's cache directory, next to the scan index."""
+    return os.path.join(cache_dir(), 'journal')
+
+
+def directory_tag(directory):
+    """Short tag of a directory, journals of one directory share it in their file name."""
+    return hashlib.blake2b(os.path.abspath(directory).encode('utf-8'), digest_size=6).hexdigest()
+
+
+def new_hash():
+    """Hash of the contents of journaled files."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def text_digest(text):
+    """Digest of text as it is written to a file."""
+    hasher = new_hash()
+    hasher.update(text.encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def file_hexdigest(file_path):
+    """Digest of the contents of a file as text_digest computes it, unlike scan_index.file_digest it is hex."""
+    hasher = new_hash()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def pack_edits(edits):
+    """Flatten (offset, mapping id) edits into [offset delta, mapping id, ...], offsets are ascending."""
+    packed, previous = [], 0
+    for offset, mapping_id in edits:
+        packed.extend((offset - previous, mapping_id))
+        previous = offset
+    return packed
+
+
+def unpack_edits(packed):
+    """Return the (offset, mapping id) edits of pack_edits."""
+    edits, offset = [], 0
+    for index in range(0, len(packed), 2):
+        offset += packed[index]
+        edits.append((offset, packed[index + 1]))
+    return edits
+
+
+class ApplyJournal:
+    """Reverse edits of one apply, enough to undo all of it or only some of its mappings.
+
+    Records the digest and the substitution offsets of every changed file.
+    add is thread safe.
+    """
+
+    def __init__(self, directory, mappings, journal_dir=None):
+        self.directory = os.path.abspath(directory)
+        self.mappings = list(mappings.items())  # (old color, new color), edits refer to them by index
+        self.mapping_ids = {old_color: mapping_id for mapping_id, (old_color, new_color) in enumerate(self.mappings)}
+        self.files = {}  # Path relative to directory -> {'digest': ..., 'edits': packed edits}
+        self.lock = threading.Lock()
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        self.journal_path = os.path.join(journal_dir or default_journal_dir(),
+                                         f"{timestamp}_{directory_tag(self.directory)}.json")
+
+    def add(self, file_path, edits, digest):
+        """Record the (offset in the new contents, old color) edits of a changed file and the digest of its new contents."""
+        relative_path = os.path.relpath(file_path, self.directory)
+        edits = [(offset, self.mapping_ids[old_color]) for offset, old_color in edits]
+        entry = {'digest': digest, 'edits': pack_edits(edits)}
+        with self.lock:
+            self.files[relative_path] = entry
+
+    def close(self):
+        """Write the journal, returns its path or None if no file changed."""
+        if not self.files:
+            return None
+
+        journal = {
+            'version': JOURNAL_VERSION,
+            'directory': self.directory,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'mappings': self.mappings,
+            'files': self.files,
+        }
+        write_journal(self.journal_path, journal)
+        return self.journal_path
+
+
+def write_journal(journal_path, journal):
+    os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+    temp_path = f"{journal_path}.saving"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(journal, f, separators=(',', ':'))
+    os.replace(temp_path, journal_path)
+
+
+def read_journal(journal_path):
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        journal = json.load(f)
+    if journal.get('version') != JOURNAL_VERSION:
+        raise ValueError(f"{journal_path} is a journal of version {journal.get('version')}, "
+                         f"only version {JOURNAL_VERSION} can be undone")
+    return journal
+
+
+def journal_paths(directory, journal_dir=None):
+    """Return the journals of the applies to directory, newest first."""
+    journal_dir = journal_dir or default_journal_dir()
+    suffix = f"_{directory_tag(directory)}.json"
+    try:
+        names = [name for name in os.listdir(journal_dir) if name.endswith(suffix)]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(journal_dir, name) for name in sorted(names, reverse=True)]
+
+
+def reverse_file(file_path, edits, mappings, undone, writer):
+    """Put the old colors of the undone mapping ids back into a file, replacing it through writer.
+
+    Returns the edits left, with their offsets in the new contents, and the
+    digest of the new contents.
+    """
+    remaining = []
+    hasher = new_hash()
+    temp_file, temp_path = writer.begin(file_path)
+    try:
+        with open(file_path, 'r', encoding='utf-8', newline='') as source:
+            written = 0
+
+            def write(text):
+                nonlocal written
+                temp_file.write(text)
+                hasher.update(text.encode('utf-8'))
+                written += len(text)
+
+            position = 0
+            for offset, mapping_id in edits:
+                while position < offset:
+                    text = source.read(min(offset - position, CHUNK_BYTES))
+                    if not text:
+                        raise StaleJournal([file_path])
+                    write(text)
+                    position += len(text)
+
+                old_color, new_color = mappings[mapping_id]
+                if source.read(len(new_color)) != new_color:
+                    raise StaleJournal([file_path])  # Only possible with a digest collision or a forged journal
+                position += len(new_color)
+                if mapping_id in undone:
+                    write(old_color)
+                else:
+                    remaining.append((written, mapping_id))
+                    write(new_color)
+
+            for text in iter(lambda: source.read(CHUNK_BYTES), ''):
+                write(text)
+    except BaseException:
+        writer.discard(temp_file, temp_path)
+        raise
+    writer.commit(temp_file, temp_path, file_path)  # Never leaves a half-undone file behind
+    return remaining, hasher.hexdigest()
+
+
+def undo_journal(journal_path, old_colors=None):
+    """Undo the apply recorded in a journal, or only its mappings of old_colors.
+
+    Raises StaleJournal without rewriting anything if a recorded file
+    changed since. Returns the directory and the number of files rewritten.
+    """
+    journal = read_journal(journal_path)
+    directory = journal['directory']
+    mappings = journal['mappings']
+    undone = {mapping_id for mapping_id, (old_color, new_color) in enumerate(mappings)
+              if old_colors is None or old_color in old_colors}
+
+    affected = []
+    stale = []
+    for relative_path, entry in journal['files'].items():
+        edits = unpack_edits(entry['edits'])
+        if not any(mapping_id in undone for offset, mapping_id in edits):
+            continue
+        file_path = os.path.join(directory, relative_path)
+        try:
+            if file_hexdigest(file_path) != entry['digest']:
+                stale.append(file_path)
+                continue
+        except OSError:
+            stale.append(file_path)
+            continue
+        affected.append((relative_path, file_path, edits))
+    if stale:
+        raise StaleJournal(stale)
+
+    writer = AtomicWriter()
+    try:
+        for relative_path, file_path, edits in affected:
+            remaining, digest = reverse_file(file_path, edits, mappings, undone, writer)
+            if remaining:
+                journal['files'][relative_path] = {'digest': digest, 'edits': pack_edits(remaining)}
+            else:
+                del journal['files'][relative_path]
+    finally:
+        writer.close()
+        # Files undone before an error are recorded as such
+        if journal['files']:
+            write_journal(journal_path, journal)
+        else:
+            os.remove(journal_path)
+    return directory, len(affected)
+
+
+def pending_mappings(journal):
+    """Return the (old color, new color) mappings of a journal that still have substitutions to undo."""
+    mapping_ids = set()
+    for entry in journal['files'].values():
+        mapping_ids.update(entry['edits'][1::2])
+    return [tuple(mapping) for mapping_id, mapping in enumerate(journal['mappings']) if mapping_id in mapping_ids]
@@ -1,8 +1,21 @@
-from PyQt5.QtWidgets import QApplication
-from color_changer import ColorChangerApp
+import sys
+
+COMMANDS = ('scan', 'apply', 'undo', 'diff', 'transform')
+
+
+def run_gui():
+    # Qt is only imported for the GUI, batch commands run without it
+    from PyQt5.QtWidgets import QApplication
+    from color_changer import ColorChangerApp
 
-if __name__ == '__main__':
     app = QApplication([])
     window = ColorChangerApp()
     window.show()
     app.exec_()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        from cli import main
+        sys.exit(main())
+    run_gui()
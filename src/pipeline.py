@@ -0,0 +1,69 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_IO_THREADS = 4  # Threads reading and writing files, 0 does all I/O in the calling thread
+PENDING_PER_THREAD = 4  # Reads prefetched or writes queued per thread, bounds the memory held by a pipeline
+
+
+def prefetched(function, items, threads=DEFAULT_IO_THREADS, ahead=None):
+    """Yield (item, function(item)) in the order of items, calling function on a thread pool ahead of the consumer.
+
+    At most ahead results are pending. Exceptions are raised when the result
+    of their item is consumed.
+    """
+    if threads <= 0:
+        for item in items:
+            yield item, function(item)
+        return
+
+    ahead = ahead or threads * PENDING_PER_THREAD
+    executor = ThreadPoolExecutor(max_workers=threads)
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= ahead:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            result = future.result()
+            for next_item in items:
+                pending.append((next_item, executor.submit(function, next_item)))
+                break
+            yield item, result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class WriteBehind:
+    """Runs writes on a thread pool while the caller goes on, with at most limit writes queued.
+
+    submit blocks on the oldest write once the queue is full, so the new
+    contents held in memory stay bounded. close waits for every queued
+    write. The first error of a write is raised by submit or close, the
+    writes already queued are still completed.
+    """
+
+    def __init__(self, threads=DEFAULT_IO_THREADS, limit=None):
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.limit = limit or max(threads, 1) * PENDING_PER_THREAD
+        self.pending = deque()
+
+    def submit(self, function, *args):
+        if self.executor is None:
+            function(*args)
+            return
+        while len(self.pending) >= self.limit:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(function, *args))
+
+    def close(self):
+        if self.executor is None:
+            return
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown(wait=True)
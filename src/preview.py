@@ -0,0 +1,166 @@
+import os
+import re
+from collections import namedtuple
+from pipeline import DEFAULT_IO_THREADS, prefetched
+from replacer import ColorReplacer, is_svg, is_svg_reference
+from scanner import COLOR_LITERAL
+from textfiles import CHUNK_BYTES, SNIFF_BYTES, SkippedFile, sniff
+
+# Every color literal of a file, comments included, like the apply sees them
+literal_pattern = re.compile(COLOR_LITERAL, re.ASCII)
+
+DIFF_PAGE_FILES = 20  # Files shown per page of the diff preview
+
+# One page of diffs and the totals of the preview, a snapshot the UI thread can keep while the preview changes
+DiffPage = namedtuple('DiffPage', ['page', 'page_count', 'file_count', 'substitutions', 'text'])
+
+
+def read_literals(file_path):
+    """Return the set of color literals in a file, None for files larger than a chunk, which are not indexed.
+
+    Binary and oversized files have none, and SVG id references are left
+    out, like the apply does.
+    """
+    try:
+        with open(file_path, 'rb') as file_obj:
+            head = sniff(file_obj)
+            if len(head) == SNIFF_BYTES and os.fstat(file_obj.fileno()).st_size > CHUNK_BYTES:
+                return None
+            buffer = (head + file_obj.read()).decode('latin-1')
+    except (OSError, SkippedFile):
+        return set()
+    if not is_svg(file_path):
+        return set(literal_pattern.findall(buffer))
+    return {match.group() for match in literal_pattern.finditer(buffer)
+            if not is_svg_reference(buffer, match.start())}
+
+
+class DiffPreview:
+    """Per-file preview of what a set of mappings would change on disk.
+
+    Only the files containing an old color whose mapping changed are read
+    again, found through an index of the color literals of every file. Diff
+    texts are only computed for the files shown.
+    """
+
+    def __init__(self, file_paths, io_threads=DEFAULT_IO_THREADS):
+        self.file_paths = list(file_paths)  # Files an apply would rewrite, in traversal order
+        self.positions = {file_path: position for position, file_path in enumerate(self.file_paths)}
+        self.io_threads = io_threads  # Threads reading files ahead while indexing
+        self.file_literals = {}  # File path -> its color literals, None if too large to index, never mutated once set
+        self.literal_files = None  # Color literal -> positions of the files containing it, None until indexed
+        self.large_files = []  # Positions of the files too large to index, read whenever a mapping changes
+        self.mappings = {}  # Mappings the preview is up to date with
+        self.replacer = ColorReplacer({})
+        self.changes = {}  # File path -> substitutions per old color, for the files that change
+        self.diffs = {}  # File path -> unified diff, filled in as files are shown
+
+    def reuse_index(self, preview, changed_paths):
+        """Take over the literals another preview indexed for the files that did not change since."""
+        changed_paths = set(changed_paths)
+        self.file_literals = {file_path: literals for file_path, literals in preview.file_literals.items()
+                              if file_path in self.positions and file_path not in changed_paths}
+
+    def index_files(self, progress=None, cancelled=None):
+        """Index the color literals of every file not indexed yet, returns False if cancelled."""
+        file_literals = dict(self.file_literals)
+        missing = [file_path for file_path in self.file_paths if file_path not in file_literals]
+        for file_count, (file_path, literals) in enumerate(prefetched(read_literals, missing, self.io_threads), 1):
+            if cancelled and cancelled():
+                return False
+            file_literals[file_path] = literals
+            if progress:
+                progress(file_count, len(missing))
+
+        literal_files = {}
+        large_files = []
+        for position, file_path in enumerate(self.file_paths):
+            literals = file_literals[file_path]
+            if literals is None:
+                large_files.append(position)
+            else:
+                for literal in literals:
+                    literal_files.setdefault(literal, []).append(position)
+        self.file_literals = file_literals
+        self.literal_files = literal_files
+        self.large_files = large_files
+        return True
+
+    def stale_files(self, mappings):
+        """Return the files whose preview depends on mapping entries that differ from the cached ones."""
+        changed = {old_color for old_color in self.mappings.keys() | mappings.keys()
+                   if self.mappings.get(old_color) != mappings.get(old_color)}
+        if not changed:
+            return []
+        if not all(literal_pattern.fullmatch(old_color) for old_color in changed):
+            return list(self.file_paths)  # Not a literal the index knows, any file may contain it
+
+        positions = set(self.large_files)
+        for old_color in changed:
+            positions.update(self.literal_files.get(old_color, ()))
+        return [self.file_paths[position] for position in sorted(positions)]
+
+    def update(self, mappings, progress=None, cancelled=None):
+        """Bring the preview up to date with mappings, returns False if cancelled.
+
+        progress is called with the number of files read so far and their
+        total, starting over from 1 once the first update has indexed the
+        files. Nothing changes when cancelled() returns True midway.
+        """
+        if self.literal_files is None and not self.index_files(progress, cancelled):
+            return False
+
+        mappings = dict(mappings)
+        stale = self.stale_files(mappings)
+        replacer = ColorReplacer(mappings)
+        changes = {}
+
+        for file_count, file_path in enumerate(stale, 1):
+            if cancelled and cancelled():
+                return False
+            try:
+                counts = replacer.count_in_file(file_path)
+            except (OSError, UnicodeDecodeError, SkippedFile):
+                counts = None  # Unreadable and binary files are skipped by the apply as well
+            if counts:
+                changes[file_path] = counts
+            if progress:
+                progress(file_count, len(stale))
+
+        for file_path in stale:
+            self.diffs.pop(file_path, None)
+            self.changes.pop(file_path, None)
+        self.changes.update(changes)
+        self.mappings = mappings
+        self.replacer = replacer
+        return True
+
+    def changed_files(self):
+        """Files the mappings change, in traversal order."""
+        return sorted(self.changes, key=self.positions.__getitem__)
+
+    def diff(self, file_path, label=None):
+        """Return the unified diff of a changed file, computing it the first time it is asked for."""
+        diff = self.diffs.get(file_path)
+        if diff is None:
+            try:
+                diff = self.replacer.diff_file(file_path, label)
+            except (OSError, UnicodeDecodeError, SkippedFile) as e:
+                diff = f"{label or file_path}: {e}\n"
+            self.diffs[file_path] = diff
+        return diff
+
+    def page(self, page, directory):
+        """Return the DiffPage of one page of changed files, labelled relative to directory.
+
+        page is clamped to the pages there are, so a page past the end
+        after an update shows the last one.
+        """
+        files = self.changed_files()
+        page_count = max(1, -(-len(files) // DIFF_PAGE_FILES))
+        page = min(max(page, 0), page_count - 1)
+        substitutions = sum(sum(counts.values()) for counts in self.changes.values())
+        start = page * DIFF_PAGE_FILES
+        text = ''.join(self.diff(file_path, os.path.relpath(file_path, directory))
+                       for file_path in files[start:start + DIFF_PAGE_FILES])
+        return DiffPage(page, page_count, len(files), substitutions, text)
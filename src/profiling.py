@@ -0,0 +1,173 @@
+import cProfile
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+SLOWEST_FILES = 10  # Files listed in the slowest files of a report
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+PROFILE_ENV = 'COLOR_CHANGER_PROFILE'  # Set to a profile mode to profile the runs of the GUI
+TRACEMALLOC_FRAMES = 10  # Frames kept per allocation, more frames cost more memory while tracing
+TRACEMALLOC_TOP = 50  # Allocation sites written to the tracemalloc dump
+
+
+class RunStats:
+    """Wall and CPU time per phase of a scan or apply, with throughput and the slowest files.
+
+    Phases timed in several processes or threads at once add up their time
+    across them.
+    """
+
+    def __init__(self, name, slowest_count=SLOWEST_FILES):
+        self.name = name  # Kind of run, e.g. 'scan' or 'apply'
+        self.slowest_count = slowest_count
+        self.phases = {}  # Phase name -> [wall seconds, CPU seconds, calls]
+        self.files = 0
+        self.bytes = 0
+        self.matches = 0  # Color events scanned, or substitutions applied
+        self.slowest = []  # Min-heap of (seconds, file path)
+        self.profile_path = None  # Dump written by profiled, if the run was profiled
+        self.started = time.perf_counter()
+        self.finished = None
+        self.lock = threading.Lock()  # Phases and slowest files are updated from I/O threads too
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of code as part of a phase."""
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def timed(self, name, function):
+        """Wrap a function so every call is timed as part of a phase."""
+        def timed_function(*args, **kwargs):
+            with self.phase(name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def add_time(self, name, wall, cpu=None, calls=1):
+        with self.lock:
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = [0.0, 0.0, 0]
+            entry[0] += wall
+            entry[1] += wall if cpu is None else cpu  # Work measured elsewhere, e.g. in a worker process
+            entry[2] += calls
+
+    def add_entries(self, entries):
+        """Count the manifest entries a run goes through."""
+        self.files += len(entries)
+        self.bytes += sum(entry.size for entry in entries)
+
+    def add_file_time(self, file_path, seconds):
+        """Keep track of the slowest files."""
+        with self.lock:
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, (seconds, file_path))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, file_path))
+
+    def add_scan(self, file_path, timings):
+        """Record the (read seconds, lex seconds, size) of a file scanned by scanner.lex_file."""
+        read_seconds, lex_seconds, size = timings
+        self.add_time('read', read_seconds)
+        self.add_time('lex', lex_seconds)
+        self.add_file_time(file_path, read_seconds + lex_seconds)
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def report(self):
+        """Return the stats as a JSON serializable dict, running totals if the run is not finished."""
+        wall = (self.finished or time.perf_counter()) - self.started
+        with self.lock:
+            phases = [(name, list(entry)) for name, entry in self.phases.items()]
+            slowest = sorted(self.slowest, reverse=True)
+        return {
+            'name': self.name,
+            'wall': wall,
+            'files': self.files,
+            'bytes': self.bytes,
+            'matches': self.matches,
+            'files_per_second': self.files / wall if wall else 0.0,
+            'bytes_per_second': self.bytes / wall if wall else 0.0,
+            'phases': {name: {'wall': wall, 'cpu': cpu, 'calls': calls}
+                       for name, (wall, cpu, calls) in phases},
+            'slowest_files': [{'path': file_path, 'seconds': seconds}
+                              for seconds, file_path in slowest],
+            'profile': self.profile_path,
+        }
+
+
+def format_report(report):
+    """Render a report as text, e.g. for the stats panel."""
+    lines = [f"{report['name']}: {report['wall']:.3f} s, {report['files']} file(s), "
+             f"{report['bytes'] / 1e6:.1f} MB, {report['matches']} match(es)",
+             f"  {report['files_per_second']:.0f} files/s, {report['bytes_per_second'] / 1e6:.1f} MB/s"]
+    for name, phase in sorted(report['phases'].items(), key=lambda item: -item[1]['wall']):
+        lines.append(f"  {name:<10} {phase['wall']:9.3f} s wall {phase['cpu']:9.3f} s CPU {phase['calls']:8} call(s)")
+    if report['slowest_files']:
+        lines.append('  Slowest files:')
+        lines.extend(f"    {slow['seconds'] * 1000:8.1f} ms  {slow['path']}" for slow in report['slowest_files'])
+    if report['profile']:
+        lines.append(f"  Profile written to {report['profile']}")
+    return '\n'.join(lines) + '\n'
+
+
+def save_report(report, report_path):
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+        f.write('\n')
+
+
+def environment_profile_mode():
+    """Return the profile mode set in the environment, None if unset or unknown."""
+    mode = os.environ.get(PROFILE_ENV)
+    return mode if mode in PROFILE_MODES else None
+
+
+def default_profile_path(name, mode):
+    """Return a fresh dump path in the temporary directory for a profiled run."""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = 'prof' if mode == 'cprofile' else 'txt'
+    return os.path.join(tempfile.gettempdir(), f"color_changer_{name}_{timestamp}.{extension}")
+
+
+@contextmanager
+def profiled(mode, profile_path):
+    """Run a block under cProfile or tracemalloc and dump the results to profile_path, mode None does nothing.
+
+    cProfile dumps load with pstats (or snakeviz), tracemalloc dumps are the
+    peak traced memory followed by the top allocation sites as text. Only
+    the calling thread is profiled by cProfile.
+    """
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+    elif mode == 'tracemalloc':
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(profile_path, 'w', encoding='utf-8') as f:
+                f.write(f"Peak traced memory: {peak / 1e6:.1f} MB, at the end: {current / 1e6:.1f} MB\n\n")
+                for statistic in snapshot.statistics('traceback')[:TRACEMALLOC_TOP]:
+                    f.write(f"{statistic}\n")
+                    f.writelines(f"    {line}\n" for line in statistic.traceback.format())
+    else:
+        yield
@@ -0,0 +1,100 @@
+from array import array
+
+USAGE_LINE_BYTES = 4096  # Longest usage line read back, lines of minified files can be megabytes long
+
+
+class FileTable:
+    """Interned file paths, usage sites refer to files by their index."""
+
+    __slots__ = ('paths', 'ids')
+
+    def __init__(self, paths=()):
+        self.paths = list(paths)
+        self.ids = {path: file_id for file_id, path in enumerate(self.paths)}
+
+    def intern(self, path):
+        """Return the id of path, adding it to the table if needed."""
+        file_id = self.ids.get(path)
+        if file_id is None:
+            file_id = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+        return file_id
+
+
+class ColorRecord:
+    """A scanned color with its usage sites packed into arrays.
+
+    Usage sites are (file id, line number, byte offset of the line) triples,
+    the line text itself is only read from disk when it is shown.
+    """
+
+    __slots__ = ('name', 'line', 'usage_count', 'file_ids', 'line_numbers', 'offsets', 'alternative', 'key')
+
+    def __init__(self, name, line, alternative, key=None):
+        self.name = name  # Variable name, or the color itself for SVG colors
+        self.line = line  # Line the color was first found on
+        self.usage_count = 0
+        self.file_ids = array('I')
+        self.line_numbers = array('I')
+        self.offsets = array('Q')
+        self.alternative = alternative  # Hex <-> rgba representation
+        self.key = key  # Canonical RGBA key shared by equivalent spellings, see color_table
+
+    def add_usage(self, file_id, line_number, offset):
+        self.usage_count += 1
+        self.file_ids.append(file_id)
+        self.line_numbers.append(line_number)
+        self.offsets.append(offset)
+
+    def extend_sites(self, other):
+        """Take over the usage sites collected by another record."""
+        self.usage_count += other.usage_count
+        self.file_ids.extend(other.file_ids)
+        self.line_numbers.extend(other.line_numbers)
+        self.offsets.extend(other.offsets)
+
+    def remove_file_sites(self, file_id):
+        """Drop the usage sites of one file, e.g. before merging its new scan result."""
+        keep = [index for index, site_file_id in enumerate(self.file_ids) if site_file_id != file_id]
+        if len(keep) == len(self.file_ids):
+            return
+        self.usage_count -= len(self.file_ids) - len(keep)
+        self.file_ids = array('I', [self.file_ids[index] for index in keep])
+        self.line_numbers = array('I', [self.line_numbers[index] for index in keep])
+        self.offsets = array('Q', [self.offsets[index] for index in keep])
+
+    def sort_sites(self):
+        """Put usage sites back in traversal order after sites were merged in late."""
+        sites = sorted(zip(self.file_ids, self.line_numbers, self.offsets))
+        self.file_ids = array('I', [site[0] for site in sites])
+        self.line_numbers = array('I', [site[1] for site in sites])
+        self.offsets = array('Q', [site[2] for site in sites])
+
+    def site_count(self):
+        return len(self.file_ids)
+
+    def usage_sites(self, start=0, stop=None):
+        """Return (file id, line number, offset) triples of a range of usage sites."""
+        return list(zip(self.file_ids[start:stop], self.line_numbers[start:stop], self.offsets[start:stop]))
+
+
+def read_usage_lines(file_table, sites):
+    """Read the text of usage sites, opening each file once."""
+    lines = [None] * len(sites)
+    by_file = {}
+    for index, (file_id, line_number, offset) in enumerate(sites):
+        by_file.setdefault(file_id, []).append((index, line_number, offset))
+
+    for file_id, file_sites in by_file.items():
+        file_path = file_table.paths[file_id]
+        try:
+            with open(file_path, 'rb') as f:
+                for index, line_number, offset in file_sites:
+                    f.seek(offset)
+                    text = f.readline(USAGE_LINE_BYTES).decode('utf-8', errors='replace').strip()
+                    lines[index] = (file_path, line_number, text)
+        except OSError:
+            for index, line_number, offset in file_sites:
+                lines[index] = (file_path, line_number, '<file is no longer readable>')
+
+    return lines
@@ -0,0 +1,321 @@
+import difflib
+import re
+import time
+from atomic import AtomicWriter
+from journal import new_hash, text_digest
+from pipeline import DEFAULT_IO_THREADS, WriteBehind, prefetched
+from textfiles import CHUNK_BYTES, SkippedFile, open_text
+
+# Characters that continue a color token (e.g. '#abc' inside '#abcdef' or a 'rgb(' inside 'argb(')
+TOKEN_CHARS = r'[0-9A-Za-z_-]'
+
+# Text before an id reference in SVGs (href="#grad", xlink:href too, url(#clip)), hex-like ids there are not colors
+SVG_REFERENCE_PREFIXES = ('href="', "href='", 'url(', 'url("', "url('")
+SVG_REFERENCE_GUARD = ''.join(f'(?<!{re.escape(prefix)}\\#)' for prefix in SVG_REFERENCE_PREFIXES)
+LOOKBEHIND = max(map(len, SVG_REFERENCE_PREFIXES))  # Characters a match may look at before its start
+
+
+def is_svg(file_path):
+    return file_path.lower().endswith('.svg')
+
+
+def is_svg_reference(text, start):
+    """Whether the '#' at text[start] starts an id reference of an SVG rather than a color."""
+    return text.endswith(SVG_REFERENCE_PREFIXES, max(start - LOOKBEHIND, 0), start)
+
+
+def trie_pattern(node, previous=None, hash_guard=''):
+    """Regex of the colors in a trie node, previous being the character leading to it (None at the root).
+
+    hash_guard is checked right after a color's leading '#', see SVG_REFERENCE_GUARD.
+    """
+    branches = []
+    for char, child in sorted(item for item in node.items() if item[0] is not None):
+        branch = re.escape(char)
+        if previous is None and re.match(TOKEN_CHARS, char):
+            # Only match whole tokens so 'rgb(' never matches inside 'argb(', checked once the first character matched
+            branch += f'(?<!{TOKEN_CHARS}{re.escape(char)})'
+        elif previous is None and char == '#':
+            branch += hash_guard
+        branches.append(branch + trie_pattern(child, char))
+    if None in node:
+        # Longer colors sharing this prefix are tried first, and '#abc' never matches part of '#abcdef'
+        branches.append(f'(?!{TOKEN_CHARS})' if re.match(TOKEN_CHARS, previous) else '')
+    return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+
+class ColorReplacer:
+    """Replace every mapped color in a single pass over a piece of text."""
+
+    def __init__(self, mappings):
+        self.mappings = dict(mappings)  # Old color value -> new color value
+        self.pattern = self.build_pattern(self.mappings)
+        self.svg_pattern = self.build_pattern(self.mappings, SVG_REFERENCE_GUARD)  # Leaves id references alone
+        self.overlap = max(map(len, self.mappings), default=0) + 1  # Text a match may need past its start, lookahead included
+
+    @staticmethod
+    def build_pattern(mappings, hash_guard=''):
+        """Build one regex matching all old colors, longest first.
+
+        The old colors are merged into a trie, so the regex engine walks
+        their common prefixes once instead of trying every color in turn at
+        each '#' or 'r', and each position is dismissed by its first
+        character.
+        """
+        if not mappings:
+            return None
+
+        trie = {}
+        for old_color in mappings:
+            node = trie
+            for char in old_color:
+                node = node.setdefault(char, {})
+            node[None] = None  # A color ends here
+        return re.compile(trie_pattern(trie, hash_guard=hash_guard))
+
+    def replace(self, content, edits=None, svg=False):
+        """Return the new content and the number of substitutions per old color.
+
+        With an edits list, the (offset in the new content, old color) of
+        every substitution is appended to it, see journal.ApplyJournal.
+        With svg, id references that look like hex colors are left alone.
+        """
+        counts = {}
+        pattern = self.svg_pattern if svg else self.pattern
+        if pattern is None:
+            return content, counts
+        shift = 0  # Length the new content gained so far
+
+        def substitute(match):
+            nonlocal shift
+            old_color = match.group(0)
+            counts[old_color] = counts.get(old_color, 0) + 1
+            new_color = self.mappings[old_color]
+            if edits is not None:
+                edits.append((match.start() + shift, old_color))
+                shift += len(new_color) - len(old_color)
+            return new_color
+
+        return pattern.sub(substitute, content), counts
+
+    def count(self, content, svg=False):
+        """Return the number of substitutions per old color replace would make."""
+        counts = {}
+        pattern = self.svg_pattern if svg else self.pattern
+        if pattern is not None:
+            for match in pattern.finditer(content):
+                old_color = match.group(0)
+                counts[old_color] = counts.get(old_color, 0) + 1
+        return counts
+
+    def replace_stream(self, source, write=None, edits=None, svg=False):
+        """Replace in a text stream chunk by chunk, passing the new text to write, returns the counts.
+
+        Matches ending in the last overlap characters of a chunk are left
+        for the next one. Without write the substitutions are only counted.
+        """
+        counts = {}
+        pattern = self.svg_pattern if svg else self.pattern
+        pending = ''  # Text not written yet, preceded by up to LOOKBEHIND characters of context
+        context = 0
+        written = 0  # Length of the new text so far
+        while True:
+            chunk = source.read(CHUNK_BYTES)
+            window = pending + chunk
+            stop = len(window) - self.overlap if chunk else len(window)
+            position = resume = context
+            if pattern is not None:
+                for match in pattern.finditer(window, context):
+                    if match.end() > stop:
+                        resume = match.start()
+                        break
+                    old_color = match.group(0)
+                    counts[old_color] = counts.get(old_color, 0) + 1
+                    new_color = self.mappings[old_color]
+                    written += match.start() - position
+                    if edits is not None:
+                        edits.append((written, old_color))
+                    written += len(new_color)
+                    if write:
+                        write(window[position:match.start()])
+                        write(new_color)
+                    position = match.end()
+                else:
+                    resume = max(stop, position)
+            else:
+                resume = max(stop, position)
+
+            if not chunk:
+                if write:
+                    write(window[position:])
+                return counts
+            written += resume - position
+            if write:
+                write(window[position:resume])
+            context = min(resume, LOOKBEHIND)
+            pending = window[resume - context:]
+
+    def count_in_file(self, file_path):
+        text, size = open_text(file_path)
+        with text:
+            if size > CHUNK_BYTES:
+                return self.replace_stream(text, svg=is_svg(file_path))
+            return self.count(text.read(), is_svg(file_path))
+
+    def diff_file(self, file_path, label=None):
+        """Return the unified diff the mappings would make to a file, empty if none."""
+        text, size = open_text(file_path)
+        with text:
+            content = text.read()
+
+        new_content, counts = self.replace(content, svg=is_svg(file_path))
+        if not counts:
+            return ''
+
+        label = label or file_path
+        return ''.join(difflib.unified_diff(content.splitlines(keepends=True), new_content.splitlines(keepends=True),
+                                            f'a/{label}', f'b/{label}'))
+
+    def replace_in_file(self, file_path, before_write=None, journal=None, writer=None):
+        """Apply all mappings to a file, rewriting it once if anything changed.
+
+        before_write is called right before a changed file is rewritten,
+        e.g. to back it up. Binary and oversized files raise
+        textfiles.SkippedFile.
+        """
+        owned = writer is None
+        writer = writer or AtomicWriter()
+        try:
+            text, size = open_text(file_path)
+            with text:
+                if size > CHUNK_BYTES:
+                    return self.replace_large_file(text, file_path, before_write, journal, writer)
+                content = text.read()
+
+            edits = [] if journal is not None else None
+            new_content, counts = self.replace(content, edits, is_svg(file_path))
+            if counts:
+                write_file(file_path, new_content, before_write, writer, journal, edits)
+            return counts
+        finally:
+            if owned:
+                writer.close()
+
+    def replace_large_file(self, text, file_path, before_write, journal, writer):
+        """Stream a large file into the temporary file of writer, which replaces it if anything changed."""
+        edits = [] if journal is not None else None
+        hasher = new_hash()
+        temp_file, temp_path = writer.begin(file_path)
+        try:
+            def write(new_text):
+                temp_file.write(new_text)
+                if journal is not None:
+                    hasher.update(new_text.encode('utf-8'))
+
+            counts = self.replace_stream(text, write, edits, is_svg(file_path))
+            if counts and before_write:
+                before_write(file_path)
+        except BaseException:
+            writer.discard(temp_file, temp_path)
+            raise
+        if not counts:
+            writer.discard(temp_file, temp_path)
+            return counts
+
+        writer.commit(temp_file, temp_path, file_path)
+        if journal is not None:
+            journal.add(file_path, edits, hasher.hexdigest())  # Only once the file was replaced
+        return counts
+
+
+def read_file(file_path):
+    """Read a file for replace_in_files, returns (its text, read seconds).
+
+    The text is a textfiles.SkippedFile or UnicodeDecodeError for files
+    that are left untouched, and None for files larger than a chunk, which
+    are streamed by ColorReplacer.replace_in_file instead.
+    """
+    start = time.perf_counter()
+    try:
+        text, size = open_text(file_path)
+        with text:
+            content = text.read() if size <= CHUNK_BYTES else None
+    except (SkippedFile, UnicodeDecodeError) as error:
+        content = error
+    return content, time.perf_counter() - start
+
+
+def write_file(file_path, content, before_write, writer, journal=None, edits=None):
+    """Replace a file with its new content through writer (see atomic.AtomicWriter), calling before_write first.
+
+    The edits of the file are recorded in journal once it was replaced, so
+    a failed write never leaves an entry that cannot be undone.
+    """
+    if before_write:
+        before_write(file_path)
+    writer.write(file_path, content)
+    if journal is not None:
+        journal.add(file_path, edits, text_digest(content))
+
+
+def replace_in_files(replacer, file_paths, before_write=None, progress=None, stats=None, cancelled=None,
+                     io_threads=DEFAULT_IO_THREADS, journal=None, sync=True):
+    """Apply a replacer to every file, reporting substitutions per mapping and per file.
+
+    Files are read ahead and written back (before_write included) on
+    io_threads threads each, see pipeline, and replaced atomically, see
+    atomic.AtomicWriter. progress is called with the number of files
+    processed, and when cancelled() returns True the remaining files are
+    left untouched. Binary, oversized and non UTF-8 files are left untouched
+    and listed as skipped.
+    """
+    report = {'per_mapping': {}, 'per_file': {}, 'skipped': [], 'cancelled': False}
+    reads = prefetched(read_file, file_paths, io_threads)
+    writer = WriteBehind(io_threads)
+    atomic_writer = AtomicWriter(sync, io_threads)
+    write = stats.timed('write', write_file) if stats is not None else write_file
+    sync_directories = stats.timed('sync', atomic_writer.close) if stats is not None else atomic_writer.close
+
+    try:
+        for file_count, (file_path, (content, read_seconds)) in enumerate(reads, 1):
+            if cancelled and cancelled():
+                report['cancelled'] = True
+                break
+
+            start = time.perf_counter()
+            try:
+                if isinstance(content, Exception):
+                    raise content  # Skipped when it was read
+                if content is None:
+                    # Large file, streamed by this thread
+                    counts = replacer.replace_in_file(file_path, before_write, journal, atomic_writer)
+                else:
+                    edits = [] if journal is not None else None
+                    new_content, counts = replacer.replace(content, edits, is_svg(file_path))
+                    if counts:
+                        writer.submit(write, file_path, new_content, before_write, atomic_writer, journal, edits)
+            except (SkippedFile, UnicodeDecodeError):
+                counts = None
+                report['skipped'].append(file_path)
+
+            if stats is not None:
+                seconds = time.perf_counter() - start
+                stats.add_time('read', read_seconds)
+                stats.add_time('replace', seconds)
+                stats.add_file_time(file_path, read_seconds + seconds)
+                stats.matches += sum(counts.values()) if counts else 0
+            if counts:
+                report['per_file'][file_path] = counts
+                for old_color, count in counts.items():
+                    report['per_mapping'][old_color] = report['per_mapping'].get(old_color, 0) + count
+
+            if progress:
+                progress(file_count)
+    finally:
+        reads.close()
+        try:
+            writer.close()  # Writes of the files replaced so far are always completed
+        finally:
+            sync_directories()
+
+    return report
@@ -0,0 +1,242 @@
+import gc
+import os
+import struct
+import sys
+from array import array
+import numpy as np
+from collections import namedtuple
+from color_table import ColorTable
+from discovery import ManifestEntry
+from records import ColorRecord, FileTable
+
+MAGIC = b'CCSCAN\0\0'
+FORMAT_VERSION = 1  # Bump whenever the layout below changes, older files are then refused
+SCAN_EXTENSION = '.ccscan'
+NO_STRING = 0xFFFFFFFF  # String id of a missing name or line
+
+# Magic, version, directory string id, file types string id, then the number of strings, string
+# characters, manifest entries, interned files, colors and usage sites
+HEADER = struct.Struct('<8sHxxIIIQIIIQ4x')
+
+# A saved scan: the color definitions with their FileTable, and the manifest and file types they were scanned from
+SavedScan = namedtuple('SavedScan', ['directory', 'selected_filetypes', 'manifest', 'color_definitions', 'file_table'])
+
+
+class ScanFormatError(ValueError):
+    """A file that is not a saved scan, was saved by another format version, or is truncated."""
+
+
+class StringTable:
+    """Interned strings, saved as their character offsets followed by all of them as one UTF-8 blob.
+
+    Offsets count characters rather than bytes, so loading decodes the blob
+    once and slices it.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.offsets = array('Q', [0])
+        self.strings = []
+
+    def intern(self, string):
+        if string is None:
+            return NO_STRING
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            self.offsets.append(self.offsets[-1] + len(string))
+        return string_id
+
+
+def to_relative(path, directory):
+    """Store paths relative to the scanned directory with '/' separators, so saved scans move between machines."""
+    return os.path.relpath(path, directory).replace(os.sep, '/')
+
+
+def packed(values):
+    """Return the little endian bytes of an array (NumPy arrays are already little endian), padded to 8 bytes."""
+    if isinstance(values, array) and sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    data = values.tobytes()
+    return data + b'\0' * (-len(data) % 8)
+
+
+def save_scan(scan_path, directory, selected_filetypes, manifest, color_definitions, file_table):
+    """Write a complete scan to scan_path, see load_scan.
+
+    The file is written next to scan_path first, so an interrupted save
+    never leaves a truncated file.
+    """
+    data = pack_scan(directory, selected_filetypes, manifest, color_definitions, file_table)
+    temp_path = f"{scan_path}.saving"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, scan_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def pack_scan(directory, selected_filetypes, manifest, color_definitions, file_table):
+    """Return the bytes of a saved scan, see unpack_scan.
+
+    A header followed by packed arrays of strings, files, colors and usage
+    sites.
+    """
+    directory = os.path.abspath(directory)
+    strings = StringTable()
+    directory_id = strings.intern(directory)
+    filetypes_id = strings.intern(','.join(selected_filetypes))
+
+    manifest_paths = array('I', [strings.intern(to_relative(entry.path, directory)) for entry in manifest])
+    manifest_sizes = array('Q', [entry.size for entry in manifest])
+    manifest_mtimes = array('q', [entry.mtime for entry in manifest])
+    file_paths = array('I', [strings.intern(to_relative(path, directory)) for path in file_table.paths])
+
+    color_columns = [array('I') for _ in range(3)]  # Value, name and line string ids
+    site_starts = array('Q', [0])
+    file_ids, line_numbers, offsets = array('I'), array('I'), array('Q')
+    for color_value, record in color_definitions.items():
+        for column, string in zip(color_columns, (color_value, record.name, record.line)):
+            column.append(strings.intern(string))
+        file_ids.extend(record.file_ids)
+        line_numbers.extend(record.line_numbers)
+        offsets.extend(record.offsets)
+        site_starts.append(len(file_ids))
+
+    color_table = ColorTable()
+    rows = color_table.extend(list(color_definitions))
+    rgb, alpha, valid = color_table.rgb[rows], color_table.alpha[rows].astype('<f4'), color_table.valid[rows]
+
+    text = ''.join(strings.strings).encode('utf-8')
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, directory_id, filetypes_id, len(strings.strings), len(text),
+                         len(manifest), len(file_table.paths), len(color_definitions), len(file_ids))
+
+    return b''.join([header, packed(strings.offsets), text + b'\0' * (-len(text) % 8),
+                     *(packed(values) for values in (manifest_paths, manifest_sizes, manifest_mtimes, file_paths,
+                                                     *color_columns, rgb, alpha, valid, site_starts, file_ids,
+                                                     line_numbers, offsets))])
+
+
+class Reader:
+    """Unpacks the arrays of a saved scan from one bulk read, in the order save_scan wrote them."""
+
+    def __init__(self, data, position):
+        self.data = memoryview(data)
+        self.position = position
+
+    def take(self, typecode, count):
+        values = array(typecode)
+        size = values.itemsize * count
+        if self.position + size > len(self.data):
+            raise ScanFormatError('The saved scan is truncated')
+        values.frombytes(self.data[self.position:self.position + size])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        self.position += size + (-size % 8)
+        return values
+
+    def take_numpy(self, dtype, shape):
+        size = np.dtype(dtype).itemsize * int(np.prod(shape))
+        if self.position + size > len(self.data):
+            raise ScanFormatError('The saved scan is truncated')
+        values = np.frombuffer(self.data, dtype, int(np.prod(shape)), self.position).reshape(shape)
+        self.position += size + (-size % 8)
+        return values.astype(np.dtype(dtype).newbyteorder('='))  # Native byte order, and a copy owning its memory
+
+    def take_text(self, size):
+        if self.position + size > len(self.data):
+            raise ScanFormatError('The saved scan is truncated')
+        text = str(self.data[self.position:self.position + size], 'utf-8')
+        self.position += size + (-size % 8)
+        return text
+
+
+def load_scan(scan_path, directory=None):
+    """Read a scan written by save_scan in a single read, without touching the scanned files.
+
+    Paths are resolved against directory, by default the directory the scan
+    was saved from, so a scan shared from another machine can be opened on a
+    checkout of the same theme elsewhere. Raises ScanFormatError for files
+    that cannot be loaded.
+    """
+    with open(scan_path, 'rb') as f:
+        data = f.read()
+    return unpack_scan(data, scan_path, directory)
+
+
+def unpack_scan(data, scan_path, directory=None):
+    """Rebuild a SavedScan from the bytes of a saved scan, scan_path naming them in errors, see load_scan."""
+    collecting = gc.isenabled()
+    gc.disable()  # Loading only creates objects, collections would walk the new records over and over
+    try:
+        return rebuild_scan(data, scan_path, directory)
+    except (IndexError, UnicodeDecodeError) as e:
+        raise ScanFormatError(f'{scan_path} is corrupt') from e
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def rebuild_scan(data, scan_path, directory):
+    """Unpack the header and arrays of a saved scan, see unpack_scan."""
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        raise ScanFormatError(f'{scan_path} is not a saved scan')
+    (magic, version, directory_id, filetypes_id, string_count, text_size, manifest_count, file_count, color_count,
+     site_count) = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ScanFormatError(f'{scan_path} was saved in format {version}, only format {FORMAT_VERSION} can be read')
+
+    reader = Reader(data, HEADER.size)
+    string_offsets = reader.take('Q', string_count + 1).tolist()
+    text = reader.take_text(text_size)
+    strings = [text[start:stop] for start, stop in zip(string_offsets, string_offsets[1:])]
+    strings.append(None)  # What string() returns for NO_STRING
+
+    def string(string_id):
+        return strings[string_id if string_id != NO_STRING else -1]
+
+    manifest_paths = reader.take('I', manifest_count)
+    manifest_sizes = reader.take('Q', manifest_count)
+    manifest_mtimes = reader.take('q', manifest_count)
+    file_paths = reader.take('I', file_count)
+
+    directory = os.path.abspath(directory or strings[directory_id])
+    paths = {path_id: os.path.join(directory, *strings[path_id].split('/'))
+             for path_id in set(manifest_paths) | set(file_paths)}
+    manifest = [ManifestEntry(paths[path_id], size, mtime, os.path.splitext(paths[path_id])[1].lower())
+                for path_id, size, mtime in zip(manifest_paths, manifest_sizes, manifest_mtimes)]
+    file_table = FileTable([paths[path_id] for path_id in file_paths])
+
+    values, names, lines = (reader.take('I', color_count) for _ in range(3))
+    rgb = reader.take_numpy(np.uint8, (color_count, 3))
+    alpha = reader.take_numpy('<f4', color_count)
+    valid = reader.take_numpy(bool, color_count)
+    site_starts = reader.take('Q', color_count + 1)
+    file_ids = reader.take('I', site_count)
+    line_numbers = reader.take('I', site_count)
+    offsets = reader.take('Q', site_count)
+
+    color_values = [strings[value_id] for value_id in values]
+    color_table = ColorTable.from_parsed(color_values, rgb, alpha, valid)
+    rows = color_table.all_rows()
+    valid = valid.tolist()
+    keys = color_table.keys(rows).tolist()
+    alternatives = color_table.alternatives(rows)
+
+    color_definitions = {}
+    for index, color_value in enumerate(color_values):
+        record = ColorRecord(string(names[index]), string(lines[index]), alternatives[index],
+                             keys[index] if valid[index] else None)
+        start, stop = site_starts[index], site_starts[index + 1]
+        record.file_ids = file_ids[start:stop]
+        record.line_numbers = line_numbers[start:stop]
+        record.offsets = offsets[start:stop]
+        record.usage_count = stop - start
+        color_definitions[color_value] = record
+
+    selected_filetypes = [filetype for filetype in strings[filetypes_id].split(',') if filetype]
+    return SavedScan(directory, selected_filetypes, manifest, color_definitions, file_table)
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pipeline import DEFAULT_IO_THREADS
+from saved_scan import ScanFormatError, pack_scan, unpack_scan
+from scanner import ColorResolver, iter_scan_results
+from records import FileTable
+from textfiles import CHUNK_BYTES
+from utils import cache_dir
+
+SCHEMA_VERSION = 5  # Bump whenever the per-file result format of scanner.scan_file changes
+STORE_BATCH = 500  # Number of fresh results written per transaction
+
+
+def default_index_path():
+    """Return the scan index location under the user's cache directory."""
+    return os.path.join(cache_dir(), 'scan_index.sqlite3')
+
+
+def file_digest(file_path):
+    """Hash the contents of a file a chunk at a time."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def pack_result(result):
+    """Serialize a scan result as JSON, which reads back the same in any Python version unlike marshal."""
+    lines, events = result
+    return json.dumps([list(lines.items()), events], ensure_ascii=False, separators=(',', ':'))
+
+
+def unpack_result(data):
+    """Rebuild a scan result saved by pack_result, events come back as lists."""
+    lines, events = json.loads(data)
+    return dict(lines), events
+
+
+def directory_range(directory):
+    """Return the bounds of the paths stored below directory, for a range query on the primary key."""
+    prefix = os.path.join(os.path.abspath(directory), '')
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ScanIndex:
+    """Persistent per-file scan results keyed by absolute path, mtime and size.
+
+    With use_hash, touched files whose contents match are reused. The
+    resolved scan of each directory is kept as well, keyed by the digests of
+    its files.
+    """
+
+    def __init__(self, index_path=None, use_hash=False):
+        self.index_path = index_path or default_index_path()
+        self.use_hash = use_hash
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS files')  # Old result format, start over
+            self.connection.execute('DROP TABLE IF EXISTS resolved')
+            self.connection.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                'path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, '
+                                'digest BLOB, result TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS resolved ('
+                                'directory TEXT PRIMARY KEY, key BLOB, scan BLOB)')
+
+    def close(self):
+        self.connection.close()
+
+    def load_directory(self, directory):
+        """Fetch every entry stored below directory in one query."""
+        rows = self.connection.execute('SELECT path, mtime_ns, size, digest, result FROM files '
+                                       'WHERE path >= ? AND path < ?', directory_range(directory))
+        return {path: (mtime_ns, size, digest, result) for path, mtime_ns, size, digest, result in rows}
+
+    def load_results(self, paths):
+        """Fetch the stored results of some files, returns path -> result."""
+        results = {}
+        for path in paths:
+            row = self.connection.execute('SELECT result FROM files WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                results[path] = unpack_result(row[0])
+        return results
+
+    def prune(self, stored_paths, live_paths):
+        """Drop the entries of files that no longer exist."""
+        deleted = [(path,) for path in stored_paths
+                   if path not in live_paths and not os.path.exists(path)]
+        self.connection.executemany('DELETE FROM files WHERE path = ?', deleted)
+
+    def store(self, entries):
+        """Save (path, mtime_ns, size, digest, result) entries, hashing the files whose digest is None."""
+        rows = []
+        for path, mtime_ns, size, digest, result in entries:
+            if digest is None:
+                try:
+                    digest = file_digest(path)
+                except OSError:
+                    pass  # Stored without one, the resolved scan is not reused while it is missing
+            rows.append((path, mtime_ns, size, digest, pack_result(result)))
+        self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', rows)
+        self.connection.commit()
+
+    def resolved_key(self, directory, entries):
+        """Hash the paths and digests of manifest entries in order, None unless every one is stored unchanged."""
+        rows = self.connection.execute('SELECT path, mtime_ns, size, digest FROM files '
+                                       'WHERE path >= ? AND path < ?', directory_range(directory))
+        stored = {path: (mtime_ns, size, digest) for path, mtime_ns, size, digest in rows}
+        key = hashlib.blake2b(digest_size=16)
+        for entry in entries:
+            stored_entry = stored.get(entry.path)
+            if stored_entry is None or stored_entry[:2] != (entry.mtime, entry.size) or stored_entry[2] is None:
+                return None
+            key.update(os.fsencode(entry.path) + b'\0' + stored_entry[2])
+        return key.digest()
+
+    def load_resolved(self, directory, entries):
+        """Return the color definitions and FileTable stored for entries, None if any file changed since."""
+        key = self.resolved_key(directory, entries)
+        row = self.connection.execute('SELECT key, scan FROM resolved WHERE directory = ?',
+                                      (os.path.abspath(directory),)).fetchone()
+        if key is None or row is None or row[0] != key:
+            return None
+        try:
+            saved = unpack_scan(row[1], self.index_path, directory)
+        except ScanFormatError:
+            return None
+        return saved.color_definitions, saved.file_table
+
+    def store_resolved(self, directory, entries, color_definitions, file_table):
+        """Keep the merged and resolved scan of entries, replacing the one stored for directory."""
+        key = self.resolved_key(directory, entries)
+        if key is None:
+            return  # A file could not be hashed
+        scan = pack_scan(directory, [], [], color_definitions, file_table)
+        self.connection.execute('INSERT OR REPLACE INTO resolved VALUES (?, ?, ?)',
+                                (os.path.abspath(directory), key, scan))
+        self.connection.commit()
+
+    def scan(self, directory, entries, workers=1, stats=None, io_threads=DEFAULT_IO_THREADS):
+        """Scan manifest entries like scan_directory, reusing the resolved scan when no file changed."""
+        load_resolved = stats.timed('index', self.load_resolved) if stats is not None else self.load_resolved
+        resolved = load_resolved(directory, entries)
+        if resolved is not None:
+            return resolved
+
+        color_definitions, file_table = merge_results(self.iter_results(directory, entries, workers, stats,
+                                                                        io_threads), stats)
+        store_resolved = stats.timed('store', self.store_resolved) if stats is not None else self.store_resolved
+        store_resolved(directory, entries, color_definitions, file_table)
+        return color_definitions, file_table
+
+    def iter_results(self, directory, entries, workers=1, stats=None, io_threads=DEFAULT_IO_THREADS):
+        """Yield (file_path, result) for manifest entries in order, only re-parsing new or changed files."""
+        lookup_start = time.perf_counter()
+        stored = self.load_directory(directory)
+
+        cached = {}
+        stale = []  # Entries of files that need a fresh scan
+        digests = {}
+        touched = []  # (mtime, path) of entries whose contents are unchanged but whose mtime moved
+        for entry in entries:
+            stored_entry = stored.get(entry.path)
+            if stored_entry and stored_entry[0] == entry.mtime and stored_entry[1] == entry.size:
+                cached[entry.path] = stored_entry[3]
+                continue
+
+            if self.use_hash:
+                try:
+                    digests[entry.path] = file_digest(entry.path)
+                except OSError:
+                    continue  # Vanished since it was listed
+                if stored_entry and stored_entry[1] == entry.size and stored_entry[2] == digests[entry.path]:
+                    cached[entry.path] = stored_entry[3]
+                    touched.append((entry.mtime, entry.path))
+                    continue
+
+            stale.append(entry)
+
+        self.connection.executemany('UPDATE files SET mtime_ns = ? WHERE path = ?', touched)
+        self.prune(stored, {entry.path for entry in entries})
+        self.connection.commit()
+        if stats is not None:
+            stats.add_time('index', time.perf_counter() - lookup_start)
+
+        fresh = iter_scan_results([entry.path for entry in stale], workers, stats, io_threads)
+        store = stats.timed('store', self.store) if stats is not None else self.store
+        load = stats.timed('load', unpack_result) if stats is not None else unpack_result
+        stale_entries = {entry.path: entry for entry in stale}
+        pending = []
+
+        try:
+            for entry in entries:
+                if entry.path in cached:
+                    yield entry.path, load(cached[entry.path])
+                elif entry.path in stale_entries:
+                    file_path, result = next(fresh)
+                    pending.append((file_path, entry.mtime, entry.size, digests.get(file_path), result))
+                    if len(pending) >= STORE_BATCH:
+                        store(pending)
+                        pending.clear()
+                    yield file_path, result
+        finally:
+            fresh.close()
+            store(pending)
+
+
+def iter_directory_results(directory, entries, workers=1, use_index=True, stats=None, io_threads=DEFAULT_IO_THREADS):
+    """Yield (file_path, result) for manifest entries in order, through the scan index when enabled.
+
+    With stats (see profiling.RunStats) the index lookups and file scans are timed.
+    """
+    if not use_index:
+        yield from iter_scan_results([entry.path for entry in entries], workers, stats, io_threads)
+        return
+
+    scan_index = ScanIndex()
+    try:
+        yield from scan_index.iter_results(directory, entries, workers, stats, io_threads)
+    finally:
+        scan_index.close()
+
+
+def merge_results(results, stats=None):
+    """Merge (file_path, result) pairs in order, returning the color definitions and their FileTable."""
+    resolver = ColorResolver()
+    file_table = FileTable()
+    if stats is None:
+        for file_path, result in results:
+            resolver.merge(result, file_table.intern(file_path))
+        return resolver.finish(), file_table
+
+    for file_path, result in results:
+        with stats.phase('merge'):
+            resolver.merge(result, file_table.intern(file_path))
+        stats.matches += len(result[1])
+    with stats.phase('finish'):
+        color_definitions = resolver.finish()
+    return color_definitions, file_table
+
+
+def scan_directory(directory, entries, workers=1, use_index=True, stats=None, io_threads=DEFAULT_IO_THREADS):
+    """Scan manifest entries without any UI, returning the color definitions and their FileTable."""
+    if stats is not None:
+        stats.add_entries(entries)
+    if not use_index:
+        return merge_results(iter_scan_results([entry.path for entry in entries], workers, stats, io_threads), stats)
+
+    scan_index = ScanIndex()
+    try:
+        return scan_index.scan(directory, entries, workers, stats, io_threads)
+    finally:
+        scan_index.close()
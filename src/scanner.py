@@ -0,0 +1,605 @@
+import multiprocessing
+import os
+import re
+import time
+import xml.parsers.expat
+from concurrent.futures import ProcessPoolExecutor
+from color_table import ColorTable
+from pipeline import DEFAULT_IO_THREADS, prefetched
+from records import ColorRecord, FileTable
+from textfiles import CHUNK_BYTES, SNIFF_BYTES, SkippedFile, sniff
+
+# Literal colors: hex, rgb(), rgba(), hsl() and hsla(), [^\S\n] is whitespace that does not cross a line
+COLOR_LITERAL = (r'\#[0-9a-fA-F]{3,8}(?![\w-])'
+                 r'|rgba?\([^\S\n]*\d+,[^\S\n]*\d+,[^\S\n]*\d+(?:,[^\S\n]*[\d.]+)?[^\S\n]*\)'
+                 r'|hsla?\([^\S\n]*[\d.]+(?:deg)?,[^\S\n]*[\d.]+%,[^\S\n]*[\d.]+%(?:,[^\S\n]*[\d.]+)?[^\S\n]*\)')
+
+# Colors in SVG attribute values, url() references match without a group and are skipped
+attribute_color_pattern = re.compile(r'url\([^)]*\)|(' + COLOR_LITERAL + ')', re.ASCII)
+
+# One lexer for everything a scan looks for. Every alternative starts with a plain character so
+# the regex engine can skip ahead to candidate positions. Comments and @define-color rules with
+# values other than a color or a variable match without any group and produce no token.
+token_pattern = re.compile(
+    r'/\*.*?(?:\*/|\Z)|<!--.*?(?:-->|\Z)'
+    r'|@define-color[^\S\n]+(?P<define_name>[\w-]+)[^\S\n]+'
+    r'(?:(?P<define_value>' + COLOR_LITERAL + r')|(?P<define_alias>@[\w-]+))[^\S\n]*;'
+    r'|@define-color(?![\w-])'
+    r'|@(?P<at_name>[\w-]+)(?:[^\S\n]*:[^\S\n]*'
+    r'(?:(?P<at_value>' + COLOR_LITERAL + r')|(?P<at_alias>[$@][\w-]+)))?'
+    r'|\$(?P<dollar_name>[\w-]+)(?:[^\S\n]*:[^\S\n]*'
+    r'(?:(?P<dollar_value>' + COLOR_LITERAL + r')|(?P<dollar_alias>[$@][\w-]+)))?'
+    r'|' + COLOR_LITERAL,
+    re.ASCII | re.DOTALL)
+
+# Kinds of events produced by scan_file
+DEFINE, USE, SVG, ALIAS, REFERENCE = range(5)
+
+STREAMED = 'streamed'  # Buffer read_file returns for files lexed as a stream
+STREAM_OVERLAP = 4096  # Bytes carried over between the chunks of a streamed file, longer tokens may be missed
+PARALLEL_MIN_FILES = 256  # Smaller trees are scanned serially, process startup would dominate
+CHUNKS_PER_WORKER = 4  # More chunks than workers keeps the pool busy when file sizes vary
+
+# Presentation attributes that hold the colors of an SVG, style holds CSS declarations
+SVG_COLOR_ATTRIBUTES = frozenset(('fill', 'stroke', 'stop-color', 'flood-color', 'lighting-color', 'color', 'style'))
+
+# Variable tokens by the last group they matched: event kind, sigil and group of the variable name
+VARIABLE_TOKENS = {
+    'define_value': (DEFINE, '@', 'define_name'),
+    'define_alias': (ALIAS, '@', 'define_name'),
+    'at_value': (DEFINE, '@', 'at_name'),
+    'at_alias': (ALIAS, '@', 'at_name'),
+    'at_name': (REFERENCE, '@', 'at_name'),
+    'dollar_value': (DEFINE, '$', 'dollar_name'),
+    'dollar_alias': (ALIAS, '$', 'dollar_name'),
+    'dollar_name': (REFERENCE, '$', 'dollar_name'),
+}
+
+
+def extractor_for(file_path):
+    """Return the extractor registered for the extension of a file, scan_text for unknown types."""
+    return EXTRACTORS.get(os.path.splitext(file_path)[1].lower(), scan_text)
+
+
+def scan_file(file_path):
+    """Extract the raw color events of a single file with the extractor of its type, see scan_buffer."""
+    return timed_scan(file_path)[0]
+
+
+def read_file(file_path):
+    """Read a file as latin-1 for lex_file, returns (buffer, read seconds).
+
+    The buffer is None for binary and oversized files and STREAMED for files
+    larger than a chunk.
+    """
+    start = time.perf_counter()
+    with open(file_path, 'rb') as file_obj:
+        try:
+            head = sniff(file_obj)
+        except SkippedFile:
+            return None, time.perf_counter() - start
+
+        if len(head) == SNIFF_BYTES and os.fstat(file_obj.fileno()).st_size > CHUNK_BYTES:
+            return STREAMED, time.perf_counter() - start
+        buffer = (head + file_obj.read()).decode('latin-1')
+    return buffer, time.perf_counter() - start
+
+
+def lex_file(file_path, read):
+    """Scan a file read by read_file, returns its result and (read seconds, lex seconds, size in bytes)."""
+    buffer, read_seconds = read
+    if buffer is None:
+        return ({}, []), (read_seconds, 0.0, 0)
+
+    start = time.perf_counter()
+    if buffer is STREAMED:
+        with open(file_path, 'rb') as file_obj:
+            head = sniff(file_obj)
+            if extractor_for(file_path) is scan_svg:
+                result, size = scan_svg_stream(file_obj, head)
+            else:
+                result, size = scan_stream(file_obj, head, False)
+        return result, (read_seconds, time.perf_counter() - start, size)  # Reading and lexing interleave
+
+    result = extractor_for(file_path)(buffer)
+    return result, (read_seconds, time.perf_counter() - start, len(buffer))
+
+
+def timed_scan(file_path):
+    """Scan a file, returns its result and (read seconds, lex seconds, size in bytes)."""
+    return lex_file(file_path, read_file(file_path))
+
+
+def lex(buffer, is_svg, lines, events, start, end, stop, base, line_number, line_start):
+    """Lex buffer[start:end] into lines and events, the loop behind scan_buffer and scan_stream.
+
+    Tokens ending after stop are left alone. Returns the position to resume
+    from, the line state there, and whether the token left there is an
+    unterminated comment.
+    """
+    line_end = -1
+    for match in token_pattern.finditer(buffer, start, end):
+        if match.end() > stop:
+            position = match.start()
+            if line_start < position:
+                newlines = buffer.count('\n', max(line_start, 0), position)
+                if newlines:
+                    line_number += newlines
+                    line_start = buffer.rfind('\n', 0, position) + 1
+            unterminated = match.lastgroup is None and match.group()[0] in '/<' and match.end() == end
+            return position, line_number, line_start, unterminated
+
+        token = match.lastgroup
+        if token is None:
+            color_value = match.group()
+            if color_value[0] in '/<@':
+                continue  # Comment or an @define-color rule without a color
+            kind = SVG if is_svg else USE
+            color_name = color_value if is_svg else None
+        else:
+            kind, sigil, name_group = VARIABLE_TOKENS[token]
+            color_name = sigil + match.group(name_group)
+            color_value = None if kind == REFERENCE else match.group(token)
+
+        position = match.start()
+        if position > line_end:
+            # Moved past the current line, count the newlines in between
+            newlines = buffer.count('\n', line_start if line_start > 0 else 0, position)
+            if newlines:
+                line_number += newlines
+                line_start = buffer.rfind('\n', 0, position) + 1
+            line_end = buffer.find('\n', position)
+            if line_end == -1:
+                line_end = len(buffer)
+
+        if (kind == DEFINE or kind == SVG) and line_number not in lines:
+            line = buffer[line_start if line_start > 0 else 0:line_end]
+            lines[line_number] = line.encode('latin-1').decode('utf-8', errors='replace').strip()
+        events.append((kind, color_value, color_name, line_number, base + line_start))
+
+    if stop < end:
+        newlines = buffer.count('\n', max(line_start, 0), stop)
+        if newlines:
+            line_number += newlines
+            line_start = buffer.rfind('\n', 0, stop) + 1
+    return stop, line_number, line_start, False
+
+
+def scan_buffer(buffer, is_svg, start=0, end=None):
+    """Extract the raw color events of a whole file read as latin-1, or of buffer[start:end].
+
+    Returns (lines, events), events being (kind, color_value, color_name,
+    line_number, offset) tuples in file order. References are resolved later
+    by ColorResolver.
+    """
+    lines = {}
+    events = []
+    end = len(buffer) if end is None else end
+    lex(buffer, is_svg, lines, events, start, end, end, 0, 1, 0)
+    return lines, events
+
+
+def scan_stream(file_obj, head, is_svg, chunk_size=CHUNK_BYTES):
+    """Lex a large file chunk by chunk with the tokenizer, returns its result and size.
+
+    Only a chunk and the overlap carried over from the previous one are in
+    memory, so tokens crossing a chunk boundary are still found. Comments
+    longer than the overlap are skipped without being carried. Line texts
+    longer than the overlap may be cut.
+    """
+    lines = {}
+    events = []
+    buffer = head.decode('latin-1')
+    base, line_number, line_start = 0, 1, 0  # File offset of buffer[0], line state at buffer[start]
+    start = 0  # Where lexing resumes in buffer, text before it is kept for the current line
+    size = len(buffer)
+
+    while True:
+        chunk = file_obj.read(chunk_size).decode('latin-1')
+        size += len(chunk)
+        buffer += chunk
+        stop = len(buffer) - STREAM_OVERLAP if chunk else len(buffer)
+        if stop <= 0:
+            continue
+
+        resume, line_number, line_start, in_comment = lex(buffer, is_svg, lines, events, start, len(buffer), stop,
+                                                          base, line_number, line_start)
+        if not chunk:
+            return (lines, events), size
+
+        if in_comment and len(buffer) - resume > STREAM_OVERLAP:
+            # Keep the opener of the comment and the bytes its terminator may start in
+            opener = '/*' if buffer.startswith('/*', resume) else '<!--'
+            tail = len(buffer) - 2
+            newlines = buffer.count('\n', resume, tail)
+            if newlines:
+                line_number += newlines
+                line_start = buffer.rfind('\n', 0, tail) + 1
+            buffer = opener + buffer[tail:]
+            shift = tail - len(opener)
+            start = 0
+        else:
+            shift = min(max(line_start, resume - STREAM_OVERLAP, 0), resume)
+            buffer = buffer[shift:]
+            start = resume - shift
+        base += shift
+        line_start -= shift
+
+
+def scan_text(buffer):
+    """Extractor of stylesheets and of every file type without an extractor of its own."""
+    return scan_buffer(buffer, False)
+
+
+def scan_svg(buffer):
+    """Extractor of SVG images, streaming the document through expat.
+
+    Only the color attributes (SVG_COLOR_ATTRIBUTES) and the stylesheets of
+    <style> elements are looked at, so ids in href="#abc" or url(#abc) are
+    not taken for colors. Documents expat cannot parse are lexed as text.
+    """
+    try:
+        return scan_svg_chunks([buffer])[0]
+    except xml.parsers.expat.ExpatError:
+        return scan_buffer(buffer, True)
+
+
+def scan_svg_stream(file_obj, head, chunk_size=CHUNK_BYTES):
+    """Parse a large SVG image chunk by chunk like scan_svg, returns its result and size.
+
+    Documents expat cannot parse are lexed as text by scan_stream, as
+    scan_svg lexes them with scan_buffer.
+    """
+    def chunks():
+        yield head.decode('latin-1')
+        while chunk := file_obj.read(chunk_size):
+            yield chunk.decode('latin-1')
+
+    try:
+        return scan_svg_chunks(chunks())
+    except xml.parsers.expat.ExpatError:
+        file_obj.seek(len(head))
+        return scan_stream(file_obj, head, True, chunk_size)
+
+
+def scan_svg_chunks(chunks):
+    """Parse an SVG document given as latin-1 text chunks with expat, returns its result and size.
+
+    Colors are turned into events once the rest of their line has been
+    read, and only the text from there on is kept, open <style> elements
+    included. Line texts longer than the stream overlap may be cut. Raises
+    ExpatError for documents expat cannot parse.
+    """
+    parser = xml.parsers.expat.ParserCreate()
+    parser.ordered_attributes = True
+    lines = {}
+    events = []
+    pending = []  # (position, color value, None) of colors in attributes, (start, None, end) of <style> contents
+    style_starts = []
+    buffer = ''
+    base = 0  # File offset of buffer[0]
+    cursor = 0  # File offset past the last color found in an attribute
+    line_number, line_start = 1, 0  # Line state, line_start relative to buffer, negative when the line began before it
+    counted = 0  # Position in buffer up to which the newlines are counted in the line state
+
+    def start_element(name, attributes):
+        nonlocal cursor
+        for index in range(0, len(attributes), 2):
+            if attributes[index] in SVG_COLOR_ATTRIBUTES:
+                cursor = max(cursor, parser.CurrentByteIndex)
+                for match in attribute_color_pattern.finditer(attributes[index + 1]):
+                    color_value = match.group(1)
+                    if color_value is None:
+                        continue
+                    position = buffer.find(color_value, max(cursor - base, 0))
+                    if position < 0:
+                        position = cursor  # Written with character references
+                    else:
+                        position += base
+                        cursor = position + len(color_value)
+                    pending.append((position, color_value, None))
+        if name == 'style' or name.endswith(':style'):
+            style_starts.append(base + buffer.find('>', max(cursor, parser.CurrentByteIndex) - base) + 1)
+
+    def end_element(name):
+        if (name == 'style' or name.endswith(':style')) and style_starts:
+            pending.append((style_starts.pop(), None, parser.CurrentByteIndex))
+
+    def advance(position):
+        """Move the line state to buffer[position], counting the newlines from where it was last moved."""
+        nonlocal line_number, line_start, counted
+        newlines = buffer.count('\n', counted, position)
+        if newlines:
+            line_number += newlines
+            line_start = buffer.rfind('\n', counted, position) + 1
+        counted = max(counted, position)
+
+    def flush(final):
+        """Turn the pending colors and stylesheets whose lines are complete into events, then drop the text before them."""
+        nonlocal buffer, base, line_number, line_start, counted
+        pending.sort(key=lambda item: item[0])  # <style> contents are added at their end
+        done = 0
+        for position, color_value, end in pending:
+            if style_starts and position >= style_starts[0]:
+                break  # Inside a <style> element that is still open
+            last = (position if end is None else end) - base
+            if not final and len(buffer) - last <= STREAM_OVERLAP and buffer.find('\n', last) < 0:
+                break  # The line may go on in the next chunk
+            if end is not None:
+                _, line_number, line_start, _ = lex(buffer, True, lines, events, position - base, end - base,
+                                                    end - base, base, line_number, line_start)
+                counted = max(line_start, counted)
+            else:
+                advance(position - base)
+                if line_number not in lines:
+                    line_end = buffer.find('\n', position - base)
+                    line = buffer[max(line_start, 0):line_end if line_end >= 0 else len(buffer)]
+                    lines[line_number] = line.encode('latin-1').decode('utf-8', errors='replace').strip()
+                events.append((SVG, color_value, color_value, line_number, base + line_start))
+            done += 1
+        del pending[:done]
+        if final:
+            return
+
+        # Tags expat has not reported yet start at the last '<', attribute values cannot contain one
+        keep = buffer.rfind('<')
+        if keep < 0:
+            keep = len(buffer)
+        if pending:
+            keep = min(keep, pending[0][0] - base)
+        if style_starts:
+            keep = min(keep, style_starts[0] - base)
+        advance(keep)
+        shift = max(line_start, keep - STREAM_OVERLAP, 0)
+        buffer = buffer[shift:]
+        base += shift
+        line_start -= shift
+        counted -= shift
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    size = 0
+    for chunk in chunks:
+        buffer += chunk
+        size += len(chunk)
+        parser.Parse(chunk.encode('latin-1'), False)
+        flush(False)
+    parser.Parse(b'', True)
+    flush(True)
+    return (lines, events), size
+
+
+# File extension -> function(buffer) returning the (lines, events) of a file, see scan_buffer
+EXTRACTORS = {}
+
+
+def register_extractor(extractor, *extensions):
+    for extension in extensions:
+        EXTRACTORS[extension] = extractor
+
+
+register_extractor(scan_text, '.css', '.scss', '.less')
+register_extractor(scan_svg, '.svg')
+
+
+class ColorResolver:
+    """Merge per-file scan results into color records, resolving variable references.
+
+    The first definition of a variable wins, and forward references are
+    counted once it turns up.
+    """
+
+    def __init__(self):
+        self.color_definitions = {}  # Color value -> ColorRecord
+        self.variables = {}  # Variable -> (color value, None) or (None, aliased variable)
+        self.pending_colors = {}  # Color value without a record yet -> ColorRecord holding its sites
+        self.pending_variables = {}  # Undefined variable -> ColorRecord holding the sites referring to it
+        self.unsorted = set()  # Color values whose sites were merged out of traversal order
+        self.color_table = ColorTable()  # Canonical RGBA of every color value
+        self.unconverted = []  # Color values whose records have no alternative yet
+
+    def resolve(self, variable):
+        """Follow aliases, returns (color value, None) or (None, the undefined variable ending the chain)."""
+        seen = set()
+        while variable not in seen:
+            seen.add(variable)
+            definition = self.variables.get(variable)
+            if definition is None:
+                return None, variable
+            color_value, variable = definition
+            if color_value is not None:
+                return color_value, None
+        return None, None  # Aliases form a cycle
+
+    def pending_record(self, pending, key):
+        record = pending.get(key)
+        if record is None:
+            record = pending[key] = ColorRecord(None, None, None)
+        return record
+
+    def record(self, color_value, color_name, line, touched):
+        """Return the record of a color, creating it with the sites seen before it existed."""
+        record = self.color_definitions.get(color_value)
+        if record is None:
+            record = self.color_definitions[color_value] = ColorRecord(color_name, line.strip(), None)
+            self.unconverted.append(color_value)
+            pending = self.pending_colors.pop(color_value, None)
+            if pending is not None:
+                record.extend_sites(pending)
+        elif record.name == color_value and color_name != color_value:
+            record.name, record.line = color_name, line.strip()  # First seen as an SVG color, now defined
+        touched.add(color_value)
+        return record
+
+    def reference(self, variable, site, touched):
+        """Count a reference to a variable, or keep it until the variable is defined."""
+        color_value, undefined = self.resolve(variable)
+        if color_value is not None:
+            self.color_definitions[color_value].add_usage(*site)
+            touched.add(color_value)
+        elif undefined is not None:
+            self.pending_record(self.pending_variables, undefined).add_usage(*site)
+
+    def define(self, variable, color_value, alias, touched):
+        """Define a variable, counting the references that were waiting for it."""
+        if variable in self.variables:
+            return
+        self.variables[variable] = (color_value, alias)
+
+        waiting = self.pending_variables.pop(variable, None)
+        if waiting is None:
+            return
+        color_value, undefined = self.resolve(variable)
+        if color_value is not None:
+            record = self.color_definitions[color_value]
+            if record.site_count():
+                self.unsorted.add(color_value)
+            record.extend_sites(waiting)
+            touched.add(color_value)
+        elif undefined is not None:
+            self.pending_record(self.pending_variables, undefined).extend_sites(waiting)
+
+    def site_records(self, result):
+        """Return (color value, record) of the records holding the sites of a merged result.
+
+        The color value is None for the records of colors and variables that
+        are not defined.
+        """
+        lines, events = result
+        records = {}
+        for kind, color_value, color_name, line_number, offset in events:
+            if kind == REFERENCE or kind == ALIAS:
+                color_value, undefined = self.resolve(color_name if kind == REFERENCE else color_value)
+                pending = self.pending_variables.get(undefined)
+            else:
+                pending = self.pending_colors.get(color_value)
+
+            record = self.color_definitions.get(color_value)
+            if record is not None:
+                records[id(record)] = (color_value, record)
+            elif pending is not None:
+                records[id(pending)] = (None, pending)
+        return list(records.values())
+
+    def merge(self, result, file_id):
+        """Apply the events of one file, returns the set of color values whose records changed."""
+        lines, events = result
+        touched = set()
+
+        for kind, color_value, color_name, line_number, offset in events:
+            site = (file_id, line_number, offset)
+            if kind == USE:
+                record = self.color_definitions.get(color_value)
+                if record is None:
+                    record = self.pending_record(self.pending_colors, color_value)
+                else:
+                    touched.add(color_value)
+                record.add_usage(*site)
+            elif kind == REFERENCE:
+                self.reference(color_name, site, touched)
+            elif kind == ALIAS:
+                self.define(color_name, None, color_value, touched)
+                self.reference(color_value, site, touched)  # The alias uses the variable it points to
+            else:
+                display_name = color_name if kind == SVG else color_name[1:]
+                self.record(color_value, display_name, lines[line_number], touched).add_usage(*site)
+                if kind == DEFINE:
+                    self.define(color_name, color_value, None, touched)
+
+        return touched
+
+    def convert(self):
+        """Fill in the alternative and canonical key of the new records in one bulk conversion."""
+        if not self.unconverted:
+            return
+        rows = self.color_table.extend(self.unconverted)
+        valid = self.color_table.valid[rows].tolist()
+        keys = self.color_table.keys(rows).tolist()
+        alternatives = self.color_table.alternatives(rows)
+        for index, color_value in enumerate(self.unconverted):
+            record = self.color_definitions[color_value]
+            record.alternative = alternatives[index]
+            record.key = keys[index] if valid[index] else None
+        self.unconverted = []
+
+    def finish(self):
+        """Convert the remaining records and restore the traversal order of usage sites, returns the color definitions."""
+        self.convert()
+        for color_value in self.unsorted:
+            self.color_definitions[color_value].sort_sites()
+        self.unsorted.clear()
+        return self.color_definitions
+
+
+def scan_files(file_paths, io_threads=DEFAULT_IO_THREADS):
+    """Yield (file_path, result, timings) in order, reading ahead on io_threads threads while lexing, see read_file."""
+    for file_path, read in prefetched(read_file, file_paths, io_threads):
+        yield (file_path, *lex_file(file_path, read))
+
+
+def scan_chunk(file_paths, io_threads=DEFAULT_IO_THREADS):
+    """Scan a chunk of files in a worker process, with the timings of each file."""
+    return [(result, timings) for file_path, result, timings in scan_files(file_paths, io_threads)]
+
+
+def chunk_by_size(file_paths, chunk_count):
+    """Split file_paths into contiguous chunks of roughly equal total size."""
+    sizes = []
+    for file_path in file_paths:
+        try:
+            sizes.append(os.path.getsize(file_path))
+        except OSError:
+            sizes.append(0)
+
+    target = max(sum(sizes) / chunk_count, 1)
+    chunks, chunk, chunk_size = [], [], 0
+    for file_path, size in zip(file_paths, sizes):
+        chunk.append(file_path)
+        chunk_size += size
+        if chunk_size >= target:
+            chunks.append(chunk)
+            chunk, chunk_size = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def iter_scan_results(file_paths, workers=1, stats=None, io_threads=DEFAULT_IO_THREADS):
+    """Yield (file_path, result) in traversal order, using worker processes for large trees.
+
+    Every process reads the next files on io_threads threads while it lexes
+    the current one.
+    """
+    if workers <= 1 or len(file_paths) < PARALLEL_MIN_FILES:
+        for file_path, result, timings in scan_files(file_paths, io_threads):
+            if stats is not None:
+                stats.add_scan(file_path, timings)
+            yield file_path, result
+        return
+
+    # Spawn rather than fork, the parent may be running Qt threads
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        chunks = chunk_by_size(file_paths, workers * CHUNKS_PER_WORKER)
+        futures = [executor.submit(scan_chunk, chunk, io_threads) for chunk in chunks]
+
+        # Consume futures in submission order so merging is deterministic
+        for chunk, future in zip(chunks, futures):
+            for file_path, (result, timings) in zip(chunk, future.result()):
+                if stats is not None:
+                    stats.add_scan(file_path, timings)
+                yield file_path, result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_colors_from_files(file_paths, workers=1):
+    """Extract colors from all files, merging per-file results in traversal order.
+
+    Returns the color definitions and the FileTable their usage sites refer to.
+    """
+    resolver = ColorResolver()
+    file_table = FileTable()
+    for file_path, result in iter_scan_results(file_paths, workers):
+        resolver.merge(result, file_table.intern(file_path))
+    return resolver.finish(), file_table
@@ -0,0 +1,46 @@
+import io
+import os
+
+SNIFF_BYTES = 8192  # Bytes read to tell text from binary files
+MAX_FILE_BYTES = 256 << 20  # Larger files are neither scanned nor rewritten
+CHUNK_BYTES = 1 << 20  # Larger files are scanned and rewritten in chunks of this size
+
+
+class SkippedFile(Exception):
+    """A file that is not scanned or rewritten, because it is binary or larger than MAX_FILE_BYTES."""
+
+
+def looks_binary(head):
+    """Tell binary data from text by its first bytes, like git: text never contains NUL bytes.
+
+    Images, fonts and archives have NUL bytes in their headers, so they are
+    told apart without reading further.
+    """
+    return b'\0' in head
+
+
+def sniff(file_obj, max_bytes=MAX_FILE_BYTES):
+    """Read the first bytes of a file opened in binary mode, raises SkippedFile for binary or oversized files."""
+    head = file_obj.read(SNIFF_BYTES)
+    if looks_binary(head):
+        raise SkippedFile(f"{file_obj.name} is a binary file")
+    if len(head) == SNIFF_BYTES and os.fstat(file_obj.fileno()).st_size > max_bytes:
+        raise SkippedFile(f"{file_obj.name} is larger than {max_bytes >> 20} MB")
+    return head
+
+
+def open_text(file_path, max_bytes=MAX_FILE_BYTES):
+    """Open a file as UTF-8 text once sniff accepts it, returns the text stream and the size of the file.
+
+    Line endings are not translated, so a rewritten file keeps its CRLF or
+    LF line endings byte for byte.
+    """
+    file_obj = open(file_path, 'rb')
+    try:
+        sniff(file_obj, max_bytes)
+        size = os.fstat(file_obj.fileno()).st_size
+        file_obj.seek(0)
+        return io.TextIOWrapper(file_obj, encoding='utf-8', newline=''), size
+    except BaseException:
+        file_obj.close()
+        raise
@@ -0,0 +1,117 @@
+import json
+import numpy as np
+from color_table import ColorTable, format_hex, format_rgba, hsl_to_rgb, rgb_to_hsl, rgb_to_lab
+
+CHAIN_VERSION = 1  # Bump whenever the format of saved transform chains changes
+PALETTE_BLOCK = 1 << 20  # Color to palette distances computed at once
+
+
+def hue_rotate(rgb, degrees):
+    hue, saturation, lightness = rgb_to_hsl(rgb)
+    return hsl_to_rgb(hue + degrees, saturation / 100, lightness / 100)
+
+
+def saturate(rgb, amount):
+    """Shift saturation by amount percentage points, negative values desaturate."""
+    hue, saturation, lightness = rgb_to_hsl(rgb)
+    return hsl_to_rgb(hue, (saturation + amount) / 100, lightness / 100)
+
+
+def lighten(rgb, amount):
+    """Shift lightness by amount percentage points, negative values darken."""
+    hue, saturation, lightness = rgb_to_hsl(rgb)
+    return hsl_to_rgb(hue, saturation / 100, (lightness + amount) / 100)
+
+
+def invert_lightness(rgb):
+    """Swap light and dark while keeping hue and saturation, e.g. to derive a dark variant."""
+    hue, saturation, lightness = rgb_to_hsl(rgb)
+    return hsl_to_rgb(hue, saturation / 100, (100 - lightness) / 100)
+
+
+def gamma(rgb, value):
+    """Raise every channel to value, values above 1 darken the midtones."""
+    return np.rint((rgb / 255) ** value * 255).astype(np.uint8)
+
+
+def nearest_in_palette(rgb, colors):
+    """Replace every color with the perceptually closest (CIELAB) color of a palette."""
+    palette = ColorTable()
+    rows = palette.extend(colors)
+    rows = rows[palette.valid[rows]]
+    if not len(rows):
+        raise ValueError("The target palette has no valid colors")
+    palette_rgb = palette.rgb[rows]
+    palette_lab = rgb_to_lab(palette_rgb)
+
+    lab = rgb_to_lab(rgb)
+    nearest = np.empty(len(rgb), np.intp)
+    block = max(1, PALETTE_BLOCK // len(rows))
+    for start in range(0, len(rgb), block):
+        distances = ((lab[start:start + block, None, :] - palette_lab[None, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + block] = distances.argmin(axis=1)
+    return palette_rgb[nearest]
+
+
+# Transform name -> (function, names of its parameters)
+TRANSFORMS = {
+    'hue_rotate': (hue_rotate, ('degrees',)),
+    'saturate': (saturate, ('amount',)),
+    'lighten': (lighten, ('amount',)),
+    'invert_lightness': (invert_lightness, ()),
+    'gamma': (gamma, ('value',)),
+    'palette': (nearest_in_palette, ('colors',)),
+}
+
+
+def apply_chain(chain, rgb):
+    """Run uint8 rgb rows through a chain of steps, e.g. [{'op': 'hue_rotate', 'degrees': 30}]."""
+    for step in chain:
+        if step.get('op') not in TRANSFORMS:
+            raise ValueError(f"Unknown transform: {step.get('op')!r}")
+        function, parameters = TRANSFORMS[step['op']]
+        missing = [parameter for parameter in parameters if parameter not in step]
+        if missing:
+            raise ValueError(f"Transform {step['op']} is missing {', '.join(missing)}")
+        rgb = function(rgb, *(step[parameter] for parameter in parameters))
+    return rgb
+
+
+def generate_mappings(color_definitions, chain):
+    """Transform the whole scanned palette at once, returns old -> new mappings of the colors that change.
+
+    Alpha is kept. Opaque colors map to hex values and translucent ones to
+    rgba(), so every new color passes is_valid_color and can go straight
+    to WorkerThread or replacer.ColorReplacer.
+    """
+    table = ColorTable()
+    rows = table.extend(list(color_definitions))
+    rows = rows[table.valid[rows]]
+    if not len(rows):
+        return {}
+
+    rgb = table.rgb[rows]
+    new_rgb = apply_chain(chain, rgb)
+    changed = np.flatnonzero((new_rgb != rgb).any(axis=1))
+
+    alpha = table.alpha[rows[changed]]
+    opaque = (alpha >= 1).tolist()
+    hex_values = format_hex(new_rgb[changed])
+    rgba_values = format_rgba(new_rgb[changed], alpha)
+    return {table.values[rows[index]]: hex_values[position] if opaque[position] else rgba_values[position]
+            for position, index in enumerate(changed.tolist())}
+
+
+def load_chain(chain_file):
+    """Read a transform chain saved by save_chain."""
+    with open(chain_file, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if saved.get('version') != CHAIN_VERSION:
+        raise ValueError(f"Unsupported transform chain version: {saved.get('version')!r}")
+    return saved['steps']
+
+
+def save_chain(chain, chain_file):
+    with open(chain_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': CHAIN_VERSION, 'steps': chain}, f, indent=1)
+        f.write('\n')
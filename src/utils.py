@@ -1,3 +1,4 @@
+import os
 import re
 
 def hex_to_rgba(hex_color, alpha=1.0):
@@ -45,3 +46,16 @@ def rgba_to_hex(rgba_color):
     raise ValueError("Invalid RGBA color format.")
 
 
+def is_valid_color(color):
+    """Check if the provided color is valid (either hex or rgba)."""
+    # Check for valid hex color (#RRGGBB or #RGB)
+    hex_pattern = r'^#([0-9A-Fa-f]{3}){1,2}$'
+    rgba_pattern = r'^rgba\((\d{1,3}), (\d{1,3}), (\d{1,3}), (\d(\.\d+)?)\)$'
+    
+    return bool(re.match(hex_pattern, color)) or bool(re.match(rgba_pattern, color))
+
+
+def cache_dir():
+    """Return the directory of the app under the user's cache directory (XDG_CACHE_HOME or ~/.cache)."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'color_changer')
@@ -0,0 +1,99 @@
+from discovery import select_entries
+from scanner import ALIAS, DEFINE, SVG, scan_file
+from scan_index import ScanIndex
+
+EMPTY_RESULT = ({}, [])  # Scan result of a file that is gone or was not scanned
+
+
+def changed_paths(old_manifest, new_manifest, selected_filetypes):
+    """Return the selected files that were added, modified or removed between two manifests."""
+    old_entries = {entry.path: entry for entry in select_entries(old_manifest, selected_filetypes)}
+    new_entries = {entry.path: entry for entry in select_entries(new_manifest, selected_filetypes)}
+    changed = [path for path, entry in new_entries.items() if old_entries.get(path) != entry]
+    changed.extend(path for path in old_entries if path not in new_entries)
+    return changed, old_entries, new_entries
+
+
+def read_changes(old_manifest, new_manifest, selected_filetypes):
+    """Rescan the files that changed between two manifests.
+
+    Returns (path, old result, new result) triples. Old results come from
+    the scan index, None if a file was scanned but its result is not stored.
+    New results are stored in the index so the next full scan reuses them.
+    """
+    changed, old_entries, new_entries = changed_paths(old_manifest, new_manifest, selected_filetypes)
+    if not changed:
+        return []
+
+    scan_index = ScanIndex()
+    try:
+        old_results = scan_index.load_results([path for path in changed if path in old_entries])
+        changes = []
+        fresh = []
+        for path in changed:
+            new_result = EMPTY_RESULT
+            entry = new_entries.get(path)
+            if entry is not None:
+                try:
+                    new_result = scan_file(path)
+                except OSError:
+                    pass  # Removed again since it was listed
+                else:
+                    fresh.append((path, entry.mtime, entry.size, None, new_result))
+            old_result = old_results.get(path) if path in old_entries else EMPTY_RESULT
+            changes.append((path, old_result, new_result))
+        scan_index.store(fresh)
+    finally:
+        scan_index.close()
+    return changes
+
+
+def definition_signature(result):
+    """What a file contributes to records and variables, rather than to usage sites."""
+    lines, events = result
+    definitions = []
+    svg_colors = set()
+    for kind, color_value, color_name, line_number, offset in events:
+        if kind == SVG:
+            svg_colors.add(color_value)
+        elif kind == DEFINE or kind == ALIAS:
+            definitions.append((kind, color_value, color_name, lines.get(line_number)))
+    return definitions, svg_colors
+
+
+class IncrementalScan:
+    """Applies rescanned files to the color definitions of a finished scan.
+
+    When the definitions of the changed files are the same as before, only
+    their usage sites move: the old sites are dropped and the new result is
+    merged. Otherwise which definition comes first may change anywhere in
+    the tree, and apply asks for a full rescan instead.
+    """
+
+    def __init__(self, resolver, file_table):
+        self.resolver = resolver  # ColorResolver that merged the scan
+        self.file_table = file_table
+
+    def apply(self, changes):
+        """Apply (path, old result, new result) triples from read_changes.
+
+        Returns the color values whose records changed, or None if the
+        directory has to be rescanned.
+        """
+        for path, old_result, new_result in changes:
+            if old_result is None or definition_signature(old_result) != definition_signature(new_result):
+                return None
+
+        resolver = self.resolver
+        touched = set()
+        for path, old_result, new_result in changes:
+            file_id = self.file_table.intern(path)
+            for color_value, record in resolver.site_records(old_result):
+                record.remove_file_sites(file_id)
+                if color_value is not None:
+                    touched.add(color_value)
+            touched |= resolver.merge(new_result, file_id)
+
+        resolver.unsorted |= touched  # The new sites were appended after those of later files
+        resolver.finish()
+        return touched
@@ -1,181 +1,286 @@
-import os
-import re
+import time
 from PyQt5.QtCore import QThread, pyqtSignal
-from utils import hex_to_rgba, rgba_to_rgb  # Import utility functions
+from replacer import ColorReplacer, replace_in_files
+from color_table import entered_mappings
+from backup import BackupSnapshot
+from journal import ApplyJournal
+from scanner import ColorResolver
+from records import FileTable
+from scan_index import iter_directory_results
+from discovery import DEFAULT_IGNORE_GLOBS, discover_files, manifest_extensions, select_entries
+from watch import read_changes
+from pipeline import DEFAULT_IO_THREADS
+from profiling import RunStats, default_profile_path, environment_profile_mode, profiled
+
+
+class ProgressMeter:
+    """Turns the work done into a percentage and an ETA, reported at most every interval seconds.
+
+    Work is weighted by bytes, plus a fixed cost per file so that trees of
+    tiny files do not look free. Throttling keeps a run over 100k files from
+    flooding the UI thread with signals.
+    """
+
+    interval = 0.1  # Seconds between two reports
+
+    def __init__(self, sizes, report, file_cost=4096):
+        self.file_cost = file_cost  # Bytes a file costs on top of its size, roughly opening and reading a page
+        self.total = max(sum(sizes) + file_cost * len(sizes), 1)  # Weight of all the work
+        self.report = report  # Called with the percentage and the ETA in seconds, -1 if unknown yet
+        self.done = 0
+        self.started = self.last_report = time.monotonic()
+
+    def advance(self, size):
+        """Count a processed file of size bytes."""
+        self.done += size + self.file_cost
+        now = time.monotonic()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            elapsed = now - self.started
+            eta = elapsed * (self.total - self.done) / self.done if self.done else -1.0
+            self.report(min(int(self.done * 100 / self.total), 100), eta)
+
+    def finish(self):
+        self.report(100, 0.0)
+
+
+def profiled_run(stats, run):
+    """Call run, under cProfile or tracemalloc if the environment asks for it (see profiling.PROFILE_ENV)."""
+    mode = environment_profile_mode()
+    if mode is not None:
+        stats.profile_path = default_profile_path(stats.name, mode)
+    with profiled(mode, stats.profile_path):
+        run()
+
 
 class ColorScanWorkerThread(QThread):
-    progress_signal = pyqtSignal(int)  # Signal to update progress
-    finished_signal = pyqtSignal(dict)  # Signal to send back the extracted color data
+    progress_signal = pyqtSignal(int, float)  # Signal to update progress and the ETA in seconds
+    colors_batch_signal = pyqtSignal(dict)  # Signal to stream newly found or updated colors
+    finished_signal = pyqtSignal(dict, object)  # Signal to send back the extracted color data and its FileTable
+    stats_signal = pyqtSignal(dict)  # Signal to send running totals of the scan stats, see profiling.RunStats
+
+    batch_files = 200  # Emit a batch at least every N files...
+    batch_interval = 0.1  # ...or every 100 ms, whichever comes first
 
-    def __init__(self, directory, selected_filetypes):
+    def __init__(self, directory, manifest, selected_filetypes, workers=1, use_index=True, stream_batches=True,
+                 io_threads=DEFAULT_IO_THREADS):
         super().__init__()
+        self.stream_batches = stream_batches  # Whether to send records in batches while scanning, or only once done
         self.directory = directory
-        self.selected_filetypes = selected_filetypes
-
-    def extract_colors_from_file(self, file_path):
-        """Extract unique color definitions and usage from a file."""
-        color_definitions = {}
-        
-        # Regex pattern to match hex, rgb(), and rgba() colors in @define-color
-        color_pattern = r'@define-color\s+([a-zA-Z0-9_]+)\s+(\#[0-9a-fA-F]{3,6}|rgb\(\s*(\d+),\s*(\d+),\s*(\d+)\s*\)|rgba\(\s*(\d+),\s*(\d+),\s*(\d+),\s*([\d\.]+)\s*\));'
-
-        # Regex pattern to match color usage (hex, rgb, rgba, or color variables)
-        usage_pattern = r'(\#([0-9a-fA-F]{3,6})|rgb\((\d+),\s*(\d+),\s*(\d+)\)|rgba\((\d+),\s*(\d+),\s*(\d+),\s*([\d\.]+)\))'
-
-        # Updated regex pattern to match colors in SVG attributes or inline styles
-        svg_color_pattern = r'(#(?:[0-9a-fA-F]{3}){1,2}|rgb\(\d{1,3},\s*\d{1,3},\s*\d{1,3}\)|rgba\(\d{1,3},\s*\d{1,3},\s*\d{1,3},\s*[\d\.]+\))'
-
-        with open(file_path, 'r', encoding='utf-8') as file_obj:
-            for line_number, line in enumerate(file_obj, 1):
-                # Ignore commented lines
-                if line.strip().startswith('/*') or line.strip().startswith('*'):
-                    continue
-
-                # Match color definitions in CSS-like syntax
-                match = re.search(color_pattern, line.strip())
-                if match:
-                    color_value = match.group(2)
-                    color_name = match.group(1)
-
-                    if color_value not in color_definitions:
-                        # Store as a list: [color_name, color_line, usage_count, usage_instances]
-                        color_definitions[color_value] = [color_name, line.strip(), 0, []]
-
-                # Track color usage in CSS-like syntax
-                for usage_match in re.finditer(usage_pattern, line.strip()):
-                    used_color = usage_match.group(1)
-                    if used_color in color_definitions:
-                        color_definitions[used_color][2] += 1  # Increment the usage count
-                        color_definitions[used_color][3].append(f"Line {line_number}: {line.strip()}")
-
-                # If the file is an SVG, extract color values from attributes or inline styles
-                if file_path.endswith('.svg'):
-                    svg_matches = re.findall(svg_color_pattern, line)
-                    for color in svg_matches:
-                        # Store each color found in SVG files
-                        if color not in color_definitions:
-                            color_definitions[color] = [color, line.strip(), 0, []]
-                        color_definitions[color][2] += 1  # Increment usage count
-
-        return color_definitions
+        self.manifest = manifest  # Files found by FileTypeWorkerThread
+        self.selected_filetypes = list(selected_filetypes)  # Copy, the UI list may change mid-scan
+        self.workers = workers  # Number of scanning processes, 1 scans in this thread
+        self.use_index = use_index  # Reuse results of unchanged files from the persistent scan index
+        self.io_threads = io_threads  # Threads reading files ahead of the lexer, 0 reads one file at a time
+        self.file_table = FileTable()  # Files referred to by the usage sites, filled in as the scan goes
+        self.resolver = ColorResolver()  # Kept after the scan so files can be rescanned one by one
+        self.stats = RunStats('scan')  # The UI adds the time it takes to update the table
+
+    def emit_batch(self, all_colors, touched):
+        """Send the touched color records to the UI."""
+        if touched and self.stream_batches:
+            self.colors_batch_signal.emit({color: all_colors[color] for color in touched})
+            touched.clear()
 
     def run(self):
-        """Scan the directory and extract colors."""
-        all_colors = {}
-        total_files = 0
-        processed_files = 0
-
-        # Walk through the directory to find the selected file types
-        for root, dirs, files in os.walk(self.directory):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.selected_filetypes):
-                    total_files += 1
-
-        # Now, process each file
-        for root, dirs, files in os.walk(self.directory):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.selected_filetypes):
-                    file_path = os.path.join(root, file)
-                    colors = self.extract_colors_from_file(file_path)
-                    for color, data in colors.items():
-                        if color not in all_colors:
-                            all_colors[color] = data
-                    processed_files += 1
-
-                    # Update progress
-                    progress_percent = int((processed_files / total_files) * 100)
-                    self.progress_signal.emit(progress_percent)
+        profiled_run(self.stats, self.scan)
+
+    def scan(self):
+        """Scan the directory and extract colors, streaming results in batches."""
+        resolver = self.resolver
+        all_colors = resolver.color_definitions
+        file_table = self.file_table
+        stats = self.stats
+        touched = set()
+
+        # Pick the selected file types from the manifest
+        entries = select_entries(self.manifest, self.selected_filetypes)
+        stats.add_entries(entries)
+
+        sizes = {entry.path: entry.size for entry in entries}
+        meter = ProgressMeter(list(sizes.values()), self.progress_signal.emit)
+        last_batch = time.monotonic()
+        files_since_batch = 0
+
+        # Now, process each file, results arrive in traversal order even when scanned in parallel.
+        # Unchanged files are served from the on-disk index without being parsed again.
+        results = iter_directory_results(self.directory, entries, self.workers, self.use_index, stats,
+                                         self.io_threads)
+
+        try:
+            for file_path, result in results:
+                if self.isInterruptionRequested():
+                    return  # Cancelled, or a different directory was selected
+
+                with stats.phase('merge'):
+                    touched |= resolver.merge(result, file_table.intern(file_path))
+                stats.matches += len(result[1])
+                files_since_batch += 1
+
+                now = time.monotonic()
+                if files_since_batch >= self.batch_files or now - last_batch >= self.batch_interval:
+                    with stats.phase('convert'):
+                        resolver.convert()  # Records are only sent once their alternative is known
+                    self.emit_batch(all_colors, touched)
+                    self.stats_signal.emit(stats.report())
+                    last_batch = now
+                    files_since_batch = 0
+
+                meter.advance(sizes[file_path])
+        finally:
+            results.close()  # Stops the worker processes and saves fresh index entries
+
+        with stats.phase('finish'):
+            resolver.finish()
+        self.emit_batch(all_colors, touched)
+        meter.finish()
+        stats.finish()
+        self.stats_signal.emit(stats.report())
 
         # Emit the result after scanning all files
-        self.finished_signal.emit(all_colors)
-
+        self.finished_signal.emit(all_colors, file_table)
 
 
 class FileTypeWorkerThread(QThread):
+    manifest_signal = pyqtSignal(list)  # Signal to send back the discovered files
     file_types_signal = pyqtSignal(list)  # Signal to send back file types
+    stats_signal = pyqtSignal(dict)  # Signal to send the stats of the directory walk
     
-    def __init__(self, directory):
+    def __init__(self, directory, ignore_globs=DEFAULT_IGNORE_GLOBS):
+        super().__init__()
+        self.directory = directory
+        self.ignore_globs = ignore_globs
+        self.stats = RunStats('discover')
+
+    def run(self):
+        profiled_run(self.stats, self.discover)
+
+    def discover(self):
+        """Discover the files in the directory and the file types among them."""
+        with self.stats.phase('walk'):
+            manifest = discover_files(self.directory, self.ignore_globs)
+        self.stats.add_entries(manifest)
+        self.stats.finish()
+        self.stats_signal.emit(self.stats.report())
+
+        # Emit the manifest first so it is known when the file types arrive
+        self.manifest_signal.emit(manifest)
+        self.file_types_signal.emit(list(manifest_extensions(manifest)))
+
+
+class FileChangesWorkerThread(QThread):
+    changes_signal = pyqtSignal(list, list)  # Signal to send back the new manifest and the rescanned files
+
+    def __init__(self, directory, manifest, ignore_globs, scanned_filetypes):
         super().__init__()
         self.directory = directory
+        self.manifest = manifest  # Manifest the current color table was scanned from
+        self.ignore_globs = ignore_globs
+        self.scanned_filetypes = list(scanned_filetypes)
 
     def run(self):
-        """Search for file types in the directory."""
-        file_types = set()  # To store unique file types
+        """Rediscover the directory and rescan the files that changed, see watch.read_changes."""
+        manifest = discover_files(self.directory, self.ignore_globs)
+        changes = read_changes(self.manifest, manifest, self.scanned_filetypes)
+        self.changes_signal.emit(manifest, changes)
+
+
+class DiffPreviewWorkerThread(QThread):
+    progress_signal = pyqtSignal(int, float)  # Signal to update progress and the ETA in seconds
+    finished_signal = pyqtSignal(object)  # Signal to send back the preview.DiffPage of the requested page
 
-        for root, dirs, files in os.walk(self.directory):
-            for file in files:
-                file_ext = os.path.splitext(file)[1]
-                if file_ext:
-                    file_types.add(file_ext.lower())  # Convert to lowercase for consistency
+    def __init__(self, preview, mappings, page, directory):
+        super().__init__()
+        self.preview = preview  # DiffPreview, only touched by this thread while it runs
+        self.mappings = mappings
+        self.page = page  # Page of changed files to compute the diffs of
+        self.directory = directory  # Diff labels are relative to it
+
+    def run(self):
+        """Read the files affected by the mapping changes since the last preview, then diff the requested page."""
+        meters = []
 
-        # Emit the signal with the found file types
-        self.file_types_signal.emit(list(file_types))
+        def progress(file_count, total_files):
+            if file_count == 1:  # Indexing the files and reading the stale ones are metered one after the other
+                meters[:] = [ProgressMeter([0] * total_files, self.progress_signal.emit, 1)]  # Files weigh the same
+            meters[0].advance(0)
+
+        if not self.preview.update(self.mappings, progress, self.isInterruptionRequested):
+            return
+        page = self.preview.page(self.page, self.directory)
+        if not self.isInterruptionRequested():
+            self.finished_signal.emit(page)
 
 
 class WorkerThread(QThread):
-    progress_signal = pyqtSignal(int)  # Signal to update progress
-    finished_signal = pyqtSignal()  # Signal to indicate when the task is finished
+    progress_signal = pyqtSignal(int, float)  # Signal to update progress and the ETA in seconds
+    finished_signal = pyqtSignal(dict)  # Signal to send back the substitution report
+    error_signal = pyqtSignal(str)  # Signal sent instead of finished_signal when the apply stops on an error
+    stats_signal = pyqtSignal(dict)  # Signal to send the stats of the apply, see profiling.RunStats
     
-    def __init__(self, unique_colors, directory, color_entries, selected_filetypes):
+    def __init__(self, unique_colors, directory, color_entries, selected_filetypes, manifest, backup=False,
+                 io_threads=DEFAULT_IO_THREADS):
         super().__init__()
+        self.io_threads = io_threads  # Threads reading files ahead and writing them back, 0 for none
+        self.stats = RunStats('apply')
+        self.backup = backup  # Whether to snapshot the files that get modified
         self.unique_colors = unique_colors  # Color definitions and usage
         self.directory = directory  # Directory to process
-        self.color_entries = color_entries  # Dictionary of color entries from the UI
+        self.manifest = manifest  # Files found by FileTypeWorkerThread
+        self.color_entries = color_entries  # Dictionary of new colors entered in the UI
         self.selected_filetypes = selected_filetypes  # List of selected file types (e.g., .css, .scss)
 
-    def is_valid_color(self, color):
-        """Check if the provided color is valid (either hex or rgba)."""
-        hex_pattern = r'^#([0-9A-Fa-f]{3}){1,2}$'
-        rgba_pattern = r'^rgba\((\d{1,3}), (\d{1,3}), (\d{1,3}), (\d(\.\d+)?)\)$'
-        
-        return bool(re.match(hex_pattern, color)) or bool(re.match(rgba_pattern, color))
+    def collect_mappings(self):
+        """Build the old -> new color mapping from the valid UI entries."""
+        return entered_mappings(self.color_entries, self.unique_colors)
     
-    def replace_color_in_files(self, old_color, new_color, updated_files, total_files):
-        """Replace occurrences of old_color with new_color in the selected files."""
-        changes_made = False
-        file_count = 0  # To track the number of files processed
-
-        for root, dirs, files in os.walk(self.directory):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.selected_filetypes):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-
-                    if old_color in content:
-                        changes_made = True
-                        content = content.replace(old_color, new_color)
-                        updated_files.append((file_path, content))  # Save updated content
-                    
-                    # Update the progress bar
-                    file_count += 1
-                    progress_percent = int((file_count / total_files) * 100)
-                    self.progress_signal.emit(progress_percent)
-
-        # Write all updated files
-        for file_path, new_content in updated_files:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-
-        return changes_made
+    def replace_color_in_files(self, replacer, entries, snapshot=None, journal=None):
+        """Apply every mapping to each file in one pass, writing changed files once.
 
-    def run(self):
-        """The main worker thread logic to apply color changes."""
-        changes_made = False
-        updated_files = []
+        Files are read and written back on io_threads threads while this
+        thread replaces. Stops between two files once interruption is
+        requested, files are either rewritten completely or not at all.
+        """
+        meter = ProgressMeter([entry.size for entry in entries], self.progress_signal.emit)
 
-        total_files = 0
-        for root, dirs, files in os.walk(self.directory):
-            for file in files:
-                if any(file.endswith(ext) for ext in self.selected_filetypes):
-                    total_files += 1  # Count the files to be processed
+        def progress(file_count):
+            meter.advance(entries[file_count - 1].size)
 
-        for color_value, (color_name, color_line, usage_count, usage_instances, color_alternative) in self.unique_colors.items():
-            new_color = self.color_entries.get(color_value, None).text().strip()
-            if new_color:
-                if not self.is_valid_color(new_color):
-                    continue  # Skip invalid color entries
+        before_write = self.stats.timed('backup', snapshot.save) if snapshot else None
+        report = replace_in_files(replacer, [entry.path for entry in entries], before_write, progress, self.stats,
+                                  self.isInterruptionRequested, self.io_threads, journal)
+        meter.finish()
+        return report
 
-                changes_made |= self.replace_color_in_files(color_value, new_color, updated_files, total_files)
+    def run(self):
+        try:
+            profiled_run(self.stats, self.apply)
+        except Exception as e:  # The UI waits for one of the two signals to release the buttons
+            self.error_signal.emit(f"{type(e).__name__}: {e}")
 
-        self.finished_signal.emit()
+    def apply(self):
+        """The main worker thread logic to apply color changes."""
+        stats = self.stats
+        with stats.phase('mappings'):
+            replacer = ColorReplacer(self.collect_mappings())
+
+        entries = []
+        if replacer.mappings:
+            entries = select_entries(self.manifest, self.selected_filetypes)
+            stats.add_entries(entries)
+
+        # Only the files that actually change are copied into the backup
+        snapshot = BackupSnapshot(self.directory) if self.backup else None
+        journal = ApplyJournal(self.directory, replacer.mappings)  # Lets the apply be undone, see journal.undo_journal
+        try:
+            report = self.replace_color_in_files(replacer, entries, snapshot, journal)
+        finally:
+            with stats.phase('backup'):
+                backup_dir = snapshot.close() if snapshot else None
+            with stats.phase('journal'):
+                journal_path = journal.close()
+        report['backup_dir'] = backup_dir
+        report['journal'] = journal_path
+        stats.finish()
+        self.stats_signal.emit(stats.report())
+        self.finished_signal.emit(report)
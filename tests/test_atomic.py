@@ -0,0 +1,53 @@
+import os
+import stat
+import pytest
+from atomic import TEMP_SUFFIX, AtomicWriter
+
+
+@pytest.fixture
+def theme_file(tmp_path):
+    path = tmp_path / 'a.css'
+    path.write_bytes(b'a { color: #abc; }\r\n')
+    os.chmod(path, 0o640)
+    return path
+
+
+def leftovers(directory):
+    return [name for name in os.listdir(directory) if name.endswith(TEMP_SUFFIX)]
+
+
+def test_write_keeps_the_mode(theme_file):
+    writer = AtomicWriter()
+    writer.write(str(theme_file), 'a { color: #123; }\r\n')
+    writer.close()
+    assert theme_file.read_bytes() == b'a { color: #123; }\r\n'  # Line endings are written as given
+    assert stat.S_IMODE(os.stat(theme_file).st_mode) == 0o640
+    assert leftovers(theme_file.parent) == []
+
+
+def test_failed_write_leaves_the_original_intact(theme_file):
+    writer = AtomicWriter()
+    with pytest.raises(UnicodeEncodeError):
+        writer.write(str(theme_file), 'a { color: #123; }' + '\udc80')  # Not encodable, fails midway
+    assert theme_file.read_bytes() == b'a { color: #abc; }\r\n'
+    assert stat.S_IMODE(os.stat(theme_file).st_mode) == 0o640
+    assert leftovers(theme_file.parent) == []
+
+
+def test_failed_rename_leaves_the_original_intact(theme_file, monkeypatch):
+    def replace(source, target):
+        raise OSError('rename failed')
+
+    monkeypatch.setattr(os, 'replace', replace)
+    with pytest.raises(OSError):
+        AtomicWriter(sync=False).write(str(theme_file), 'a { color: #123; }\n')
+    assert theme_file.read_bytes() == b'a { color: #abc; }\r\n'
+    assert leftovers(theme_file.parent) == []
+
+
+def test_symlinks_are_followed(theme_file, tmp_path):
+    link = tmp_path / 'link.css'
+    os.symlink(theme_file, link)
+    AtomicWriter().write(str(link), 'a { color: #123; }\n')
+    assert os.path.islink(link)
+    assert theme_file.read_text() == 'a { color: #123; }\n'
@@ -0,0 +1,31 @@
+import pytest
+from backup import BackupSnapshot, restore_snapshot
+
+
+def test_snapshots_never_replace_each_other(tmp_path):
+    directory = tmp_path / 'theme'
+    directory.mkdir()
+    (directory / 'a.css').write_text('a { color: #abc; }\n')
+
+    snapshots = []
+    for content in ('a { color: #123; }\n', 'a { color: #456; }\n'):  # Within the same second
+        snapshot = BackupSnapshot(str(directory))
+        snapshot.save(str(directory / 'a.css'))
+        (directory / 'a.css').write_text(content)
+        snapshots.append(snapshot.close())
+
+    assert snapshots[0] != snapshots[1]
+    assert restore_snapshot(snapshots[0]) == (str(directory), 1)
+    assert (directory / 'a.css').read_text() == 'a { color: #abc; }\n'
+    restore_snapshot(snapshots[1])
+    assert (directory / 'a.css').read_text() == 'a { color: #123; }\n'
+
+
+def test_existing_snapshot_directory_is_kept(tmp_path):
+    (tmp_path / 'a.css').write_text('a { color: #abc; }\n')
+    (tmp_path / 'backup').mkdir()
+    (tmp_path / 'backup' / 'keep.css').write_text('b { color: #def; }\n')
+    snapshot = BackupSnapshot(str(tmp_path), str(tmp_path / 'backup'))
+    with pytest.raises(FileExistsError):
+        snapshot.save(str(tmp_path / 'a.css'))
+    assert (tmp_path / 'backup' / 'keep.css').exists()
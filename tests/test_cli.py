@@ -0,0 +1,85 @@
+import csv
+import json
+import pytest
+from cli import main
+
+FILES = {
+    'a.css': '@define-color accent #abc;\na { color: #abc; }\n',
+    'b.scss': '$primary: #123456;\nb { color: $primary; border-color: #ABC; }\n',
+    'c.txt': 'not a selected type #abc\n',
+}
+
+
+@pytest.fixture
+def theme(tmp_path, monkeypatch):
+    """A theme directory, with the scan index and the journals under tmp_path."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    directory = tmp_path / 'theme'
+    directory.mkdir()
+    for name, content in FILES.items():
+        (directory / name).write_text(content)
+    (tmp_path / 'mapping.json').write_text(json.dumps({'#abc': '#fff', '#123456': 'nonsense'}))
+    return directory
+
+
+def run(capsys, *argv):
+    status = main([str(arg) for arg in argv])
+    out, err = capsys.readouterr()
+    return status, out, err
+
+
+def test_scan_outputs_the_color_table(theme, capsys, tmp_path):
+    status, out, _ = run(capsys, 'scan', theme, '--workers', 1, '--sites')
+    assert status == 0
+    rows = {row['value']: row for row in json.loads(out)}
+    assert set(rows) == {'#abc', '#123456'}  # Literals count once a variable defines their value
+    assert rows['#123456']['name'] == 'primary' and rows['#123456']['usage_count'] == 2
+    assert rows['#abc']['sites'] == [{'file': 'a.css', 'line': 1}, {'file': 'a.css', 'line': 2}]
+
+    output = tmp_path / 'colors.csv'
+    assert run(capsys, 'scan', theme, '--workers', 1, '--no-index', '--format', 'csv', '-o', output)[:2] == (0, '')
+    with open(output, newline='') as f:
+        assert sorted(row['value'] for row in csv.DictReader(f)) == ['#123456', '#abc']
+
+
+def test_diff_exit_status(theme, capsys, tmp_path):
+    status, out, err = run(capsys, 'diff', theme, tmp_path / 'mapping.json')
+    assert status == 1  # Like diff(1)
+    assert out.startswith('--- a/a.css\n+++ b/a.css\n') and '+a { color: #fff; }\n' in out
+    assert 'b.scss' not in out
+    assert "Skipping invalid color 'nonsense' for #123456" in err
+
+    status, out, _ = run(capsys, 'diff', theme, tmp_path / 'mapping.json', '--all-spellings')
+    assert status == 1 and 'border-color: #fff;' in out
+
+    (tmp_path / 'none.json').write_text('{"#000": "#fff"}')
+    assert run(capsys, 'diff', theme, tmp_path / 'none.json')[:2] == (0, '')
+
+
+def test_apply_and_undo(theme, capsys, tmp_path):
+    status, out, _ = run(capsys, 'apply', theme, tmp_path / 'mapping.json', '--no-sync')
+    assert status == 0
+    report = json.loads(out)
+    assert report['per_mapping'] == {'#abc': 2} and report['journal']
+    assert (theme / 'a.css').read_text() == '@define-color accent #fff;\na { color: #fff; }\n'
+    assert (theme / 'c.txt').read_text() == FILES['c.txt']
+
+    status, out, _ = run(capsys, 'undo', theme)
+    assert status == 0 and json.loads(out)['files'] == 1
+    assert {name: (theme / name).read_text() for name in FILES} == FILES
+    status, _, err = run(capsys, 'undo', theme)
+    assert status == 1 and 'Nothing to undo' in err
+
+
+def test_undo_refuses_files_changed_since(theme, capsys, tmp_path):
+    run(capsys, 'apply', theme, tmp_path / 'mapping.json', '--no-sync')
+    (theme / 'a.css').write_text('a { color: red; }\n')
+    status, _, err = run(capsys, 'undo', theme)
+    assert status == 1 and str(theme / 'a.css') in err
+    assert (theme / 'a.css').read_text() == 'a { color: red; }\n'
+
+
+def test_usage_errors(capsys):
+    with pytest.raises(SystemExit) as error:
+        main(['apply'])
+    assert error.value.code == 2
@@ -0,0 +1,79 @@
+import random
+import numpy as np
+import pytest
+import clustering
+from clustering import cluster_colors, leader_clusters
+from color_table import ColorTable, rgb_to_lab
+from records import ColorRecord
+
+
+def scanned(values, usage):
+    color_definitions = {}
+    for value, usage_count in zip(values, usage):
+        record = color_definitions[value] = ColorRecord(None, None, None)
+        record.usage_count = usage_count
+    return color_definitions
+
+
+def random_palette(count, seed=0):
+    """Random colors, some of them also spelled in short or upper case hex, with random usage."""
+    rng = random.Random(seed)
+    values = set()
+    while len(values) < count:
+        red, green, blue = (rng.randrange(16) * 17 for _ in range(3))
+        spellings = [f'#{red:02x}{green:02x}{blue:02x}', f'#{red:02X}{green:02X}{blue:02X}',
+                     f'#{red // 17:x}{green // 17:x}{blue // 17:x}']
+        values.update(rng.sample(spellings, rng.randrange(1, 4)))
+    values = sorted(values)
+    return values, [rng.randrange(1, 100) for _ in values]
+
+
+def lab_of(values):
+    table = ColorTable()
+    rows = table.extend(values)
+    return dict(zip(values, rgb_to_lab(table.rgb[rows])))
+
+
+@pytest.mark.parametrize('threshold', [2.3, 5.0, 10.0, 25.0])
+def test_members_are_within_threshold_of_the_representative(threshold):
+    values, usage = random_palette(1500)
+    clusters = cluster_colors(scanned(values, usage), threshold)
+    lab = lab_of(values)
+
+    assert sorted(member for members in clusters.values() for member in members) == values
+    for representative, members in clusters.items():
+        assert members[0] == representative
+        for member in members:
+            assert np.sqrt(((lab[member] - lab[representative]) ** 2).sum()) <= threshold + 1e-9
+
+
+def test_equivalent_spellings_share_a_cluster():
+    clusters = cluster_colors(scanned(['#abc', '#AABBCC', '#aabbcc', '#123456'], [1, 5, 2, 1]), 1.0)
+    assert clusters == {'#AABBCC': ['#AABBCC', '#aabbcc', '#abc'], '#123456': ['#123456']}
+
+
+def test_representative_is_a_spelling_of_the_heaviest_color():
+    # #000001 has the single most used spelling, #000000 the most usage over all its spellings
+    values = ['#000', '#000000', '#000001']
+    clusters = cluster_colors(scanned(values, [6, 6, 10]), 2.3)
+    assert list(clusters) == ['#000']
+    assert clusters['#000'] == ['#000', '#000001', '#000000']
+
+
+def test_unparsable_values_are_clusters_of_their_own():
+    assert cluster_colors(scanned(['#abc', '@accent'], [1, 1]))['@accent'] == ['@accent']
+
+
+@pytest.mark.parametrize('threshold', [1.0, 5.0, 20.0])
+def test_dense_and_sparse_grids_find_the_same_leaders(threshold, monkeypatch):
+    rng = np.random.default_rng(0)
+    lab = rng.random((3000, 3)) * [100, 200, 200] - [0, 100, 100]
+    alpha = rng.integers(0, 2, len(lab)) * 255
+    weights = rng.integers(1, 50, len(lab)).astype(np.float64)
+
+    sparse = leader_clusters(lab, alpha, weights, threshold)
+    monkeypatch.setattr(clustering, 'DENSE_CANDIDATES', 0)
+    dense = leader_clusters(lab, alpha, weights, threshold)
+    assert sparse == dense
+    assert (alpha[sparse] == alpha).all()
+    assert np.sqrt(((lab - lab[sparse]) ** 2).sum(axis=1)).max() <= threshold
@@ -0,0 +1,55 @@
+import random
+import pytest
+from color_table import ColorTable, entered_mappings, expand_mappings, key_spellings
+from records import ColorRecord
+from replacer import ColorReplacer
+
+
+def scanned(*values):
+    table = ColorTable()
+    rows = table.extend(values)
+    return {value: ColorRecord(None, None, None, key if valid else None)
+            for value, key, valid in zip(values, table.keys(rows).tolist(), table.valid[rows].tolist())}
+
+
+@pytest.mark.parametrize('key', [0xAABBCCFF, 0x12345680, 0x00000000, 0x11223344] +
+                         [random.Random(seed).randrange(1 << 32) for seed in range(50)])
+def test_key_spellings_parse_back_to_their_key(key):
+    spellings = key_spellings(key)
+    table = ColorTable()
+    rows = table.extend(spellings)
+    assert table.valid[rows].all()
+    assert set(table.keys(rows).tolist()) == {key}
+    assert len(set(spellings)) == len(spellings)
+
+
+def test_unscanned_spellings_are_remapped():
+    # Only #abc was recorded by the scan, the rule's other spellings of it never were
+    color_definitions = scanned('#abc', '@accent')
+    mappings = expand_mappings({'#abc': '#123456'}, color_definitions)
+    content = ('a { color: rgb(170, 187, 204); background: #AABBCC; border-color: rgba(170,187,204,1); '
+               'outline-color: #abcdef; fill: #abcf; }')
+    assert ColorReplacer(mappings).replace(content)[0] == (
+        'a { color: #123456; background: #123456; border-color: #123456; '
+        'outline-color: #abcdef; fill: #123456; }')
+
+
+def test_unscanned_old_colors_are_expanded():
+    mappings = expand_mappings({'rgb(170, 187, 204)': '#123456'}, {})
+    assert mappings['#abc'] == mappings['#AABBCC'] == '#123456'
+
+
+def test_scanned_spellings_and_own_mappings():
+    color_definitions = scanned('#abc', 'hsl(210, 25%, 73%)', '#AaBbCc', '#123')
+    mappings = expand_mappings({'#abc': '#000', '#AaBbCc': '#fff', '@accent': '#111'}, color_definitions)
+    assert mappings['#AaBbCc'] == '#fff'  # Has its own mapping
+    assert mappings['rgb(170, 187, 204)'] == '#000'
+    assert mappings['@accent'] == '#111'
+    assert '#123' not in mappings and '#112233' not in mappings
+
+
+def test_entered_mappings_skip_invalid_and_unknown_colors():
+    color_definitions = scanned('#abc', '#123')
+    mappings = entered_mappings({'#abc': ' #fff ', '#123': 'nope', '#999': '#000'}, color_definitions)
+    assert mappings['#abc'] == mappings['rgb(170, 187, 204)'] == '#fff'
+    assert '#123' not in mappings and '#999' not in mappings
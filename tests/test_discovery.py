@@ -0,0 +1,47 @@
+import os
+import pytest
+from discovery import discover_files, manifest_extensions, parse_ignore_globs, select_entries
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """A theme directory with nested, ignored and linked entries."""
+    directory = tmp_path / 'theme'
+    for name in ('b/z.css', 'b/a.scss', 'a.css', 'node_modules/lib.css', '.git/config', 'old.css.bak',
+                 'theme_backup_20240101_000000_x/a.css', 'c/deep/icon.SVG'):
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+    return directory
+
+
+def paths(manifest, directory):
+    return [os.path.relpath(entry.path, directory) for entry in manifest]
+
+
+def test_ignored_names_are_skipped_and_order_is_stable(tree):
+    manifest = discover_files(str(tree))
+    assert paths(manifest, tree) == ['a.css', os.path.join('b', 'a.scss'), os.path.join('b', 'z.css'),
+                                     os.path.join('c', 'deep', 'icon.SVG')]
+    assert manifest_extensions(manifest) == {'.css', '.scss', '.svg'}
+    assert paths(select_entries(manifest, ['.CSS']), tree) == ['a.css', os.path.join('b', 'z.css')]
+
+
+def test_custom_ignore_globs(tree):
+    manifest = discover_files(str(tree), parse_ignore_globs(' b , *.SVG,'))
+    assert 'a.css' in paths(manifest, tree)
+    assert not any(path.startswith('b') or path.endswith('.SVG') for path in paths(manifest, tree))
+    assert os.path.join('node_modules', 'lib.css') in paths(manifest, tree)  # Replaces the default globs
+
+
+def test_symlinks_are_followed_once(tree):
+    os.symlink(tree / 'b', tree / 'linked')  # A second way into b
+    os.symlink(tree, tree / 'c' / 'loop')  # A loop back to the root
+    os.symlink(tree / 'a.css', tree / 'c' / 'alias.css')
+    os.symlink(tree / 'missing.css', tree / 'c' / 'broken.css')
+    os.link(tree / 'b' / 'z.css', tree / 'c' / 'hard.css')
+
+    manifest = discover_files(str(tree))
+    assert paths(manifest, tree) == ['a.css', os.path.join('b', 'a.scss'), os.path.join('b', 'z.css'),
+                                     os.path.join('c', 'deep', 'icon.SVG')]
+    assert all(entry.size > 0 and entry.mtime > 0 for entry in manifest)
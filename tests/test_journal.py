@@ -0,0 +1,100 @@
+import os
+import pytest
+from journal import ApplyJournal, StaleJournal, journal_paths, pending_mappings, read_journal, undo_journal
+from replacer import ColorReplacer, replace_in_files
+
+MAPPINGS = {'#abc': '#aabbccdd', '#123456': '#fff', 'rgb(1, 2, 3)': 'red'}
+FILES = {
+    'a.css': b'a { color: #abc; }\r\nb { color: #123456; border: 1px solid #abc; }\r\n',
+    'b.css': b'c { background: rgb(1, 2, 3); color: #123456; }\n/* \xc3\xa9 #abc */\n',
+    'c.css': b'd { color: #def; }\n',
+}
+
+
+@pytest.fixture
+def applied(tmp_path):
+    """Apply MAPPINGS to FILES in a theme directory, returns the directory and the journal directory."""
+    directory = tmp_path / 'theme'
+    journal_dir = tmp_path / 'journal'
+    directory.mkdir()
+    for name, content in FILES.items():
+        (directory / name).write_bytes(content)
+
+    journal = ApplyJournal(str(directory), MAPPINGS, str(journal_dir))
+    paths = [str(directory / name) for name in FILES]
+    report = replace_in_files(ColorReplacer(MAPPINGS), paths, io_threads=2, journal=journal, sync=False)
+    assert len(report['per_file']) == 2
+    assert journal.close() is not None
+    return directory, str(journal_dir)
+
+
+def contents(directory):
+    return {name: (directory / name).read_bytes() for name in FILES}
+
+
+def test_full_undo_restores_every_byte(applied):
+    directory, journal_dir = applied
+    [journal_path] = journal_paths(str(directory), journal_dir)
+    assert undo_journal(journal_path) == (str(directory), 2)
+    assert contents(directory) == FILES  # CRLF line endings and non-ASCII text included
+    assert not os.path.exists(journal_path)
+
+
+def test_partial_undo_keeps_the_other_mappings(applied):
+    directory, journal_dir = applied
+    [journal_path] = journal_paths(str(directory), journal_dir)
+
+    assert undo_journal(journal_path, {'#abc'}) == (str(directory), 2)
+    assert (directory / 'a.css').read_bytes() == b'a { color: #abc; }\r\nb { color: #fff; border: 1px solid #abc; }\r\n'
+    assert (directory / 'b.css').read_bytes() == b'c { background: red; color: #fff; }\n/* \xc3\xa9 #abc */\n'
+    assert pending_mappings(read_journal(journal_path)) == [('#123456', '#fff'), ('rgb(1, 2, 3)', 'red')]
+
+    # Offsets recorded after the partial undo still point at the remaining new colors
+    assert undo_journal(journal_path, {'rgb(1, 2, 3)'}) == (str(directory), 1)
+    assert undo_journal(journal_path) == (str(directory), 2)
+    assert contents(directory) == FILES
+    assert not os.path.exists(journal_path)
+
+
+def test_stale_files_are_refused(applied):
+    directory, journal_dir = applied
+    [journal_path] = journal_paths(str(directory), journal_dir)
+    (directory / 'a.css').write_bytes(b'a { color: red; }\n')
+    before = contents(directory)
+
+    with pytest.raises(StaleJournal) as error:
+        undo_journal(journal_path)
+    assert error.value.paths == [str(directory / 'a.css')]
+    assert contents(directory) == before  # Nothing is rewritten, not even the files that did not change
+
+    # A mapping that only touched unchanged files can still be undone
+    assert undo_journal(journal_path, {'rgb(1, 2, 3)'}) == (str(directory), 1)
+    assert (directory / 'b.css').read_bytes().startswith(b'c { background: rgb(1, 2, 3); color: #fff; }')
+
+
+def test_removed_files_are_stale(applied):
+    directory, journal_dir = applied
+    [journal_path] = journal_paths(str(directory), journal_dir)
+    os.remove(directory / 'a.css')
+    with pytest.raises(StaleJournal) as error:
+        undo_journal(journal_path)
+    assert error.value.paths == [str(directory / 'a.css')]
+
+
+def test_streamed_files_are_journaled(tmp_path, monkeypatch):
+    # Files larger than a chunk are replaced and undone chunk by chunk
+    monkeypatch.setattr('replacer.CHUNK_BYTES', 8)
+    monkeypatch.setattr('journal.CHUNK_BYTES', 8)
+    directory = tmp_path / 'theme'
+    directory.mkdir()
+    content = b'a { color: #abc; }\r\n' * 20 + b'b { color: rgb(1, 2, 3); }\n' * 20
+    (directory / 'large.css').write_bytes(content)
+
+    journal = ApplyJournal(str(directory), MAPPINGS, str(tmp_path / 'journal'))
+    replace_in_files(ColorReplacer(MAPPINGS), [str(directory / 'large.css')], io_threads=0, journal=journal,
+                     sync=False)
+    journal_path = journal.close()
+    undo_journal(journal_path, {'rgb(1, 2, 3)'})
+    assert (directory / 'large.css').read_bytes() == content.replace(b'#abc;', b'#aabbccdd;')
+    undo_journal(journal_path)
+    assert (directory / 'large.css').read_bytes() == content
@@ -0,0 +1,75 @@
+import threading
+import time
+import pytest
+from pipeline import WriteBehind, prefetched
+
+
+@pytest.mark.parametrize('threads', [0, 1, 4])
+def test_prefetched_keeps_the_order(threads):
+    def slow_square(item):
+        time.sleep(0.001 * (item % 3))  # Later items often finish first
+        return item * item
+
+    assert list(prefetched(slow_square, range(50), threads)) == [(item, item * item) for item in range(50)]
+
+
+def test_prefetched_reads_at_most_ahead():
+    started = []
+    results = prefetched(started.append, range(100), threads=2, ahead=3)
+    next(results)
+    time.sleep(0.05)
+    assert len(started) <= 4  # The item consumed and the ones pending behind it
+    results.close()
+
+
+def test_prefetched_raises_when_the_item_is_consumed():
+    def read(item):
+        if item == 2:
+            raise OSError('unreadable')
+        return item
+
+    results = prefetched(read, range(5), threads=2)
+    assert [next(results), next(results)] == [(0, 0), (1, 1)]
+    with pytest.raises(OSError):
+        next(results)
+
+
+def test_write_behind_bounds_the_queue_and_waits_on_close():
+    release = threading.Event()
+    running = []
+    done = []
+
+    def write(item):
+        running.append(item)
+        release.wait()
+        done.append(item)
+
+    writes = WriteBehind(threads=1, limit=2)
+    writes.submit(write, 0)
+    writes.submit(write, 1)
+    blocked = threading.Thread(target=writes.submit, args=(write, 2))
+    blocked.start()
+    time.sleep(0.05)
+    assert blocked.is_alive()  # Waits for the oldest write while two are queued
+    release.set()
+    blocked.join()
+    writes.close()
+    assert done == [0, 1, 2]
+
+
+@pytest.mark.parametrize('threads', [0, 2])
+def test_write_behind_raises_the_first_error(threads):
+    done = []
+
+    def write(item):
+        if item == 1:
+            raise OSError('disk full')
+        done.append(item)
+
+    writes = WriteBehind(threads)
+    with pytest.raises(OSError):
+        for item in range(4):
+            writes.submit(write, item)
+        writes.close()
+    writes.close()  # Writes queued before the error are still completed
+    assert 0 in done
@@ -0,0 +1,107 @@
+from preview import DiffPreview
+from replacer import ColorReplacer
+from textfiles import CHUNK_BYTES
+
+FILES = {
+    'theme.css': '/* Accent: #abc */\na { color: #abc; }\n',
+    'icon.svg': '<svg><use href="#abc"/><rect fill="#abc"/><rect fill="#def"/></svg>\n',
+    'other.css': 'b { color: #abcdef; background: rgb(1, 2, 3); }\n',
+    'plain.txt': 'no colors\n',
+}
+
+
+def write_tree(tmp_path, files=FILES):
+    paths = []
+    for name, content in files.items():
+        path = tmp_path / name
+        path.write_text(content)
+        paths.append(str(path))
+    return paths
+
+
+def expected_changes(paths, mappings):
+    replacer = ColorReplacer(mappings)
+    return {path: counts for path in paths if (counts := replacer.count_in_file(path))}
+
+
+def test_preview_matches_the_apply(tmp_path):
+    # Colors in comments are rewritten by the apply and SVG id references are not, the preview has to agree
+    paths = write_tree(tmp_path)
+    preview = DiffPreview(paths)
+    for mappings in ({'#abc': '#123'}, {'#abc': '#123', '#def': '#456'}, {'rgb(1, 2, 3)': '#000'}, {}):
+        assert preview.update(mappings)
+        assert preview.changes == expected_changes(paths, mappings)
+    assert preview.changed_files() == []
+
+
+def test_only_files_with_changed_colors_are_read_again(tmp_path):
+    paths = write_tree(tmp_path)
+    preview = DiffPreview(paths)
+    preview.update({'#abc': '#123'})
+    assert preview.stale_files({'#abc': '#123', '#def': '#456'}) == [paths[1]]
+    assert preview.stale_files({'#abc': '#456'}) == paths[:2]
+    assert preview.stale_files({'#abc': '#123'}) == []
+
+
+def test_svg_id_references_are_not_indexed(tmp_path):
+    paths = write_tree(tmp_path, {'icon.svg': '<svg><use href="#abc"/><path clip-path="url(#def)" fill="#123"/></svg>\n'})
+    preview = DiffPreview(paths)
+    preview.update({})
+    assert preview.file_literals == {paths[0]: {'#123'}}
+    assert preview.stale_files({'#abc': '#456', '#def': '#456'}) == []
+
+
+def test_large_files_are_always_read(tmp_path):
+    paths = write_tree(tmp_path, {'small.css': 'a { color: #abc; }\n',
+                                  'large.css': 'b { color: #def; }\n' * (CHUNK_BYTES // 16)})
+    preview = DiffPreview(paths)
+    assert preview.update({'#abc': '#123'})
+    assert preview.changed_files() == paths[:1]
+    assert preview.update({'#abc': '#123', '#def': '#456'})
+    assert preview.changes == expected_changes(paths, {'#abc': '#123', '#def': '#456'})
+
+
+def test_reused_index_reads_changed_files_again(tmp_path):
+    paths = write_tree(tmp_path)
+    preview = DiffPreview(paths)
+    preview.update({'#abc': '#123'})
+
+    (tmp_path / 'plain.txt').write_text('c { color: #abc; }\n')
+    refreshed = DiffPreview(paths)
+    refreshed.reuse_index(preview, [paths[3]])
+    assert refreshed.update({'#abc': '#123'})
+    assert refreshed.changed_files() == [paths[0], paths[1], paths[3]]
+
+
+def test_cancelled_update_keeps_the_last_state(tmp_path):
+    paths = write_tree(tmp_path)
+    preview = DiffPreview(paths)
+    assert not preview.update({'#abc': '#123'}, cancelled=lambda: True)
+    assert preview.literal_files is None and preview.changes == {}
+    assert preview.update({'#abc': '#123'})
+    assert not preview.update({'#abc': '#456'}, cancelled=lambda: True)
+    assert preview.mappings == {'#abc': '#123'}
+
+
+def test_diff_of_a_changed_file(tmp_path):
+    paths = write_tree(tmp_path)
+    preview = DiffPreview(paths)
+    preview.update({'#abc': '#123'})
+    diff = preview.diff(paths[1], 'icon.svg')
+    assert diff.startswith('--- a/icon.svg\n+++ b/icon.svg\n')
+    assert '+<svg><use href="#abc"/><rect fill="#123"/><rect fill="#def"/></svg>\n' in diff
+
+
+def test_pages_are_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr('preview.DIFF_PAGE_FILES', 1)
+    paths = write_tree(tmp_path)
+    preview = DiffPreview(paths)
+    preview.update({'#abc': '#123'})
+    first = preview.page(0, str(tmp_path))
+    assert first[:4] == (0, 2, 2, 3)
+    assert first.text.startswith('--- a/theme.css\n')
+    assert preview.page(5, str(tmp_path)).text.startswith('--- a/icon.svg\n')  # Clamped to the last page
+
+    preview.update({})
+    assert first[:4] == (0, 2, 2, 3) and 'theme.css' in first.text
+    assert preview.page(1, str(tmp_path)) == (0, 1, 0, 0, '')
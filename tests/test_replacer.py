@@ -0,0 +1,117 @@
+import io
+import random
+import re
+import pytest
+from replacer import TOKEN_CHARS, ColorReplacer
+
+
+def reference_replace(mappings, content):
+    """Replace with a plain alternation of the old colors, longest first, as the trie must behave."""
+    alternatives = []
+    for old in sorted(mappings, key=len, reverse=True):
+        alternative = re.escape(old)
+        if re.match(TOKEN_CHARS, old[0]):
+            alternative = f'(?<!{TOKEN_CHARS})' + alternative
+        if re.match(TOKEN_CHARS, old[-1]):
+            alternative += f'(?!{TOKEN_CHARS})'
+        alternatives.append(alternative)
+    return re.sub('|'.join(alternatives), lambda match: mappings[match.group(0)], content)
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('color: #abc;', 'color: #111111;'),
+    ('color: #abcdef;', 'color: #222222;'),
+    ('color: #abcd;', 'color: #abcd;'),  # Longer hex value, not mapped
+    ('color: #abc-x;', 'color: #abc-x;'),  # Part of a longer token
+    ('color: #ABC;', 'color: #ABC;'),  # Spellings are only mapped when expanded, see color_table.expand_mappings
+    ('fill: rgb(1, 2, 3);', 'fill: #333333;'),
+    ('fill: argb(1, 2, 3);', 'fill: argb(1, 2, 3);'),
+    ('fill: rgb(1, 2, 3)x;', 'fill: #333333x;'),  # Ends with ')', which cannot continue a token
+    ('@accent @accent-dark', '#444444 @accent-dark'),
+    ('#abc#abc', '#111111#111111'),
+])
+def test_only_whole_tokens_are_replaced(content, expected):
+    replacer = ColorReplacer({'#abc': '#111111', '#abcdef': '#222222', 'rgb(1, 2, 3)': '#333333',
+                              '@accent': '#444444'})
+    assert replacer.replace(content)[0] == expected
+
+
+def test_counts_and_edits():
+    replacer = ColorReplacer({'#abc': '#aabbcc', '#123456': '#fff'})
+    edits = []
+    new_content, counts = replacer.replace('a{color:#abc} b{color:#123456;border:#abc}', edits)
+    assert new_content == 'a{color:#aabbcc} b{color:#fff;border:#aabbcc}'
+    assert counts == {'#abc': 2, '#123456': 1}
+    assert replacer.count('a{color:#abc} b{color:#123456;border:#abc}') == counts
+    # Offsets of the new colors in the new content, with the old color they replaced
+    assert edits == [(8, '#abc'), (25, '#123456'), (37, '#abc')]
+    assert [new_content[offset:offset + len(replacer.mappings[old])] for offset, old in edits] == \
+        ['#aabbcc', '#fff', '#aabbcc']
+
+
+def test_trie_matches_the_longest_first_alternation():
+    rng = random.Random(0)
+    pieces = ['#', 'a', 'b', 'c', 'A', '1', 'rgb(', 'rgba(', '1, ', '2', ')', ' ', '-', ';', '@x', '\n']
+    mappings = {}
+    while len(mappings) < 60:
+        old = rng.choice(['#', 'rgb(', '@', 'rgba(']) + ''.join(rng.choice(pieces[1:10]) for _ in range(rng.randrange(1, 6)))
+        mappings[old] = f'<{len(mappings)}>'
+    replacer = ColorReplacer(mappings)
+    for _ in range(200):
+        content = ''.join(rng.choice(pieces) for _ in range(80))
+        assert replacer.replace(content)[0] == reference_replace(mappings, content)
+
+
+def test_no_mappings():
+    replacer = ColorReplacer({})
+    assert replacer.replace('#abc') == ('#abc', {})
+    assert replacer.count('#abc') == {}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 16, 1000])
+def test_stream_matches_whole_text_replace(monkeypatch, chunk_size):
+    # Colors crossing chunk boundaries, and boundaries right before a token character, have to give the same result
+    monkeypatch.setattr('replacer.CHUNK_BYTES', chunk_size)
+    rng = random.Random(chunk_size)
+    pieces = ['#abc', '#abcdef', '#ABC', 'rgb(1, 2, 3)', 'argb(1, 2, 3)', '#abc-x', 'a', '-', ';', ' ', '\r\n']
+    replacer = ColorReplacer({'#abc': '#0', '#abcdef': '#123456', 'rgb(1, 2, 3)': 'red', '#ABC': 'rgb(9, 9, 9)'})
+    for _ in range(30):
+        content = ''.join(rng.choice(pieces) for _ in range(60))
+        expected_edits = []
+        expected, expected_counts = replacer.replace(content, expected_edits)
+
+        written = []
+        edits = []
+        counts = replacer.replace_stream(io.StringIO(content, newline=''), written.append, edits)
+        assert ''.join(written) == expected
+        assert counts == expected_counts
+        assert edits == expected_edits
+        assert replacer.replace_stream(io.StringIO(content, newline='')) == expected_counts
+
+
+SVG = '<use href="#abc"/><use xlink:href=\'#abc\'/><g clip-path="url(#def)" fill="#abc" mask="url(\'#def\')"/>'
+
+
+def test_svg_id_references_are_left_alone():
+    replacer = ColorReplacer({'#abc': '#123', '#def': '#456'})
+    assert replacer.replace(SVG, svg=True) == (SVG.replace('fill="#abc"', 'fill="#123"'), {'#abc': 1})
+    assert replacer.count(SVG, svg=True) == {'#abc': 1}
+    assert replacer.count(SVG) == {'#abc': 3, '#def': 2}  # Other files have no such references
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1000])
+def test_stream_leaves_svg_id_references_alone(monkeypatch, chunk_size):
+    # The text before a reference may be in an earlier chunk than its '#'
+    monkeypatch.setattr('replacer.CHUNK_BYTES', chunk_size)
+    replacer = ColorReplacer({'#abc': '#123', '#def': '#456'})
+    written = []
+    counts = replacer.replace_stream(io.StringIO(SVG * 3), written.append, svg=True)
+    assert (''.join(written), counts) == replacer.replace(SVG * 3, svg=True)
+
+
+def test_svg_files_are_detected_by_extension(tmp_path):
+    replacer = ColorReplacer({'#abc': '#123', '#def': '#456'})
+    (tmp_path / 'icon.SVG').write_text(SVG)
+    (tmp_path / 'icon.html').write_text(SVG)
+    assert replacer.count_in_file(str(tmp_path / 'icon.SVG')) == {'#abc': 1}
+    assert replacer.count_in_file(str(tmp_path / 'icon.html')) == {'#abc': 3, '#def': 2}
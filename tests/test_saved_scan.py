@@ -0,0 +1,63 @@
+import os
+import pytest
+from discovery import discover_files
+from saved_scan import ScanFormatError, load_scan, save_scan
+from scan_index import scan_directory
+
+FILES = {
+    'defs.css': '@define-color accent #abc;\n$primary: #123456;\n',
+    'sub/uses.css': 'a { color: @accent; background: $primary; }\n/* é */ b { color: rgba(1, 2, 3, 0.5); }\n',
+    'icon.svg': '<svg><rect fill="#abc" stroke="hsl(120, 50%, 25%)"/></svg>\n',
+}
+
+
+@pytest.fixture
+def scanned(tmp_path):
+    directory = tmp_path / 'theme'
+    for name, content in FILES.items():
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_text(content)
+    manifest = discover_files(str(directory))
+    color_definitions, file_table = scan_directory(str(directory), manifest, use_index=False)
+    scan_path = tmp_path / 'theme.ccscan'
+    save_scan(str(scan_path), str(directory), ['.css', '.svg'], manifest, color_definitions, file_table)
+    return directory, scan_path, manifest, color_definitions, file_table
+
+
+def snapshot(color_definitions, file_table, directory):
+    return [(color_value, record.name, record.line, record.alternative, record.key, record.usage_count,
+             [(os.path.relpath(file_table.paths[file_id], directory), line, offset)
+              for file_id, line, offset in record.usage_sites()])
+            for color_value, record in color_definitions.items()]
+
+
+def test_round_trip(scanned):
+    directory, scan_path, manifest, color_definitions, file_table = scanned
+    saved = load_scan(str(scan_path))
+    assert saved.directory == str(directory)
+    assert saved.selected_filetypes == ['.css', '.svg']
+    assert saved.manifest == manifest
+    assert snapshot(saved.color_definitions, saved.file_table, directory) == \
+           snapshot(color_definitions, file_table, directory)
+
+
+def test_moved_checkout(scanned, tmp_path):
+    directory, scan_path, manifest, color_definitions, file_table = scanned
+    moved = tmp_path / 'elsewhere'
+    os.rename(directory, moved)
+    saved = load_scan(str(scan_path), str(moved))
+    assert [entry.path for entry in saved.manifest] == [entry.path.replace(str(directory), str(moved))
+                                                        for entry in manifest]
+    assert snapshot(saved.color_definitions, saved.file_table, moved) == \
+           snapshot(color_definitions, file_table, directory)
+
+
+def test_broken_files_are_refused(scanned, tmp_path):
+    _, scan_path, *_ = scanned
+    data = scan_path.read_bytes()
+    for name, content in (('other', b'not a scan'), ('truncated', data[:len(data) // 2]),
+                          ('newer', data[:8] + b'\xff\xff' + data[10:])):
+        path = tmp_path / name
+        path.write_bytes(content)
+        with pytest.raises(ScanFormatError):
+            load_scan(str(path))
@@ -0,0 +1,69 @@
+import os
+import pytest
+from discovery import discover_files
+from scan_index import ScanIndex, pack_result, scan_directory, unpack_result
+
+FILES = {
+    'defs.css': '@define-color accent #abc;\n$primary: #123456;\n',
+    'uses.css': 'a { color: @accent; background: $primary; }\n/* é */ b { color: rgba(1, 2, 3, 0.5); }\n',
+    'icon.svg': '<svg><use href="#def"/><rect fill="#abc"/></svg>\n',
+}
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    """A theme directory, with the default scan index under tmp_path."""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    directory = tmp_path / 'theme'
+    directory.mkdir()
+    for name, content in FILES.items():
+        (directory / name).write_text(content)
+    return directory
+
+
+def snapshot(color_definitions, file_table):
+    return [(color_value, record.name, record.line, record.alternative, record.key,
+             [(file_table.paths[file_id], line, offset) for file_id, line, offset in record.usage_sites()])
+            for color_value, record in color_definitions.items()]
+
+
+def test_results_round_trip():
+    result = ({1: '@define-color accent #abc;', 12: 'é'}, [(0, '#abc', '@accent', 1, 0), (1, '#fff', None, 12, 40)])
+    lines, events = unpack_result(pack_result(result))
+    assert lines == result[0]
+    assert [tuple(event) for event in events] == result[1]
+
+
+def test_unchanged_tree_reuses_the_resolved_scan(tree, monkeypatch):
+    manifest = discover_files(str(tree))
+    expected = snapshot(*scan_directory(str(tree), manifest, use_index=False))
+    assert snapshot(*scan_directory(str(tree), manifest)) == expected
+
+    def merge_results(*args):
+        raise AssertionError('the files are merged again')
+
+    monkeypatch.setattr('scan_index.merge_results', merge_results)
+    assert snapshot(*scan_directory(str(tree), manifest)) == expected
+
+
+def test_changed_file_is_merged_again(tree):
+    scan_directory(str(tree), discover_files(str(tree)))
+    (tree / 'defs.css').write_text('@define-color accent #fed;\n$primary: #123456;\n')
+    os.utime(tree / 'defs.css', ns=(0, 0))  # A new mtime even on coarse clocks
+    manifest = discover_files(str(tree))
+    assert snapshot(*scan_directory(str(tree), manifest)) == snapshot(*scan_directory(str(tree), manifest,
+                                                                                       use_index=False))
+
+
+def test_touched_files_are_matched_by_digest(tree, tmp_path):
+    manifest = discover_files(str(tree))
+    scan_index = ScanIndex(str(tmp_path / 'index.sqlite3'), use_hash=True)
+    try:
+        resolved = snapshot(*scan_index.scan(str(tree), manifest))
+        os.utime(tree / 'uses.css', ns=(0, 0))
+        touched = discover_files(str(tree))
+        assert scan_index.load_resolved(str(tree), touched) is None  # Not hashed yet
+        assert snapshot(*scan_index.scan(str(tree), touched)) == resolved
+        assert snapshot(*scan_index.load_resolved(str(tree), touched)) == resolved
+    finally:
+        scan_index.close()
@@ -0,0 +1,124 @@
+import io
+import random
+import pytest
+from records import FileTable
+from scanner import ColorResolver, scan_buffer, scan_stream, scan_svg, scan_svg_stream, scan_text
+
+SNIPPETS = [
+    '@define-color accent #abc;\n',
+    '@define-color accent_alias @accent;\n',
+    'a { color: @accent; background: rgba(1, 2, 3, 0.5); }\n',
+    '$primary: #123456;\n',
+    '$link: $primary;\n',
+    'b { border-color: $link; fill: hsl(120deg, 50%, 25%); }\n',
+    '/* #fff in a short comment */\n',
+    '/* a long comment ' + 'with #000 inside, ' * 12 + '*/\n',
+    'c { color: #ABCDEF; outline: rgb( 10, 20, 30 ); }\n',
+    '\n',
+]
+
+
+def theme(seed, count=400):
+    rng = random.Random(seed)
+    return ''.join(rng.choice(SNIPPETS) for _ in range(count)).encode('latin-1')
+
+
+def stream(data, is_svg, chunk_size, head_size=16):
+    file_obj = io.BytesIO(data)
+    return scan_stream(file_obj, file_obj.read(head_size), is_svg, chunk_size)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 333, 4096])
+@pytest.mark.parametrize('seed', range(3))
+def test_stream_matches_buffer_scan(monkeypatch, chunk_size, seed):
+    # A small overlap makes tokens and comments cross chunk boundaries often
+    monkeypatch.setattr('scanner.STREAM_OVERLAP', 80)
+    data = theme(seed)
+    expected = scan_buffer(data.decode('latin-1'), False)
+    result, size = stream(data, False, chunk_size)
+    assert size == len(data)
+    assert result == expected
+
+
+def test_stream_matches_buffer_scan_of_svg_colors(monkeypatch):
+    monkeypatch.setattr('scanner.STREAM_OVERLAP', 80)
+    data = ('<svg>\n<!-- #fff -->\n' + '<rect fill="#abc" stroke="rgb(1, 2, 3)"/>\n' * 50 + '</svg>\n').encode()
+    assert stream(data, True, 13)[0] == scan_buffer(data.decode('latin-1'), True)
+
+
+SVG_ELEMENTS = [
+    '<rect fill="#abc" stroke="rgb(1, 2, 3)"/>',
+    '<use href="#def"/>',
+    '<g style="fill: #123456; stroke: url(#aaa)"><circle fill="hsl(120, 50%, 25%)"/></g>',
+    '<style>\na { color: #fff; }\n@define-color accent #010203;\n</style>',
+    '<!-- #999 -->',
+    '\n',
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 4096])
+@pytest.mark.parametrize('seed', range(3))
+def test_svg_stream_matches_svg_scan(monkeypatch, chunk_size, seed):
+    # Large SVGs are parsed with expat as well, ids in href and url() are not taken for colors
+    monkeypatch.setattr('scanner.STREAM_OVERLAP', 1000)
+    rng = random.Random(seed)
+    data = ('<svg>\n' + ''.join(rng.choice(SVG_ELEMENTS) for _ in range(300)) + '\n</svg>\n').encode()
+    expected = scan_svg(data.decode('latin-1'))
+    assert '#def' not in {event[1] for event in expected[1]}
+    file_obj = io.BytesIO(data)
+    assert scan_svg_stream(file_obj, file_obj.read(16), chunk_size) == (expected, len(data))
+
+    # Line texts longer than the overlap are cut, the events stay the same
+    monkeypatch.setattr('scanner.STREAM_OVERLAP', 40)
+    file_obj = io.BytesIO(data)
+    assert scan_svg_stream(file_obj, file_obj.read(16), chunk_size)[0][1] == expected[1]
+
+
+def test_svg_stream_falls_back_to_text_like_svg_scan(monkeypatch):
+    monkeypatch.setattr('scanner.STREAM_OVERLAP', 80)
+    data = ('<svg>\n' + '<rect fill="#abc"/><use href="#def"/>\n' * 50 + '</g>\n').encode()  # Not well-formed
+    file_obj = io.BytesIO(data)
+    assert scan_svg_stream(file_obj, file_obj.read(16), 13) == (scan_svg(data.decode('latin-1')), len(data))
+
+
+def resolve(files):
+    """Merge scan_text results of (name, text) pairs in order, returns the color definitions and file table."""
+    resolver = ColorResolver()
+    file_table = FileTable()
+    for name, text in files:
+        resolver.merge(scan_text(text), file_table.intern(name))
+    return resolver.finish(), file_table
+
+
+def usage(color_definitions, file_table):
+    return {color_value: (record.usage_count,
+                          [(file_table.paths[file_id], line) for file_id, line, _ in record.usage_sites()])
+            for color_value, record in color_definitions.items()}
+
+
+DEFINITIONS = ('defs.css', '@define-color accent #abc;\n$primary: #123456;\n@define-color alias @accent;\n')
+USES = ('uses.css', 'a { color: @accent; }\nb { color: $primary; border: @alias; background: #abc; }\n')
+
+
+def test_forward_references_are_counted():
+    # uses.css comes first in traversal order, before any of the variables it refers to is defined
+    color_definitions, file_table = resolve([USES, DEFINITIONS])
+    assert usage(color_definitions, file_table) == {
+        '#abc': (5, [('uses.css', 1), ('uses.css', 2), ('uses.css', 2), ('defs.css', 1), ('defs.css', 3)]),
+        '#123456': (2, [('uses.css', 2), ('defs.css', 2)]),
+    }
+
+
+def test_usage_does_not_depend_on_file_order():
+    forward = usage(*resolve([USES, DEFINITIONS]))
+    backward = usage(*resolve([DEFINITIONS, USES]))
+    assert {color_value: count for color_value, (count, _) in forward.items()} == \
+           {color_value: count for color_value, (count, _) in backward.items()}
+    for color_value, (_, sites) in forward.items():
+        assert sorted(sites) == sorted(backward[color_value][1])
+
+
+def test_undefined_and_cyclic_variables_are_not_counted():
+    color_definitions, _ = resolve([('a.css', 'a { color: @missing; }\n@define-color x @y;\n@define-color y @x;\n'
+                                             'b { color: @x; }\n')])
+    assert color_definitions == {}
@@ -0,0 +1,60 @@
+import json
+import numpy as np
+import pytest
+from transforms import CHAIN_VERSION, apply_chain, generate_mappings, load_chain, save_chain
+from utils import is_valid_color
+
+
+def mappings(chain, *values):
+    return generate_mappings(dict.fromkeys(values), chain)
+
+
+def test_hue_rotation_keeps_alpha_and_skips_variables():
+    assert mappings([{'op': 'hue_rotate', 'degrees': 120}], '#f00', 'rgba(255, 0, 0, 0.5)', '@accent', '#808080') == {
+        '#f00': '#00FF00', 'rgba(255, 0, 0, 0.5)': 'rgba(0, 255, 0, 0.5)'}  # Grays have no hue to rotate
+
+
+def test_invert_lightness():
+    assert mappings([{'op': 'invert_lightness'}], '#fff', '#123', '#f00') == {'#fff': '#000000', '#123': '#CCDDEE'}
+
+
+def test_chains_run_in_order():
+    chain = [{'op': 'lighten', 'amount': 30}, {'op': 'invert_lightness'}]
+    assert mappings(chain, '#800') == {'#800': '#DD0000'}
+    assert mappings(chain[::-1], '#800') == {'#800': '#FFFFFF'}  # Lightness is clamped
+
+
+def test_identity_transforms_change_nothing():
+    rgb = np.array([[0, 0, 0], [128, 64, 32], [255, 255, 255]], np.uint8)
+    assert (apply_chain([{'op': 'gamma', 'value': 1}, {'op': 'saturate', 'amount': 0}], rgb) == rgb).all()
+    assert mappings([{'op': 'hue_rotate', 'degrees': 360}], '#123456', '#abc') == {}
+
+
+def test_nearest_palette_color():
+    chain = [{'op': 'palette', 'colors': ['#ff0000', '#000', 'not a color']}]
+    assert mappings(chain, '#f00', '#fff', '#fe0101', '#200') == {'#fff': '#000000', '#fe0101': '#FF0000',
+                                                                  '#200': '#000000'}
+    with pytest.raises(ValueError):
+        mappings([{'op': 'palette', 'colors': ['not a color']}], '#fff')
+
+
+def test_new_colors_are_valid_entries():
+    values = ['#abc', '#abcd', 'rgb(1, 2, 3)', 'rgba(10, 20, 30, 0.25)', 'hsl(200, 50%, 40%)']
+    for new_color in mappings([{'op': 'hue_rotate', 'degrees': 45}, {'op': 'gamma', 'value': 1.5}], *values).values():
+        assert is_valid_color(new_color)
+
+
+@pytest.mark.parametrize('chain', [[{'op': 'blur'}], [{'op': 'lighten'}], [{}]])
+def test_invalid_steps_are_refused(chain):
+    with pytest.raises(ValueError):
+        apply_chain(chain, np.zeros((1, 3), np.uint8))
+
+
+def test_chain_round_trip(tmp_path):
+    chain = [{'op': 'hue_rotate', 'degrees': 30}, {'op': 'palette', 'colors': ['#000', '#fff']}]
+    save_chain(chain, str(tmp_path / 'chain.json'))
+    assert load_chain(str(tmp_path / 'chain.json')) == chain
+
+    (tmp_path / 'newer.json').write_text(json.dumps({'version': CHAIN_VERSION + 1, 'steps': chain}))
+    with pytest.raises(ValueError):
+        load_chain(str(tmp_path / 'newer.json'))